@@ -0,0 +1,124 @@
+"""
+Compare the step time and peak memory of the eager and compiled (compile=True) log-partition computation
+for the discriminative estimators on CPU.
+
+Usage: python scripts/benchmark_log_partition.py --batch_size 1024 --n_steps 20
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+from torch_mist.estimators import instantiate_estimator
+
+# Separable critics are used so that the cost of the step is dominated by the computation of the log-partition
+ESTIMATORS = [
+    "nwj",
+    "tuba",
+    "alpha_tuba",
+    "mine",
+    "js",
+    "smile",
+    "infonce",
+    "flo",
+]
+
+
+def _peak_memory(prof: profile) -> int:
+    # Peak of the running sum of the CPU memory allocated (and released) by each operation, as recorded by the
+    # profiler. Temporaries allocated and released inside the same operation are not counted.
+    events = sorted(
+        prof.profiler.function_events, key=lambda event: event.time_range.start
+    )
+    current, peak = 0, 0
+    for event in events:
+        current += event.self_cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+def _step(
+    estimator: torch.nn.Module, x: torch.Tensor, y: torch.Tensor
+) -> None:
+    with estimator.step_cache():
+        estimator.loss(x, y).backward()
+    estimator.zero_grad()
+
+
+def benchmark(
+    estimator_name: str,
+    x: torch.Tensor,
+    y: torch.Tensor,
+    hidden_dims: List[int],
+    n_steps: int,
+    compile: bool,
+) -> Tuple[float, int]:
+    torch.manual_seed(0)
+    estimator = instantiate_estimator(
+        estimator_name=estimator_name,
+        x_dim=x.shape[-1],
+        y_dim=y.shape[-1],
+        hidden_dims=hidden_dims,
+        neg_samples=0,
+        critic_type="separable",
+        compile=compile,
+    )
+
+    # Warm-up (and compilation)
+    for _ in range(3):
+        _step(estimator, x, y)
+
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        _step(estimator, x, y)
+    step_time = (time.perf_counter() - start) / n_steps
+
+    with profile(
+        activities=[ProfilerActivity.CPU], profile_memory=True
+    ) as prof:
+        _step(estimator, x, y)
+
+    return step_time, _peak_memory(prof)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=1024)
+    parser.add_argument("--dim", type=int, default=8)
+    parser.add_argument("--hidden_dims", type=int, nargs="+", default=[64])
+    parser.add_argument("--n_steps", type=int, default=20)
+    args = parser.parse_args()
+
+    x = torch.randn(args.batch_size, args.dim)
+    y = x + torch.randn(args.batch_size, args.dim)
+
+    print(
+        f"{'estimator':<12}{'eager [ms]':>12}{'compiled [ms]':>15}"
+        f"{'eager [MB]':>12}{'compiled [MB]':>15}"
+    )
+    for estimator_name in ESTIMATORS:
+        results = []
+        for compile in [False, True]:
+            # Start from an empty compilation cache for each estimator
+            torch._dynamo.reset()
+            results.append(
+                benchmark(
+                    estimator_name=estimator_name,
+                    x=x,
+                    y=y,
+                    hidden_dims=args.hidden_dims,
+                    n_steps=args.n_steps,
+                    compile=compile,
+                )
+            )
+        (eager_time, eager_mem), (compiled_time, compiled_mem) = results
+        print(
+            f"{estimator_name:<12}{eager_time * 1e3:>12.2f}{compiled_time * 1e3:>15.2f}"
+            f"{eager_mem / 2 ** 20:>12.1f}{compiled_mem / 2 ** 20:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
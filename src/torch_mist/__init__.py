@@ -2,4 +2,8 @@
 from importlib.metadata import version
 
 __version__ = version("torch_mist")
-from .utils.estimation import estimate_mi, k_fold_mi_estimate
+from .utils.estimation import (
+    estimate_mi,
+    k_fold_mi_estimate,
+    estimate_mi_ensemble,
+)
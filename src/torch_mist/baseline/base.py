@@ -29,6 +29,9 @@ class ConstantBaseline(Baseline):
 
 
 class ExponentialMovingAverage(Baseline):
+    # Version 2 stores the moving average in the state dict
+    _version = 2
+
     def __init__(self, gamma: float = 0.9):
         super(ExponentialMovingAverage, self).__init__()
         self.ema = None
@@ -59,6 +62,41 @@ class ExponentialMovingAverage(Baseline):
         ma = ma.expand_as(f_[0])
         return ma
 
+    # The moving average is stored in the state dict (it is None before the first update)
+    def get_extra_state(self) -> dict:
+        return {"ema": self.ema}
+
+    def set_extra_state(self, state: dict):
+        self.ema = state["ema"]
+
+    def _load_from_state_dict(
+        self,
+        state_dict,
+        prefix,
+        local_metadata,
+        strict,
+        missing_keys,
+        unexpected_keys,
+        error_msgs,
+    ):
+        # State dicts saved by previous versions do not contain the moving average
+        version = local_metadata.get("version", None)
+        extra_state_key = prefix + "_extra_state"
+        if (version is None or version < 2) and not (
+            extra_state_key in state_dict
+        ):
+            state_dict[extra_state_key] = {"ema": None}
+
+        super()._load_from_state_dict(
+            state_dict,
+            prefix,
+            local_metadata,
+            strict,
+            missing_keys,
+            unexpected_keys,
+            error_msgs,
+        )
+
 
 class BatchLogMeanExp(Baseline):
     def __init__(self, dims: str):
@@ -75,8 +113,9 @@ class BatchLogMeanExp(Baseline):
         if self.dims == "all":
             f_ = f_.reshape(-1)
 
+        # The logsumexp is computed in float32 in mixed precision regions
         M = f_.shape[0]
-        b = torch.logsumexp(f_, 0) - math.log(M)
+        b = torch.logsumexp(f_.float(), 0) - math.log(M)
 
         if self.dims == "all":
             for _ in range(x.ndim - 1):
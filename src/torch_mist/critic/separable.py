@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from typing import Optional
 
 import torch
@@ -5,6 +6,7 @@ import torch
 from torch import nn
 
 from .base import Critic
+from torch_mist.utils.caching import cached_method
 from torch_mist.utils.shape import expand_to_same_shape
 
 
@@ -27,14 +29,59 @@ class SeparableCritic(Critic):
         self.f_x = (lambda x: x) if f_x is None else f_x
         self.f_y = (lambda y: y) if f_y is None else f_y
         self.temperature = temperature
+        self._precomputed_embeddings = False
+
+    @contextmanager
+    def precomputed_embeddings(self):
+        """
+        Within this context the inputs of the critic are interpreted as the embeddings f_x(x) and f_y(y).
+        """
+        self._precomputed_embeddings = True
+        try:
+            yield
+        finally:
+            self._precomputed_embeddings = False
+
+    @cached_method
+    def embed_x(self, x: torch.Tensor) -> torch.Tensor:
+        if self._precomputed_embeddings:
+            return x
+        return self.f_x(x)
+
+    @cached_method
+    def embed_y(self, y: torch.Tensor) -> torch.Tensor:
+        if self._precomputed_embeddings:
+            return y
+        return self.f_y(y)
+
+    def score_matrix(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        """
+        Compute the value of the critic for all the pairs (x_j, y_i) with one matrix product
+        :param x: a tensor with shape [N, X_DIM]
+        :param y: a tensor with shape [M, Y_DIM]
+        :return: a tensor of shape [M, N] containing f(x_j, y_i) at position (i, j)
+        """
+        return self.score_embeddings(x, self.embed_y(y))
+
+    def score_embeddings(
+        self, x: torch.Tensor, f_y: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Compute the value of the critic for all the pairs (x_j, y_i) given the embeddings f_y(y_i)
+        :param x: a tensor with shape [N, X_DIM]
+        :param f_y: a tensor with shape [M, D]
+        :return: a tensor of shape [M, N] containing f(x_j, y_i) at position (i, j)
+        """
+        f_x = self.embed_x(x)
+        return f_y @ f_x.T / self.temperature
 
     def forward(
         self,
         x: torch.Tensor,
         y: torch.Tensor,
     ) -> torch.Tensor:
-        f_x = self.f_x(x)
-        f_y = self.f_y(y)
+        f_x = self.embed_x(x)
+        f_y = self.embed_y(y)
 
         f_x, f_y = expand_to_same_shape(f_x, f_y)
 
@@ -1,4 +1,6 @@
-from typing import List, Dict
+import json
+import os
+from typing import List, Dict, Optional
 
 import numpy as np
 import torch
@@ -13,11 +15,152 @@ from torch.distributions import (
 from torch_mist.distributions.joint.base import JointDistribution
 from torch_mist.distributions.joint.wrapper import TorchJointDistribution
 
+# Estimates of one dimension of the distribution, indexed by (rho, sigma, epsilon, delta)
+_ESTIMATES = {}
+
+
+def _default_cache_dir() -> str:
+    return os.environ.get(
+        "TORCH_MIST_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "torch_mist"),
+    )
+
+
+def _log_normal_mixture(
+    points: np.ndarray, mu: np.ndarray, precision: np.ndarray, log_det: float
+) -> np.ndarray:
+    # Log-density of the uniform mixture of gaussians with means mu [K, D] and a shared covariance at points [..., D]
+    diff = points[..., None, :] - mu
+    log_probs = (
+        -0.5 * np.einsum("...ki,ij,...kj->...k", diff, precision, diff)
+        - 0.5 * (mu.shape[-1] * np.log(2 * np.pi) + log_det)
+        - np.log(len(mu))
+    )
+    max_log_prob = log_probs.max(-1)
+    return max_log_prob + np.log(
+        np.exp(log_probs - max_log_prob[..., None]).sum(-1)
+    )
+
+
+def _mixture_entropy(
+    mu: np.ndarray, covariance: np.ndarray, n_nodes: int
+) -> float:
+    # Gauss-Hermite quadrature of -E[log p] for each component of the mixture (one rule for each dimension)
+    nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    weights = weights / weights.sum()
+    n_dims = mu.shape[-1]
+
+    grid = np.stack(
+        np.meshgrid(*([nodes] * n_dims), indexing="ij"), -1
+    ).reshape(-1, n_dims)
+    grid_weights = np.prod(
+        np.stack(np.meshgrid(*([weights] * n_dims), indexing="ij"), -1),
+        -1,
+    ).reshape(-1)
+
+    # Nodes for each component [K, n_nodes**D, D]
+    points = mu[:, None] + grid @ np.linalg.cholesky(covariance).T
+    log_p = _log_normal_mixture(
+        points,
+        mu,
+        np.linalg.inv(covariance),
+        np.linalg.slogdet(covariance)[1],
+    )
+    return -float((log_p @ grid_weights).mean())
+
+
+def compute_mixture_estimates(
+    rho: float,
+    sigma: float,
+    epsilon: float,
+    delta: float,
+    n_nodes: int = 64,
+) -> Dict[str, float]:
+    """
+    Compute the entropies and the mutual information for one dimension of MultivariateCorrelatedNormalMixture
+    with Gauss-Hermite quadrature (the distribution factorizes over the dimensions).
+    """
+    mu = np.array(
+        [
+            [epsilon + delta, -epsilon + delta],
+            [-epsilon - delta, epsilon - delta],
+            [epsilon - delta, -epsilon - delta],
+            [-epsilon + delta, epsilon + delta],
+        ]
+    )
+    covariance = np.array([[1.0, rho], [rho, 1.0]]) * sigma
+
+    estimates = {
+        "H(x)": _mixture_entropy(mu[:, :1], covariance[:1, :1], n_nodes),
+        "H(y)": _mixture_entropy(mu[:, 1:], covariance[1:, 1:], n_nodes),
+        "H(xy)": _mixture_entropy(mu, covariance, n_nodes),
+    }
+    estimates["I(x;y)"] = (
+        estimates["H(x)"] + estimates["H(y)"] - estimates["H(xy)"]
+    )
+    return estimates
+
+
+def _load_cached_estimates(cache_file: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.isfile(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        print(f"[Warning]: Ignoring the invalid cache file {cache_file}")
+        return {}
+
+
+def get_mixture_estimates(
+    rho: float,
+    sigma: float,
+    epsilon: float,
+    delta: float,
+    cache_dir: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Entropies and mutual information for one dimension of MultivariateCorrelatedNormalMixture.
+    The values are computed once and stored in memory and in cache_dir/multimixture.json.
+    :param cache_dir: the directory of the cache on disk. By default, the TORCH_MIST_CACHE environment variable or
+        ~/.cache/torch_mist. Use False to disable the cache on disk.
+    """
+    key = (float(rho), float(sigma), float(epsilon), float(delta))
+    if key in _ESTIMATES:
+        return _ESTIMATES[key]
+
+    if cache_dir is None:
+        cache_dir = _default_cache_dir()
+
+    str_key = json.dumps(key)
+    cache_file = None
+    if not (cache_dir is False):
+        cache_file = os.path.join(cache_dir, "multimixture.json")
+        cached = _load_cached_estimates(cache_file)
+        if str_key in cached:
+            _ESTIMATES[key] = cached[str_key]
+            return _ESTIMATES[key]
+
+    estimates = compute_mixture_estimates(*key)
+    _ESTIMATES[key] = estimates
+
+    if not (cache_file is None):
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Re-read the cache to keep the entries written in the meanwhile, and replace the file atomically
+            cached = _load_cached_estimates(cache_file)
+            cached[str_key] = estimates
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as file:
+                json.dump(cached, file, indent=1)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print(f"[Warning]: Could not write the cache in {cache_dir}: {e}")
+
+    return estimates
 
-class MultivariateCorrelatedNormalMixture(TorchJointDistribution):
-    MC_SAMPLES = 100000
-    MC_ITERATIONS = 100
 
+class MultivariateCorrelatedNormalMixture(TorchJointDistribution):
     def __init__(
         self,
         rho: float = 0.95,
@@ -25,12 +168,14 @@ class MultivariateCorrelatedNormalMixture(TorchJointDistribution):
         epsilon: float = 0.15,
         delta: float = 1.5,
         n_dim: int = 5,
+        cache_dir: Optional[str] = None,
     ):
         self.n_dim = n_dim
         self.rho = rho
         self.sigma = sigma
         self.epsilon = epsilon
         self.delta = delta
+        self.cache_dir = cache_dir
 
         covariance = torch.eye(2)
         covariance[0, 1] = covariance[1, 0] = rho
@@ -70,8 +215,6 @@ class MultivariateCorrelatedNormalMixture(TorchJointDistribution):
             1,
         )
 
-        self._cached_estimates = {}
-
         super().__init__(torch_dist=p_XY, variables=["x", "y"])
 
     def _marginal(self, variables: List[str]) -> JointDistribution:
@@ -83,63 +226,25 @@ class MultivariateCorrelatedNormalMixture(TorchJointDistribution):
             variables=[variable],
         )
 
-    def _approximate_estimates(self):
-        if self.n_dim > 1:
-            p_XY = MultivariateCorrelatedNormalMixture(
-                n_dim=1,
-                rho=self.rho,
-                delta=self.delta,
-                sigma=self.sigma,
-                epsilon=self.epsilon,
-            )
-        else:
-            p_XY = self
-
-        estimates = {
-            "H(x)": [],
-            "H(y)": [],
-            "H(xy)": [],
-            "I(x;y)": [],
-        }
-
-        p_X = p_XY.marginal("x")
-        p_Y = p_XY.marginal("y")
-
-        for i in range(self.MC_ITERATIONS):
-            # Sample from the joint
-            samples = p_XY.sample([self.MC_SAMPLES])
-
-            # Compute the log-probability of each sample pair
-            log_p_xy = p_XY.log_prob(**samples)
-
-            # And the marginal log-probability
-            log_p_x = p_X.log_prob(samples["x"])
-            log_p_y = p_Y.log_prob(samples["y"])
-
-            # MC estimation of the joint and marginal entropies
-            entropy_xy = -torch.mean(log_p_xy)
-            entropy_x = -torch.mean(log_p_x)
-            entropy_y = -torch.mean(log_p_y)
-
-            estimates["H(x)"].append(entropy_x)
-            estimates["H(x)"].append(entropy_y)
-            estimates["H(xy)"].append(entropy_xy)
-            estimates["I(x;y)"].append(entropy_x + entropy_y - entropy_xy)
-
-        for name, values in estimates.items():
-            self._cached_estimates[name] = np.mean(values) * self.n_dim
+    def _estimates(self) -> Dict[str, float]:
+        # The distribution factorizes over the dimensions
+        estimates = get_mixture_estimates(
+            rho=self.rho,
+            sigma=self.sigma,
+            epsilon=self.epsilon,
+            delta=self.delta,
+            cache_dir=self.cache_dir,
+        )
+        return {name: value * self.n_dim for name, value in estimates.items()}
 
     def _entropy(self, variables: List[str]) -> torch.Tensor:
-        if len(self._cached_estimates) == 0:
-            self._approximate_estimates()
         if len(variables) == 2:
-            return self._cached_estimates["H(xy)"]
-
-        return self._cached_estimates["H(x)"]
+            name = "H(xy)"
+        else:
+            name = f"H({variables[0]})"
+        return torch.tensor(self._estimates()[name])
 
     def _mutual_information(
         self, variable_1: str, variable_2: str
     ) -> torch.Tensor:
-        if len(self._cached_estimates) == 0:
-            self._approximate_estimates()
-        return self._cached_estimates["I(x;y)"]
+        return torch.tensor(self._estimates()["I(x;y)"])
@@ -8,3 +8,4 @@ from .normal import (
 )
 from .categorical import CategoricalModule, ConditionalCategoricalModule
 from .empirical import EmpiricalDistribution
+from .memory_bank import MemoryBank
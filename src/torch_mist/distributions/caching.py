@@ -8,6 +8,7 @@ from pyro.distributions import (
 )
 
 from torch_mist.utils.caching import cached_method
+from torch_mist.utils.precision import full_precision
 
 
 class CachedTransformModule(TransformModule):
@@ -18,15 +19,19 @@ class CachedTransformModule(TransformModule):
         self.codomain = transform.codomain
         self.bijective = transform.bijective
 
+    # Flows (and their log-determinants) are computed in float32 in mixed precision regions
     @cached_method
+    @full_precision
     def _call(self, x):
         return self._transform._call(x)
 
     @cached_method
+    @full_precision
     def _inverse(self, y):
         return self._transform._inverse(y)
 
     @cached_method
+    @full_precision
     def log_abs_det_jacobian(self, x, y):
         return self._transform.log_abs_det_jacobian(x, y)
 
@@ -39,7 +44,9 @@ class CachedConditionalTransformModule(ConditionalTransformModule):
         super().__init__()
         self._conditional_transform = conditional_transform
 
+    # The parameters of the conditional flow are computed in float32 in mixed precision regions
     @cached_method
+    @full_precision
     def condition(self, context):
         return CachedTransformModule(
             self._conditional_transform.condition(context)
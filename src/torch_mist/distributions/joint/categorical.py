@@ -28,7 +28,8 @@ class JointCategorical(JointDistribution):
 
     @property
     def categorical(self) -> Categorical:
-        return Categorical(logits=self.logits / self.temperature)
+        # Normalize in float32 also when the logits are in half precision
+        return Categorical(logits=self.logits.float() / self.temperature)
 
     def _tensor_to_dict(
         self, tensor: torch.LongTensor
@@ -82,7 +83,8 @@ class JointCategorical(JointDistribution):
                 dims_to_remove.append(i)
 
         new_logits = torch.logsumexp(
-            self.logits.view(*self.bins) / self.temperature, dim=dims_to_remove
+            self.logits.float().view(*self.bins) / self.temperature,
+            dim=dims_to_remove,
         ).view(-1)
 
         return JointCategorical(
@@ -0,0 +1,184 @@
+from copy import deepcopy
+from typing import Optional
+
+import torch
+from torch import nn
+from torch.distributions import Distribution
+
+
+class MemoryBank(Distribution, nn.Module):
+    def __init__(
+        self,
+        capacity: int,
+        encoder: Optional[nn.Module] = None,
+        momentum: Optional[float] = None,
+    ):
+        """
+        Proposal distribution that stores the (detached) samples of the previous batches in a fixed-capacity
+        ring buffer. The negatives are sampled from the stored samples, or consist of the samples in the current batch
+        followed by all the stored ones (see sample and sample_all).
+        :param capacity: the maximum number of stored samples.
+        :param encoder: an optional encoder applied to the samples before storing them (e.g. the f_y projection of a
+            SeparableCritic). When specified, the bank stores embeddings and the negatives are returned embedded.
+        :param momentum: if specified, the stored embeddings are computed with a copy of the encoder whose parameters
+            are an exponential moving average of the encoder parameters with the given momentum.
+        """
+        nn.Module.__init__(self)
+        Distribution.__init__(self, validate_args=False)
+
+        if capacity < 1:
+            raise ValueError(
+                "The capacity of the memory bank must be positive."
+            )
+        if not (momentum is None):
+            if encoder is None:
+                raise ValueError(
+                    "A momentum can be used only with an encoder."
+                )
+            if not 0 <= momentum <= 1:
+                raise ValueError("The momentum must be between 0 and 1.")
+
+        self.capacity = capacity
+        self.encoder = encoder
+        self.momentum = momentum
+
+        if momentum is None:
+            self.momentum_encoder = None
+        else:
+            self.momentum_encoder = deepcopy(encoder)
+            for param in self.momentum_encoder.parameters():
+                param.requires_grad = False
+
+        # The memory is allocated on the first update, and stored in the state dict with get_extra_state
+        self.register_buffer("_memory", None, persistent=False)
+        self._pointer = 0
+        self._n_stored = 0
+        self._samples = None
+        self._embeddings = None
+        self.n_negatives = 0
+
+    @property
+    def embedded(self) -> bool:
+        return not (self.encoder is None)
+
+    def add_samples(
+        self, samples: torch.Tensor, embeddings: Optional[torch.Tensor] = None
+    ):
+        """
+        :param samples: the samples in the current batch.
+        :param embeddings: for memory banks storing embeddings, the (already computed) embeddings of the samples.
+            If not specified, they are computed with the encoder.
+        """
+        self._samples = samples
+        self._embeddings = embeddings
+
+    def _stored(self) -> torch.Tensor:
+        return self._memory[: self._n_stored]
+
+    def _current(self) -> torch.Tensor:
+        if not self.embedded:
+            return self._samples
+        if self._embeddings is None:
+            self._embeddings = self.encoder(self._samples)
+        return self._embeddings
+
+    def sample(self, sample_shape: torch.Size = torch.Size()) -> torch.Tensor:
+        """
+        Sample uniformly (without replacement) from the stored samples. The samples are shared across the batch,
+        with shape [M, 1, ...].
+        """
+        assert len(sample_shape) == 1
+        n_samples = sample_shape[0]
+        assert 0 < n_samples <= self._n_stored
+
+        negatives = self._stored()
+        if n_samples < self._n_stored:
+            ids = torch.randperm(self._n_stored, device=negatives.device)
+            negatives = negatives[ids[:n_samples]]
+        self.n_negatives = n_samples
+        return negatives.unsqueeze(1)
+
+    def sample_all(self) -> torch.Tensor:
+        """
+        Return the samples in the current batch followed by all the stored ones, with shape [N + S, 1, ...].
+        """
+        negatives = self._current()
+        if self._n_stored > 0:
+            negatives = torch.cat([negatives, self._stored()], 0)
+        self.n_negatives = negatives.shape[0]
+        return negatives.unsqueeze(1)
+
+    @torch.no_grad()
+    def _update_momentum_encoder(self):
+        for param, momentum_param in zip(
+            self.encoder.parameters(), self.momentum_encoder.parameters()
+        ):
+            momentum_param.mul_(self.momentum).add_(
+                param.detach(), alpha=1 - self.momentum
+            )
+
+    @torch.no_grad()
+    def _enqueue(self, samples: torch.Tensor):
+        if self.embedded:
+            if self.momentum_encoder is None:
+                samples = self._current()
+            else:
+                self._update_momentum_encoder()
+                samples = self.momentum_encoder(samples)
+        samples = samples.detach()
+
+        # Allocate the memory on the first update
+        if self._memory is None:
+            self._memory = torch.zeros(
+                self.capacity,
+                *samples.shape[1:],
+                dtype=samples.dtype,
+                device=samples.device,
+            )
+
+        # Keep only the most recent samples if the batch is larger than the memory
+        samples = samples[-self.capacity :]
+        n = samples.shape[0]
+        ids = (
+            torch.arange(n, device=self._memory.device) + self._pointer
+        ) % self.capacity
+        self._memory[ids] = samples.to(self._memory.device)
+        self._pointer = (self._pointer + n) % self.capacity
+        self._n_stored = min(self._n_stored + n, self.capacity)
+
+    def update(self, store: bool = True):
+        # Store the current samples (if required) and clear them
+        if store and not (self._samples is None):
+            self._enqueue(self._samples)
+        self._samples = None
+        self._embeddings = None
+
+    def reset(self):
+        self._memory = None
+        self._pointer = 0
+        self._n_stored = 0
+        self._samples = None
+        self._embeddings = None
+
+    def get_extra_state(self) -> dict:
+        return {
+            "memory": self._memory,
+            "pointer": self._pointer,
+            "n_stored": self._n_stored,
+        }
+
+    def set_extra_state(self, state: dict):
+        self._memory = state["memory"]
+        self._pointer = state["pointer"]
+        self._n_stored = state["n_stored"]
+
+    def __len__(self) -> int:
+        return self._n_stored
+
+    def __repr__(self):
+        s = f"{self.__class__.__name__}(capacity={self.capacity}, n_stored={self._n_stored}"
+        if self.embedded:
+            s += f", encoder={self.encoder}"
+        if not (self.momentum is None):
+            s += f", momentum={self.momentum}"
+        return s + ")"
@@ -109,5 +109,6 @@ class LogitsMap(ParameterMap):
     n_parameters: int = 1
 
     def map_parameters(self, parameter_list: List[torch.Tensor]) -> Dict[str, torch.Tensor]:
-        logits = parameter_list[0]
+        # Half precision logits (e.g. computed under autocast) are normalized in float32
+        logits = parameter_list[0].float()
         return {"logits": logits}
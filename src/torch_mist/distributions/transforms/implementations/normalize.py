@@ -11,12 +11,18 @@ class EMANormalize(Linear):
         gamma: float = 0.99,
         normalize_inverse=True,
     ):
-        super().__init__(input_dim=input_dim, epsilon=epsilon)
+        super().__init__(
+            input_dim=input_dim, loc=0.0, scale=1.0, epsilon=epsilon
+        )
+
+        # The running statistics are buffers so that they are stored in the state dict
+        self.register_buffer("log_scale", torch.zeros(input_dim))
 
         assert 0 <= gamma <= 1
         self.gamma = gamma
         self.normalize_inverse = normalize_inverse
 
+    @torch.no_grad()
     def _update_params(self, t: torch.Tensor):
         self.loc = (
             self.gamma * self.loc + (1 - self.gamma) * t.mean(0).detach()
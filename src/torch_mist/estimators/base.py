@@ -1,10 +1,17 @@
 from abc import abstractmethod
-from typing import Dict, Union, Callable, Tuple, List
+from contextlib import contextmanager
+from typing import Dict, Union, Callable, Tuple, List, Any
 
 import torch
 import torch.nn as nn
 
 from torch_mist.nn import Model
+from torch_mist.utils.caching import (
+    cache_stats,
+    clear_cache,
+    reset_cache_stats,
+    step_cache,
+)
 
 
 class MIEstimator(Model):
@@ -50,3 +57,21 @@ class MIEstimator(Model):
         self, x: torch.Tensor, y: torch.Tensor
     ) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
         return self.loss(x, y)
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Report hits, misses, hit rate, held bytes and saved time for the cached methods of the estimator and its
+        components.
+        """
+        return cache_stats(self)
+
+    def clear_cache(self):
+        clear_cache(self)
+
+    @contextmanager
+    def step_cache(self):
+        with step_cache(self):
+            yield
+
+    def reset_cache_stats(self):
+        reset_cache_stats(self)
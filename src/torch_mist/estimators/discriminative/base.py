@@ -1,15 +1,32 @@
+import math
 from abc import abstractmethod
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, Iterator, Callable
 
 import torch
+from torch.utils.checkpoint import checkpoint
 
 from torch_mist.baseline import Baseline
 from torch_mist.estimators.base import MIEstimator
 from torch_mist.critic import Critic
 from torch_mist.critic import SeparableCritic
 from torch_mist.distributions.empirical import EmpiricalDistribution
-from torch_mist.utils.caching import cached_method
-from torch_mist.utils.indexing import matrix_off_diagonal
+from torch_mist.distributions.memory_bank import MemoryBank
+from torch_mist.utils.caching import cached_method, caching
+from torch_mist.utils.indexing import matrix_off_diagonal, select_k_others
+
+# Compiled version of the functions, created on first use
+_compiled_functions = {}
+
+
+def _log_partition_from_scores(
+    estimator: "DiscriminativeMIEstimator",
+    x: torch.Tensor,
+    y: torch.Tensor,
+    f_: torch.Tensor,
+    log_w: Optional[torch.Tensor],
+) -> torch.Tensor:
+    f_ = estimator._transform_negative_scores(f_)
+    return estimator._approx_log_partition(x=x, y=y, f_=f_, log_w=log_w)
 
 
 class DiscriminativeMIEstimator(MIEstimator):
@@ -20,12 +37,36 @@ class DiscriminativeMIEstimator(MIEstimator):
         self,
         critic: Critic,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
+        """
+        :param critic: the critic f(x,y).
+        :param neg_samples: the number of negative samples. Values <= 0 are interpreted as difference from the
+            batch size (0 uses the whole batch, -1 all but one in the batch).
+        :param max_chunk_elements: maximum number of critic evaluations on negative pairs computed at once.
+            When specified, the negatives are processed in chunks and the log-partition function is accumulated
+            online, bounding the memory to O(max_chunk_elements) instead of O(neg_samples x batch_size). During
+            training, the critic is evaluated again on each chunk in the backward pass (gradient checkpointing).
+        :param compile: if True, the post-processing of the critic values on the negatives and the computation of
+            the log-partition function are compiled with torch.compile into fused kernels.
+        """
         super().__init__()
         self.critic = critic
         self.neg_samples = neg_samples
+        self.max_chunk_elements = max_chunk_elements
+        self.compile_log_partition = compile
         self.proposal = EmpiricalDistribution()
 
+    def _maybe_compiled(self, function: Callable) -> Callable:
+        # A single compiled version of each function is shared by all the estimators (of any class).
+        # torch.compile guards on the inputs (including the estimator) and recompiles the function when needed.
+        if not self.compile_log_partition:
+            return function
+        if not (function in _compiled_functions):
+            _compiled_functions[function] = torch.compile(function)
+        return _compiled_functions[function]
+
     @cached_method
     def unnormalized_log_ratio(
         self, x: torch.Tensor, y: torch.Tensor
@@ -35,6 +76,10 @@ class DiscriminativeMIEstimator(MIEstimator):
         return f
 
     def n_negatives_to_use(self, N: int):
+        # The number of negatives from a memory bank is determined when sampling
+        if isinstance(self.proposal, MemoryBank):
+            return self.proposal.n_negatives
+
         neg_samples = self.neg_samples
 
         # Negative neg_samples values are interpreted as difference from the batch size (-1 is all but one in the batch)
@@ -53,6 +98,9 @@ class DiscriminativeMIEstimator(MIEstimator):
     def sample_negatives(
         self, x: torch.Tensor, y: torch.Tensor
     ) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+        if isinstance(self.proposal, MemoryBank):
+            return self._sample_memory_bank_negatives(x, y)
+
         N = x.shape[0]
         neg_samples = self.n_negatives_to_use(N)
 
@@ -60,9 +108,11 @@ class DiscriminativeMIEstimator(MIEstimator):
             self.proposal.add_samples(y)
 
         # Efficient implementation for separable critic with empirical distribution (negatives from the same batch)
+        # The critic is evaluated on all the pairs in the batch with one matrix product, the M negatives are
+        # selected afterwards (see critic_on_negatives)
         if (
             isinstance(self.critic, SeparableCritic)
-            and self.neg_samples <= 0
+            and (self.neg_samples <= 0 or x.ndim == 2)
             and isinstance(self.proposal, EmpiricalDistribution)
         ):
             y_ = self.proposal._samples[:N].unsqueeze(1)
@@ -77,6 +127,44 @@ class DiscriminativeMIEstimator(MIEstimator):
 
         return x.unsqueeze(0), y_, None
 
+    def _sample_memory_bank_negatives(
+        self, x: torch.Tensor, y: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+        # Positive values of neg_samples sample the negatives from the ones stored in the memory bank (shared across
+        # the batch), while values <= 0 use the samples in the current batch followed by all the stored ones.
+        if self.proposal.embedded and not (
+            isinstance(self.critic, SeparableCritic) and x.ndim == 2
+        ):
+            raise ValueError(
+                "A memory bank storing embeddings requires a SeparableCritic and inputs with shape [N, X_DIM]."
+            )
+
+        # The embeddings of the current batch computed by the critic are re-used by the memory bank
+        embeddings = None
+        if self.proposal.embedded and self.proposal.encoder is self.critic.f_y:
+            embeddings = self.critic.embed_y(y)
+        self.proposal.add_samples(y, embeddings=embeddings)
+
+        if self.neg_samples <= 0:
+            y_ = self.proposal.sample_all()
+        elif len(self.proposal) > 0:
+            neg_samples = min(self.neg_samples, len(self.proposal))
+            y_ = self.proposal.sample(torch.Size([neg_samples]))
+        else:
+            # Before any sample is stored, the negatives are the other samples in the current batch
+            neg_samples = max(min(self.neg_samples, x.shape[0] - 1), 1)
+            if self.proposal.embedded:
+                # All the pairs are scored, and the off-diagonal elements are selected in critic_on_negatives
+                y_ = self.proposal.sample_all()
+            else:
+                y_ = select_k_others(y, neg_samples)
+            self.proposal.n_negatives = neg_samples
+
+        # The current batch is stored only during training
+        self.proposal.update(store=self.training)
+
+        return x.unsqueeze(0), y_, None
+
     def log_ratio(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         # Approximate the log-ratio p(x,y)/r(x,y) on samples from p(x,y).
         # x and y have shape [..., X_DIM] and [..., Y_DIM] respectively
@@ -115,6 +203,250 @@ class DiscriminativeMIEstimator(MIEstimator):
     ) -> torch.Tensor:
         raise NotImplementedError()
 
+    def _transform_negative_scores(self, f_: torch.Tensor) -> torch.Tensor:
+        # Element-wise transformation of the critic values on the negatives before computing the log-partition
+        return f_
+
+    def _is_all_pairs(self, x_: torch.Tensor, y_: torch.Tensor) -> bool:
+        # x_ with shape [1, N, X_DIM] and y_ with shape [M, 1, Y_DIM] represent all the pairs (x_j, y_i)
+        return (
+            isinstance(self.critic, SeparableCritic)
+            and x_.ndim == 3
+            and y_.ndim == 3
+            and x_.shape[0] == 1
+            and y_.shape[1] == 1
+        )
+
+    def _score_all_pairs(
+        self, x: torch.Tensor, y: torch.Tensor
+    ) -> torch.Tensor:
+        # The negatives from a memory bank of embeddings are already projected with f_y
+        if isinstance(self.proposal, MemoryBank) and self.proposal.embedded:
+            return self.critic.score_embeddings(x, y)
+        return self.critic.score_matrix(x, y)
+
+    def critic_on_negatives(
+        self,
+        x_: torch.Tensor,
+        y_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+        M: int,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        # Evaluate the unnormalized_log_ratio f(x_,y_) on the samples x_, y_ ~ r(x, y). It has shape [M, ...]
+        if self._is_all_pairs(x_, y_):
+            # Computational shortcut for separable critic
+            # x and y are embedded once, and the critic is computed for all pairs with one matrix product
+            f_ = self._score_all_pairs(x_[0], y_[:, 0])
+        else:
+            f_ = self.critic(x_, y_)
+
+        # Select the M off-diagonal elements (excluding the positive pairs)
+        if M != f_.shape[0]:
+            assert isinstance(self.critic, SeparableCritic)
+            f_ = matrix_off_diagonal(f_, M)
+            if not (log_w is None) and log_w.shape[0] != M:
+                log_w = matrix_off_diagonal(log_w, M)
+
+        return f_, log_w
+
+    @staticmethod
+    def _batch_shape(x: torch.Tensor) -> torch.Size:
+        # Tensors of integers do not have the last (feature) dimension
+        return x.shape[:-1] if torch.is_floating_point(x) else x.shape
+
+    def _use_chunks(
+        self, x_: torch.Tensor, y_: torch.Tensor, batch_shape: torch.Size
+    ) -> bool:
+        if self.max_chunk_elements is None:
+            return False
+        n_rows = max(x_.shape[0], y_.shape[0])
+        return n_rows * batch_shape.numel() > self.max_chunk_elements
+
+    def _critic_on_negative_chunk(
+        self,
+        x_: torch.Tensor,
+        y_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+        M: int,
+        start: int,
+        end: int,
+        f_x: Optional[torch.Tensor],
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]:
+        n_rows = max(x_.shape[0], y_.shape[0])
+
+        if self._is_all_pairs(x_, y_):
+            # For the separable shortcut, the embeddings f_x are computed once for all the chunks
+            f_y = y_[start:end, 0]
+            if not (
+                isinstance(self.proposal, MemoryBank)
+                and self.proposal.embedded
+            ):
+                f_y = self.critic.embed_y(f_y)
+            with self.critic.precomputed_embeddings():
+                f_chunk = self.critic.score_embeddings(f_x, f_y)
+        else:
+            x_chunk = x_[start:end] if x_.shape[0] == n_rows else x_
+            y_chunk = y_[start:end] if y_.shape[0] == n_rows else y_
+            f_chunk = self.critic(x_chunk, y_chunk)
+
+        log_w_chunk = None
+        if not (log_w is None):
+            log_w_chunk = (
+                log_w[start:end] if log_w.shape[0] == n_rows else log_w
+            )
+
+        # For the separable shortcut, the critic is evaluated on all the pairs and the diagonal has to be removed
+        mask = None
+        if M != n_rows:
+            assert isinstance(self.critic, SeparableCritic)
+            # Keep the entries (i, j) with 1 <= (i - j) mod N <= M, as selected by matrix_off_diagonal
+            rows = torch.arange(start, end, device=f_chunk.device)
+            cols = torch.arange(n_rows, device=f_chunk.device)
+            offset = (rows.unsqueeze(1) - cols.unsqueeze(0)) % n_rows
+            mask = (offset >= 1) & (offset <= M)
+
+        return f_chunk, log_w_chunk, mask
+
+    def _reduce_negative_chunk(
+        self,
+        reduce: Callable[
+            [torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]],
+            torch.Tensor,
+        ],
+        x_: torch.Tensor,
+        y_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+        M: int,
+        start: int,
+        end: int,
+        f_x: Optional[torch.Tensor],
+    ) -> torch.Tensor:
+        # The cached values are neither used nor stored, so that the recomputation during the backward pass
+        # is identical to the forward pass
+        with caching(enabled=False):
+            return reduce(
+                *self._critic_on_negative_chunk(
+                    x_=x_,
+                    y_=y_,
+                    log_w=log_w,
+                    M=M,
+                    start=start,
+                    end=end,
+                    f_x=f_x,
+                )
+            )
+
+    def reduce_negative_chunks(
+        self,
+        reduce: Callable[
+            [torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]],
+            torch.Tensor,
+        ],
+        x_: torch.Tensor,
+        y_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+        M: int,
+        batch_shape: torch.Size,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Evaluate the critic on the negatives in chunks of rows of at most max_chunk_elements values, and reduce each
+        chunk with reduce(f_, log_w, mask), where f_ and log_w have shape [chunk_size, ...] and the mask (if not None)
+        selects the values that correspond to negative samples.
+        When gradients are required, each chunk is checkpointed: only the reduced values are stored, and the critic
+        is evaluated again on the chunk during the backward pass. This bounds the memory to O(max_chunk_elements)
+        both for training and evaluation.
+        :return: an iterator over the reduced values of the chunks.
+        """
+        n_rows = max(x_.shape[0], y_.shape[0])
+        chunk_size = max(1, self.max_chunk_elements // batch_shape.numel())
+
+        f_x = None
+        if self._is_all_pairs(x_, y_):
+            f_x = self.critic.embed_x(x_[0])
+
+        for start in range(0, n_rows, chunk_size):
+            end = min(start + chunk_size, n_rows)
+            params = dict(
+                reduce=reduce,
+                x_=x_,
+                y_=y_,
+                log_w=log_w,
+                M=M,
+                start=start,
+                end=end,
+                f_x=f_x,
+            )
+            if torch.is_grad_enabled():
+                yield checkpoint(
+                    self._reduce_negative_chunk, use_reentrant=False, **params
+                )
+            else:
+                yield self._reduce_negative_chunk(**params)
+
+    def _chunked_log_mean_exp(
+        self,
+        x_: torch.Tensor,
+        y_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+        M: int,
+        batch_shape: torch.Size,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        def _log_sum_exp(
+            f_chunk: torch.Tensor,
+            log_w_chunk: Optional[torch.Tensor],
+            mask: Optional[torch.Tensor],
+        ) -> torch.Tensor:
+            # log sum_m e^f_ (and log sum_m e^(f_+log_w) if weights are specified) on the chunk
+            f_chunk = self._transform_negative_scores(f_chunk)
+            fw_chunk = f_chunk
+            if not (log_w_chunk is None):
+                fw_chunk = f_chunk + log_w_chunk
+            if not (mask is None):
+                f_chunk = f_chunk.masked_fill(~mask, -torch.inf)
+                fw_chunk = fw_chunk.masked_fill(~mask, -torch.inf)
+
+            if log_w_chunk is None:
+                return torch.logsumexp(f_chunk, 0).unsqueeze(0)
+            return torch.stack(
+                [torch.logsumexp(f_chunk, 0), torch.logsumexp(fw_chunk, 0)]
+            )
+
+        # Online computation of log 1/M sum_m e^f_ (and log 1/M sum_m e^(f_+log_w) if weights are specified)
+        log_sum_exp = None
+        for chunk_lse in self.reduce_negative_chunks(
+            _log_sum_exp,
+            x_=x_,
+            y_=y_,
+            log_w=log_w,
+            M=M,
+            batch_shape=batch_shape,
+        ):
+            log_sum_exp = (
+                chunk_lse
+                if log_sum_exp is None
+                else torch.logaddexp(log_sum_exp, chunk_lse)
+            )
+
+        # A single row with the value log 1/M sum_m e^f_ is equivalent to the M rows for all the
+        # log-partition estimators since they depend on f_ only through (log) mean exp
+        f_ = (log_sum_exp[0] - math.log(M)).unsqueeze(0)
+
+        if log_w is None:
+            return f_, None
+        return f_, (log_sum_exp[1] - log_sum_exp[0]).unsqueeze(0)
+
+    def _scores_log_partition(
+        self,
+        x: torch.Tensor,
+        y: torch.Tensor,
+        f_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+    ) -> torch.Tensor:
+        # The transformation of the scores and the reductions are fused when compiled
+        return self._maybe_compiled(_log_partition_from_scores)(
+            self, x=x, y=y, f_=f_, log_w=log_w
+        )
+
     def approx_log_partition(
         self,
         x: torch.Tensor,
@@ -125,20 +457,22 @@ class DiscriminativeMIEstimator(MIEstimator):
     ) -> torch.Tensor:
         N = x.shape[0]
         M = self.n_negatives_to_use(N)
+        batch_shape = self._batch_shape(x)
+
+        if self._use_chunks(x_, y_, batch_shape):
+            # Stream the negatives in chunks and reduce them to an equivalent single row
+            f_, log_w = self._chunked_log_mean_exp(
+                x_=x_, y_=y_, log_w=log_w, M=M, batch_shape=batch_shape
+            )
+            assert f_.shape[0] == 1 and f_.shape[1] == N
+            log_Z = self._approx_log_partition(x=x, y=y, f_=f_, log_w=log_w)
+        else:
+            f_, log_w = self.critic_on_negatives(
+                x_=x_, y_=y_, log_w=log_w, M=M
+            )
+            assert f_.shape[0] == M and f_.shape[1] == N
+            log_Z = self._scores_log_partition(x=x, y=y, f_=f_, log_w=log_w)
 
-        # Evaluate the unnormalized_log_ratio f(x_,y_) on the samples x_, y_ ~ r(x, y). It has shape [M, ...]
-        f_ = self.critic(x_, y_)
-
-        # Computational shortcut for separable critic
-        # we compute the product for the whole batch and then remove the diagonal
-        if self.neg_samples < 0 and M != f_.shape[0]:
-            assert isinstance(self.critic, SeparableCritic)
-            # Remove the diagonal from the matrix
-            f_ = matrix_off_diagonal(f_, M)
-
-        assert f_.shape[0] == M and f_.shape[1] == N
-
-        log_Z = self._approx_log_partition(x=x, y=y, f_=f_, log_w=log_w)
         assert log_Z.shape == x.shape[:-1]
 
         return log_Z
@@ -163,10 +497,14 @@ class BaselineDiscriminativeMIEstimator(DiscriminativeMIEstimator):
         critic: Critic,
         baseline: Baseline,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
 
         self.baseline = baseline
@@ -1,10 +1,13 @@
 import inspect
-from typing import List
+from typing import List, Optional
 
 from torch_mist.baseline.base import ConstantBaseline
 from torch_mist.baseline.factories import baseline_nn
+from torch_mist.critic import SeparableCritic
 from torch_mist.critic.base import JOINT_CRITIC, SEPARABLE_CRITIC
 from torch_mist.critic.factories import critic_nn, shared_critic_nns
+from torch_mist.distributions.memory_bank import MemoryBank
+from torch_mist.estimators.discriminative.base import DiscriminativeMIEstimator
 from torch_mist.estimators.discriminative.implementations import (
     AlphaTUBA,
     FLO,
@@ -18,6 +21,40 @@ from torch_mist.estimators.discriminative.implementations import (
 )
 
 
+def _add_memory_bank(
+    estimator: DiscriminativeMIEstimator,
+    capacity: Optional[int],
+    momentum: Optional[float],
+) -> DiscriminativeMIEstimator:
+    # Replace the default proposal (negatives from the same batch) with a memory bank storing the previous batches
+    if capacity is None:
+        if not (momentum is None):
+            raise ValueError(
+                "memory_bank_momentum can be used only when memory_bank_capacity is specified."
+            )
+        return estimator
+
+    if estimator.neg_samples > capacity:
+        raise ValueError(
+            f"neg_samples={estimator.neg_samples} negatives can not be sampled from a memory bank with capacity "
+            + f"{capacity}."
+        )
+
+    encoder = None
+    if not (momentum is None):
+        if not isinstance(estimator.critic, SeparableCritic):
+            raise ValueError(
+                "A memory bank with momentum requires a separable critic (critic_type='separable')."
+            )
+        # The bank stores the f_y embeddings computed with a momentum copy of the encoder
+        encoder = estimator.critic.f_y
+
+    estimator.proposal = MemoryBank(
+        capacity=capacity, encoder=encoder, momentum=momentum
+    )
+    return estimator
+
+
 def alpha_tuba(
     x_dim: int,
     y_dim: int,
@@ -26,6 +63,10 @@ def alpha_tuba(
     learnable_baseline: bool = True,
     critic_type: str = SEPARABLE_CRITIC,
     neg_samples: int = 0,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> AlphaTUBA:
     baseline_params = {}
@@ -46,7 +87,7 @@ def alpha_tuba(
     else:
         b_nn = ConstantBaseline(value=1.0)
 
-    return AlphaTUBA(
+    estimator = AlphaTUBA(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -57,6 +98,13 @@ def alpha_tuba(
         baseline=b_nn,
         alpha=alpha,
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
 
 
@@ -67,6 +115,10 @@ def flo(
     neg_samples: int = -1,
     n_shared_layers: int = -1,
     critic_type: str = SEPARABLE_CRITIC,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> FLO:
     # Make two critics with shared architectures
@@ -80,10 +132,17 @@ def flo(
         **kwargs,
     )
 
-    return FLO(
+    estimator = FLO(
         critic=critic,
         normalized_critic=normalized_critic,
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
 
 
@@ -93,9 +152,13 @@ def infonce(
     hidden_dims: List[int],
     critic_type: str = SEPARABLE_CRITIC,
     neg_samples: int = 0,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> InfoNCE:
-    return InfoNCE(
+    estimator = InfoNCE(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -104,6 +167,13 @@ def infonce(
             **kwargs,
         ),
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
 
 
@@ -113,9 +183,13 @@ def js(
     hidden_dims: List[int],
     neg_samples: int = 1,
     critic_type: str = JOINT_CRITIC,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> JS:
-    return JS(
+    estimator = JS(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -124,15 +198,26 @@ def js(
             **kwargs,
         ),
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
 
 
 def dummy_discriminative(
     neg_samples: int = 1,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
     **kwargs,
 ) -> DummyDiscriminativeMIEstimator:
     return DummyDiscriminativeMIEstimator(
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
     )
 
 
@@ -143,9 +228,13 @@ def mine(
     critic_type: str = JOINT_CRITIC,
     neg_samples: int = 1,
     gamma: float = 0.9,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> MINE:
-    return MINE(
+    estimator = MINE(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -154,8 +243,15 @@ def mine(
             **kwargs,
         ),
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
         gamma=gamma,
     )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
+    )
 
 
 def nwj(
@@ -164,9 +260,13 @@ def nwj(
     hidden_dims: List[int],
     neg_samples: int = 1,
     critic_type: str = JOINT_CRITIC,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> NWJ:
-    return NWJ(
+    estimator = NWJ(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -175,6 +275,13 @@ def nwj(
             **kwargs,
         ),
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
 
 
@@ -185,9 +292,13 @@ def smile(
     neg_samples: int = 1,
     tau: float = 5.0,
     critic_type: str = JOINT_CRITIC,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> SMILE:
-    return SMILE(
+    estimator = SMILE(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -196,8 +307,15 @@ def smile(
             **kwargs,
         ),
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
         tau=tau,
     )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
+    )
 
 
 def tuba(
@@ -206,6 +324,10 @@ def tuba(
     hidden_dims: List[int],
     neg_samples: int = 1,
     critic_type: str = JOINT_CRITIC,
+    max_chunk_elements: Optional[int] = None,
+    compile: bool = False,
+    memory_bank_capacity: Optional[int] = None,
+    memory_bank_momentum: Optional[float] = None,
     **kwargs,
 ) -> TUBA:
     baseline_params = {}
@@ -219,7 +341,7 @@ def tuba(
 
     b_nn = baseline_nn(x_dim=x_dim, hidden_dims=hidden_dims, **baseline_params)
 
-    return TUBA(
+    estimator = TUBA(
         critic=critic_nn(
             x_dim=x_dim,
             y_dim=y_dim,
@@ -229,4 +351,11 @@ def tuba(
         ),
         baseline=b_nn,
         neg_samples=neg_samples,
+        max_chunk_elements=max_chunk_elements,
+        compile=compile,
+    )
+    return _add_memory_bank(
+        estimator=estimator,
+        capacity=memory_bank_capacity,
+        momentum=memory_bank_momentum,
     )
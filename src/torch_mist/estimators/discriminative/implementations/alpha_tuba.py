@@ -1,3 +1,5 @@
+from typing import Optional
+
 from torch_mist.critic import Critic
 from torch_mist.baseline import (
     LearnableBaseline,
@@ -16,6 +18,8 @@ class AlphaTUBA(BaselineDiscriminativeMIEstimator):
         baseline: LearnableBaseline,
         alpha: float = 0.01,
         neg_samples: int = -1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         alpha_baseline = InterpolatedBaseline(
             baseline_1=BatchLogMeanExp("first"),
@@ -26,4 +30,6 @@ class AlphaTUBA(BaselineDiscriminativeMIEstimator):
             critic=critic,
             baseline=alpha_baseline,
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
@@ -10,10 +10,14 @@ class DummyDiscriminativeMIEstimator(DiscriminativeMIEstimator):
     def __init__(
         self,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=ConstantCritic(),
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
 
     def _approx_log_partition(
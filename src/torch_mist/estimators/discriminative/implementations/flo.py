@@ -9,16 +9,34 @@ from torch_mist.estimators.discriminative.base import (
 from torch_mist.utils.caching import cached_method
 
 
+def _log_partition(
+    u: torch.Tensor,
+    f: torch.Tensor,
+    f_: torch.Tensor,
+    log_w: Optional[torch.Tensor],
+) -> torch.Tensor:
+    # Add the log_weights if provided
+    if not (log_w is None):
+        assert log_w.ndim == f_.ndim
+        f_ = f_ + log_w
+
+    return (u - f + torch.logsumexp(f_, 0)).exp() / f_.shape[0] - 1
+
+
 class FLO(DiscriminativeMIEstimator):
     def __init__(
         self,
         critic: Critic,
         normalized_critic: Critic,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
         self.normalized_critic = normalized_critic
 
@@ -48,17 +66,28 @@ class FLO(DiscriminativeMIEstimator):
         u = self.unnormalized_log_ratio(x=x, y=y)
         assert f.shape == u.shape
 
-        # Add the log_weights if provided
-        if not (log_w is None):
-            assert log_w.ndim == f_.ndim
-            f_ = f_ + log_w
-
-        log_Z = (u - f + torch.logsumexp(f_, 0)).exp() / f_.shape[0] - 1
+        log_Z = _log_partition(u=u, f=f, f_=f_, log_w=log_w)
 
         assert log_Z.shape == f_.shape[1:]
 
         return log_Z
 
+    def _scores_log_partition(
+        self,
+        x: torch.Tensor,
+        y: torch.Tensor,
+        f_: torch.Tensor,
+        log_w: Optional[torch.Tensor],
+    ) -> torch.Tensor:
+        # The critics are evaluated outside of the compiled function, which fuses the log-partition computation
+        f = self.critic(x, y)
+        u = self.unnormalized_log_ratio(x=x, y=y)
+        assert f.shape == u.shape
+
+        return self._maybe_compiled(_log_partition)(
+            u=u, f=f, f_=f_, log_w=log_w
+        )
+
     def __repr__(self):
         s = self.__class__.__name__ + "(\n"
         s += (
@@ -10,13 +10,21 @@ from torch_mist.estimators.discriminative.base import (
 
 
 class InfoNCE(BaselineDiscriminativeMIEstimator):
-    def __init__(self, critic: Critic, neg_samples: int = 0):
+    def __init__(
+        self,
+        critic: Critic,
+        neg_samples: int = 0,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
+    ):
         # Note that this can be equivalently obtained by extending TUBA with a BatchLogMeanExp(dim=1) baseline
         # This implementation saves some computation
         super().__init__(
             critic=critic,
             neg_samples=neg_samples,  # 0 signifies the whole batch is used as negative samples
             baseline=BatchLogMeanExp("first"),
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
 
     def _approx_log_partition(
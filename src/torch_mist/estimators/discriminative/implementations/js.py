@@ -10,16 +10,45 @@ from torch_mist.estimators.discriminative.base import (
 )
 
 
+def _negative_term(
+    f_: torch.Tensor, log_w: Optional[torch.Tensor]
+) -> torch.Tensor:
+    neg = F.softplus(f_)
+
+    # Compute the expectation w.r.t the M negatives (re-weighting if necessary)
+    if not (log_w is None):
+        neg = neg * log_w.exp()
+
+    return neg.mean(0)
+
+
+def _negative_chunk_sum(
+    f_: torch.Tensor,
+    log_w: Optional[torch.Tensor],
+    mask: Optional[torch.Tensor],
+) -> torch.Tensor:
+    neg = F.softplus(f_)
+    if not (log_w is None):
+        neg = neg * log_w.exp()
+    if not (mask is None):
+        neg = neg.masked_fill(~mask, 0)
+    return neg.sum(0)
+
+
 class JS(BaselineDiscriminativeMIEstimator):
     def __init__(
         self,
         critic: Critic,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             neg_samples=neg_samples,
             baseline=ConstantBaseline(value=0.0),
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
 
     def batch_loss(
@@ -31,16 +60,30 @@ class JS(BaselineDiscriminativeMIEstimator):
         f = self.unnormalized_log_ratio(x=x, y=y)
 
         x_, y_, log_w = self.sample_negatives(x, y)
-        f_ = self.critic(x_, y_)
+        M = self.n_negatives_to_use(x.shape[0])
+        batch_shape = self._batch_shape(x)
 
         pos = F.softplus(-f)
-        neg = F.softplus(f_)
-
-        # Compute the expectation w.r.t the M negatives (re-weighting if necessary)
-        if not (log_w is None):
-            neg = neg * log_w.exp()
 
-        neg = neg.mean(0)
+        if self._use_chunks(x_, y_, batch_shape):
+            # Accumulate the sum over the negatives one chunk at the time
+            neg = 0
+            for neg_chunk in self.reduce_negative_chunks(
+                _negative_chunk_sum,
+                x_=x_,
+                y_=y_,
+                log_w=log_w,
+                M=M,
+                batch_shape=batch_shape,
+            ):
+                neg = neg + neg_chunk
+            neg = neg / M
+        else:
+            f_, log_w = self.critic_on_negatives(
+                x_=x_, y_=y_, log_w=log_w, M=M
+            )
+            # The softplus, the re-weighting and the mean are fused when compiled
+            neg = self._maybe_compiled(_negative_term)(f_, log_w)
 
         assert pos.shape == neg.shape
 
@@ -1,4 +1,5 @@
 from contextlib import contextmanager
+from typing import Optional
 
 import torch
 
@@ -17,11 +18,15 @@ class MINE(BaselineDiscriminativeMIEstimator):
         critic: Critic,
         neg_samples: int = 1,
         gamma: float = 0.9,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             baseline=BatchLogMeanExp("all"),
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
         self._train_baseline = ExponentialMovingAverage(gamma=gamma)
 
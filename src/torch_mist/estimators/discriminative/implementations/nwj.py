@@ -1,3 +1,5 @@
+from typing import Optional
+
 from torch_mist.estimators.discriminative.base import (
     BaselineDiscriminativeMIEstimator,
 )
@@ -10,9 +12,13 @@ class NWJ(BaselineDiscriminativeMIEstimator):
         self,
         critic: Critic,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             neg_samples=neg_samples,
             baseline=ConstantBaseline(value=1.0),
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
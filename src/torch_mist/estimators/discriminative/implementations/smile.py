@@ -16,17 +16,23 @@ class SMILE(JS, BaselineDiscriminativeMIEstimator):
         critic: Critic,
         neg_samples: int = 1,
         tau: float = 5.0,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         JS.__init__(
             self,
             critic=critic,
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
         BaselineDiscriminativeMIEstimator.__init__(
             self,
             critic=critic,
             neg_samples=neg_samples,
             baseline=BatchLogMeanExp("all"),
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
         self.tau = tau
 
@@ -36,17 +42,6 @@ class SMILE(JS, BaselineDiscriminativeMIEstimator):
     def log_ratio(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
         return BaselineDiscriminativeMIEstimator.log_ratio(self, x, y)
 
-    def _approx_log_partition(
-        self,
-        x: torch.Tensor,
-        y: torch.Tensor,
-        f_: torch.Tensor,
-        log_w: Optional[torch.Tensor],
-    ) -> torch.Tensor:
+    def _transform_negative_scores(self, f_: torch.Tensor) -> torch.Tensor:
         # Clamp f_ between [-\tau, \tau] (before re-weighting)
-        return super()._approx_log_partition(
-            x=x,
-            y=y,
-            f_=torch.clamp(f_, min=-self.tau, max=self.tau),
-            log_w=log_w,
-        )
+        return torch.clamp(f_, min=-self.tau, max=self.tau)
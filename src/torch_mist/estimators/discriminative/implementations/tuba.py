@@ -1,3 +1,5 @@
+from typing import Optional
+
 from torch_mist.baseline import LearnableBaseline
 from torch_mist.critic import Critic
 from torch_mist.estimators.discriminative.base import (
@@ -11,9 +13,13 @@ class TUBA(BaselineDiscriminativeMIEstimator):
         critic: Critic,
         baseline: LearnableBaseline,
         neg_samples: int = 1,
+        max_chunk_elements: Optional[int] = None,
+        compile: bool = False,
     ):
         super().__init__(
             critic=critic,
             baseline=baseline,
             neg_samples=neg_samples,
+            max_chunk_elements=max_chunk_elements,
+            compile=compile,
         )
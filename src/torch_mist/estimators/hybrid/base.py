@@ -20,6 +20,8 @@ class HybridMIEstimator(DiscriminativeMIEstimator):
         super().__init__(
             critic=discriminative_estimator.critic,
             neg_samples=neg_samples,
+            max_chunk_elements=discriminative_estimator.max_chunk_elements,
+            compile=discriminative_estimator.compile_log_partition,
         )
 
         self.discriminative_estimator = discriminative_estimator
@@ -1,4 +1,4 @@
 from .train import train_mi_estimator
 from .freeze import freeze, is_trainable, n_trainable_parameters
 from .evaluation import evaluate_mi
-from .estimation import estimate_mi
+from .estimation import estimate_mi, estimate_mi_ensemble
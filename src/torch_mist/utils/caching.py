@@ -1,27 +1,99 @@
-from copy import deepcopy
-from typing import Callable, TypeVar, Dict, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, TypeVar, Any, Optional, Hashable, Tuple, Dict
 import inspect
+import time
 
 import torch
 from torch import nn
 
 T = TypeVar("T")
 
+DEFAULT_CACHE_SIZE = 2
+
+# Global configuration shared by all the cached methods and functions
+_cache_config = {"enabled": True, "max_memory": None}
+
+
+def enable_caching():
+    _cache_config["enabled"] = True
+
+
+def disable_caching():
+    _cache_config["enabled"] = False
+
+
+def is_caching_enabled() -> bool:
+    return _cache_config["enabled"]
+
+
+@contextmanager
+def caching(enabled: bool = True):
+    previous = _cache_config["enabled"]
+    _cache_config["enabled"] = enabled
+    try:
+        yield
+    finally:
+        _cache_config["enabled"] = previous
+
+
+def set_cache_max_memory(max_memory: Optional[int]):
+    """
+    Limit the amount of memory held by each cache.
+    :param max_memory: maximum number of bytes of the tensors stored in each cache. None removes the limit.
+    """
+    if not (max_memory is None) and max_memory < 0:
+        raise ValueError("max_memory must be a non-negative number of bytes.")
+    _cache_config["max_memory"] = max_memory
+
+
+def _is_compiling() -> bool:
+    # The caches rely on python side effects and on the memory location of the tensors.
+    # They are bypassed while tracing with torch.compile.
+    compiler = getattr(torch, "compiler", None)
+    if compiler is None or not hasattr(compiler, "is_compiling"):
+        return False
+    return compiler.is_compiling()
+
+
+def _nbytes(value: Any) -> int:
+    if torch.is_tensor(value):
+        return value.numel() * value.element_size()
+    elif isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    elif isinstance(value, list) or isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _parameters_version(module: nn.Module) -> Tuple[Tuple[int, int], ...]:
+    # Optimizer steps and load_state_dict() update the parameters in-place, incrementing their version counter
+    return tuple((p.data_ptr(), p._version) for p in module.parameters())
+
 
 def _is_cache_valid(arguments: Any, stored_arguments: Any):
     if stored_arguments is None:
         return False
 
     if torch.is_tensor(arguments):
+        if not torch.is_tensor(stored_arguments):
+            return False
         if not torch.equal(stored_arguments, arguments):
             return False
     elif isinstance(arguments, dict):
+        if not isinstance(stored_arguments, dict):
+            return False
         if stored_arguments.keys() != arguments.keys():
             return False
         for k in arguments:
             if not _is_cache_valid(arguments[k], stored_arguments[k]):
                 return False
     elif isinstance(arguments, list) or isinstance(arguments, tuple):
+        if not (
+            isinstance(stored_arguments, list)
+            or isinstance(stored_arguments, tuple)
+        ):
+            return False
         if len(arguments) != len(stored_arguments):
             return False
         for i in range(len(arguments)):
@@ -33,20 +105,167 @@ def _is_cache_valid(arguments: Any, stored_arguments: Any):
     return True
 
 
-def delete_cache_hook(self, *args, **kwargs):
-    if hasattr(self, "__cache"):
-        del self.__cache
+def _make_key(arguments: Any) -> Hashable:
+    # Tensors are identified by their memory location, version counter (incremented by in-place operations) and layout.
+    # This is O(1) and does not require reading the tensor values.
+    if torch.is_tensor(arguments):
+        return (
+            torch.Tensor,
+            arguments.data_ptr(),
+            arguments._version,
+            tuple(arguments.shape),
+            tuple(arguments.stride()),
+            arguments.dtype,
+            arguments.device,
+            arguments.requires_grad,
+        )
+    elif isinstance(arguments, dict):
+        return (
+            dict,
+            tuple((k, _make_key(v)) for k, v in arguments.items()),
+        )
+    elif isinstance(arguments, list) or isinstance(arguments, tuple):
+        return (
+            type(arguments),
+            tuple(_make_key(v) for v in arguments),
+        )
+
+    try:
+        hash(arguments)
+    except TypeError:
+        # Unhashable objects are compared by identity
+        return object, id(arguments)
+    return type(arguments), arguments
+
+
+class LRUCache:
+    def __init__(
+        self, max_size: int = DEFAULT_CACHE_SIZE, strict: bool = False
+    ):
+        """
+        Least-recently-used cache mapping the arguments of a call to the returned value.
+        :param max_size: maximum number of entries stored in the cache.
+        :param strict: if True, the arguments are compared element-wise with torch.equal instead of
+            using the identity (memory location and version) of the tensors.
+        """
+        if max_size < 1:
+            raise ValueError("The cache size must be at least 1.")
+        self.max_size = max_size
+        self.strict = strict
+        self._entries = OrderedDict()
+
+        self.nbytes = 0
+
+    def _lookup_key(self, arguments: Any) -> Optional[Hashable]:
+        if self.strict:
+            for key in reversed(self._entries):
+                if _is_cache_valid(arguments, self._entries[key][0]):
+                    return key
+            return None
+
+        key = _make_key(arguments)
+        return key if key in self._entries else None
+
+    def lookup(
+        self, arguments: Any
+    ) -> Tuple[bool, Optional[Any], Optional[float]]:
+        """
+        Search for a cached value.
+        :param arguments: the arguments of the call.
+        :return: a flag indicating if the value has been found, the value and the time that was required to compute it.
+        """
+        key = self._lookup_key(arguments)
+        if key is None:
+            return False, None, None
 
+        self._entries.move_to_end(key)
+        _, value, elapsed, _ = self._entries[key]
+        return True, value, elapsed
+
+    def _evict(self):
+        _, _, _, nbytes = self._entries.popitem(last=False)[1]
+        self.nbytes -= nbytes
+
+    def store(self, arguments: Any, value: Any, elapsed: float = 0.0):
+        nbytes = _nbytes(value)
+        max_memory = _cache_config["max_memory"]
+
+        # Values that do not fit in the memory budget are not cached
+        if not (max_memory is None) and nbytes > max_memory:
+            return
+
+        # The arguments are stored together with the value to keep the tensors alive.
+        # This guarantees that their memory location can not be re-used by a different tensor while cached.
+        key = _make_key(arguments)
+        if key in self._entries:
+            self.nbytes -= self._entries[key][3]
+        self._entries[key] = (arguments, value, elapsed, nbytes)
+        self._entries.move_to_end(key)
+        self.nbytes += nbytes
+
+        while len(self._entries) > self.max_size:
+            self._evict()
+        if not (max_memory is None):
+            while self.nbytes > max_memory:
+                self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {"hits": 0, "miss": 0, "time_saved": 0.0}
+
+
+def _cached_call(
+    cache: LRUCache,
+    stats: Dict[str, Any],
+    method: Callable[..., T],
+    arguments: Dict[str, Any],
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+) -> T:
+    found, value, elapsed = cache.lookup(arguments)
+    if not found:
+        start = time.perf_counter()
+        value = method(*args, **kwargs)
+        cache.store(arguments, value, elapsed=time.perf_counter() - start)
+        stats["miss"] += 1
+    else:
+        stats["hits"] += 1
+        stats["time_saved"] += elapsed
+
+    return value
+
+
+def cached_method(
+    method: Optional[Callable[..., T]] = None,
+    max_size: int = DEFAULT_CACHE_SIZE,
+    strict: bool = False,
+) -> Callable[..., T]:
+    # Allow the decorator to be used with or without parameters
+    if method is None:
+        return lambda method: cached_method(
+            method, max_size=max_size, strict=strict
+        )
 
-def cached_method(method: Callable[..., T]) -> Callable[..., T]:
     def wrapper(*args, **kwargs):
+        if not _cache_config["enabled"] or _is_compiling():
+            return method(*args, **kwargs)
+
         arguments = inspect.getcallargs(method, *args, **kwargs)
         self = arguments.pop("self")
 
         # Attach __cache to the instance
         if not hasattr(self, "__cache"):
             self.__cache = {}
-            self.__cache_stats = {}
+            self.__cache_versions = {}
+            if not hasattr(self, "__cache_stats"):
+                self.__cache_stats = {}
 
             if hasattr(self, "__getstate__"):
                 original_getstate = self.__getstate__
@@ -55,7 +274,6 @@ def cached_method(method: Callable[..., T]) -> Callable[..., T]:
 
             # Wrap the get_state method to exclude the cache
             def wrapped_getstate():
-                # delete_cache_hook(self)
                 if original_getstate is None:
                     state = self.__dict__
                 else:
@@ -65,73 +283,138 @@ def cached_method(method: Callable[..., T]) -> Callable[..., T]:
                     state["__getstate__"] = original_getstate
                 if "__cache" in state:
                     del state["__cache"]
+                if "__cache_versions" in state:
+                    del state["__cache_versions"]
                 if "__cache_stats" in state:
                     del state["__cache_stats"]
                 return state
 
             self.__getstate__ = wrapped_getstate
 
-            # For nn.Modules, automatically invalidate cache on backwards()
-            if isinstance(self, nn.Module):
-                self.register_full_backward_hook(delete_cache_hook)
-
         # Initialize the stats and empty cache
         if not (method.__name__ in self.__cache):
-            self.__cache[method.__name__] = None, None
+            self.__cache[method.__name__] = LRUCache(
+                max_size=max_size, strict=strict
+            )
 
         if not (method.__name__ in self.__cache_stats):
-            self.__cache_stats[method.__name__] = {"hits": 0, "miss": 0}
+            self.__cache_stats[method.__name__] = _empty_stats()
 
-        stored_arguments, stored_value = self.__cache[method.__name__]
+        cache = self.__cache[method.__name__]
         stats = self.__cache_stats[method.__name__]
 
-        if not _is_cache_valid(arguments, stored_arguments):
-            value = method(*args, **kwargs)
-            self.__cache[method.__name__] = (arguments, value)
-            stats["miss"] += 1
-        else:
-            stats["hits"] += 1
-            value = stored_value
+        # The cached values are dropped when the parameters of the module are updated
+        if isinstance(self, nn.Module):
+            version = _parameters_version(self)
+            if self.__cache_versions.get(method.__name__) != version:
+                cache.clear()
+                self.__cache_versions[method.__name__] = version
 
-        return value
+        return _cached_call(cache, stats, method, arguments, args, kwargs)
 
     wrapper.__signature__ = inspect.signature(method)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
 
     return wrapper
 
 
-def cached_function(method: Callable[..., T]) -> Callable[..., T]:
-    stored_arguments = {}
-    stored_value = None
-    stats = {"hits": 0, "miss": 0}
+def cached_function(
+    method: Optional[Callable[..., T]] = None,
+    max_size: int = DEFAULT_CACHE_SIZE,
+    strict: bool = False,
+) -> Callable[..., T]:
+    # Allow the decorator to be used with or without parameters
+    if method is None:
+        return lambda method: cached_function(
+            method, max_size=max_size, strict=strict
+        )
+
+    cache = LRUCache(max_size=max_size, strict=strict)
+    stats = _empty_stats()
 
     def cache_info():
-        nonlocal stats
         return stats
 
     def delete_cache():
-        nonlocal stored_value, stored_arguments
-        stored_value = None
-        stored_arguments = {}
+        cache.clear()
 
     def wrapper(*args, **kwargs):
+        if not _cache_config["enabled"] or _is_compiling():
+            return method(*args, **kwargs)
+
         arguments = inspect.getcallargs(method, *args, **kwargs)
 
         # static cache for functions (no methods)
-        nonlocal stats, stored_arguments, stored_value
-
-        if not _is_cache_valid(arguments, stored_arguments):
-            value = method(*args, **kwargs)
-            stored_value = value
-            stored_arguments = arguments
-            stats["miss"] += 1
-        else:
-            stats["hits"] += 1
-            value = stored_value
-
-        return value
+        return _cached_call(cache, stats, method, arguments, args, kwargs)
 
     wrapper.cache_info = cache_info
     wrapper.delete_cache = delete_cache
     wrapper.__signature__ = inspect.signature(method)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
     return wrapper
+
+
+def _summarize_stats(stats: Dict[str, Any], cache: Optional[LRUCache]):
+    calls = stats["hits"] + stats["miss"]
+    return {
+        "hits": stats["hits"],
+        "miss": stats["miss"],
+        "hit_rate": stats["hits"] / calls if calls > 0 else 0.0,
+        "entries": 0 if cache is None else len(cache),
+        "bytes": 0 if cache is None else cache.nbytes,
+        "time_saved": stats["time_saved"],
+    }
+
+
+def cache_stats(module: nn.Module) -> Dict[str, Dict[str, Any]]:
+    """
+    Collect the statistics of the cached methods of a module and all its sub-modules.
+    :param module: the module to inspect.
+    :return: a dictionary mapping '<sub_module_name>.<method_name>' to the number of hits, misses, hit rate,
+        number of cached entries, bytes held by the cache and the time saved (in seconds).
+    """
+    summary = {}
+    for name, sub_module in module.named_modules():
+        if not hasattr(sub_module, "__cache_stats"):
+            continue
+        caches = getattr(sub_module, "__cache", {})
+        for method_name, stats in sub_module.__cache_stats.items():
+            full_name = method_name if name == "" else f"{name}.{method_name}"
+            summary[full_name] = _summarize_stats(
+                stats, caches.get(method_name)
+            )
+    return summary
+
+
+def clear_cache(module: nn.Module):
+    """
+    Drop the cached values of a module and all its sub-modules.
+    """
+    for sub_module in module.modules():
+        if hasattr(sub_module, "__cache"):
+            for cache in sub_module.__cache.values():
+                cache.clear()
+
+
+@contextmanager
+def step_cache(module: nn.Module):
+    """
+    Scope the values cached by a module (and its sub-modules) to one training or evaluation step.
+    All the cached values are dropped when the context is exited, releasing the memory of the stored
+    tensors (and their computational graphs).
+    Outside of this context, the values cached by a method of a module are kept until the parameters of the
+    module are updated in-place (e.g. by an optimizer step or load_state_dict()).
+    """
+    try:
+        yield
+    finally:
+        clear_cache(module)
+
+
+def reset_cache_stats(module: nn.Module):
+    for sub_module in module.modules():
+        if hasattr(sub_module, "__cache_stats"):
+            for method_name in sub_module.__cache_stats:
+                sub_module.__cache_stats[method_name] = _empty_stats()
@@ -2,6 +2,7 @@ from .loader import (
     SameAttributeDataLoader,
     sample_same_attributes,
 )
-from .sampler import SameAttributeSampler
+from .sampler import SameAttributeSampler, BatchSliceSampler
 from .dataset import SampleDataset
 from .csv import CSVDataset
+from .npz import NumpyDataset
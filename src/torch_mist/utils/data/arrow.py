@@ -0,0 +1,273 @@
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+import torch
+
+from torch_mist.utils.data.dataset import ColumnarDataset, group_columns
+
+
+def _import_pyarrow() -> Any:
+    # pyarrow is an optional dependency, imported only when Parquet or Arrow files are loaded
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "pyarrow is required to load Parquet and Arrow files. "
+            + "Please install it with `pip install torch_mist[arrow]` or `pip install pyarrow`."
+        ) from e
+    return pyarrow
+
+
+class _ChunkedArrowDataset(ColumnarDataset, ABC):
+    def __init__(
+        self,
+        filepath: str,
+        variables: Optional[List[str]] = None,
+        in_memory: bool = True,
+        max_cached_chunks: int = 8,
+    ):
+        super().__init__()
+        _import_pyarrow()
+
+        if not os.path.isfile(filepath):
+            raise ValueError(f"{os.path.abspath(filepath)} does not exist.")
+
+        self.filepath = filepath
+        self.in_memory = in_memory
+        self.max_cached_chunks = max_cached_chunks
+
+        self._open()
+        self.variables, self.variable_cols = group_columns(
+            self._column_names(), variables
+        )
+        self.columns = [
+            column
+            for variable in self.variables
+            for column in self.variable_cols[variable]
+        ]
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(self._chunk_lengths())]
+        ).astype(np.int64)
+        self._cache = OrderedDict()
+
+        if in_memory:
+            chunks = [self._read_chunk(i) for i in range(self.n_chunks)]
+            self.data = {
+                variable: np.concatenate([chunk[variable] for chunk in chunks])
+                if len(chunks) > 0
+                else np.zeros(
+                    (0, len(self.variable_cols[variable])), dtype=np.float32
+                )
+                for variable in self.variables
+            }
+        else:
+            # The chunks are read when needed, and the most recent ones are kept in memory
+            self.data = None
+
+        print(f"The file '{filepath}' has columns:")
+        for variable in self.variables:
+            print(
+                f"  '{variable}' with shape {(len(self), len(self.variable_cols[variable]))}"
+            )
+
+    @abstractmethod
+    def _open(self):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _column_names(self) -> List[str]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _chunk_lengths(self) -> List[int]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _read_table(self, chunk_id: int) -> "pyarrow.Table":
+        raise NotImplementedError()
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.offsets) - 1
+
+    def _read_chunk(self, chunk_id: int) -> Dict[str, np.ndarray]:
+        # Only the selected columns are converted, missing values become NaNs
+        table = self._read_table(chunk_id)
+        return {
+            variable: np.stack(
+                [
+                    table.column(column).to_numpy()
+                    for column in self.variable_cols[variable]
+                ],
+                axis=1,
+            ).astype(np.float32, copy=False)
+            for variable in self.variables
+        }
+
+    def _get_chunk(self, chunk_id: int) -> Dict[str, np.ndarray]:
+        if chunk_id in self._cache:
+            self._cache.move_to_end(chunk_id)
+        else:
+            self._cache[chunk_id] = self._read_chunk(chunk_id)
+            if len(self._cache) > self.max_cached_chunks:
+                self._cache.popitem(last=False)
+        return self._cache[chunk_id]
+
+    def __getstate__(self):
+        # The file is re-opened instead of being pickled (e.g. when sent to worker processes)
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_cache"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get_batch(self, indices: torch.LongTensor) -> Dict[str, torch.Tensor]:
+        if self.in_memory:
+            return super().get_batch(indices)
+
+        # The entries are gathered from the chunks they belong to
+        indices = indices.numpy()
+        chunk_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        batch = {
+            variable: np.empty(
+                (len(indices), len(self.variable_cols[variable])),
+                dtype=np.float32,
+            )
+            for variable in self.variables
+        }
+        for chunk_id in np.unique(chunk_ids):
+            in_chunk = chunk_ids == chunk_id
+            chunk = self._get_chunk(int(chunk_id))
+            chunk_indices = indices[in_chunk] - self.offsets[chunk_id]
+            for variable, value in batch.items():
+                value[in_chunk] = chunk[variable][chunk_indices]
+        return {k: torch.as_tensor(v) for k, v in batch.items()}
+
+    def valid_mask(self) -> np.ndarray:
+        if self.in_memory:
+            return super().valid_mask()
+
+        masks = []
+        for chunk_id in range(self.n_chunks):
+            chunk = self._read_chunk(chunk_id)
+            mask = np.ones(
+                self.offsets[chunk_id + 1] - self.offsets[chunk_id],
+                dtype=bool,
+            )
+            for value in chunk.values():
+                mask &= ~np.isnan(value).any(-1)
+            masks.append(mask)
+        return (
+            np.concatenate(masks)
+            if len(masks) > 0
+            else np.zeros(0, dtype=bool)
+        )
+
+    def __getitem__(self, index):
+        if self.in_memory:
+            return super().__getitem__(index)
+
+        if index < 0:
+            index += len(self)
+        chunk_id = int(np.searchsorted(self.offsets, index, side="right") - 1)
+        chunk = self._get_chunk(chunk_id)
+        return {
+            k: np.array(v[index - self.offsets[chunk_id]])
+            for k, v in chunk.items()
+        }
+
+
+class ParquetDataset(_ChunkedArrowDataset):
+    def __init__(
+        self,
+        filepath: str,
+        variables: Optional[List[str]] = None,
+        in_memory: bool = True,
+        max_cached_chunks: int = 8,
+    ):
+        """
+        Dataset of the variables stored in a Parquet file, with columns named from <name>_1 to <name>_N.
+        :param filepath: path to the Parquet file.
+        :param variables: if specified, only the columns of these variables are read.
+        :param in_memory: load the selected columns in memory as float32 arrays. Otherwise, the row groups are read
+            when they are needed.
+        :param max_cached_chunks: maximum number of row groups kept in memory when in_memory is False.
+        """
+        super().__init__(
+            filepath=filepath,
+            variables=variables,
+            in_memory=in_memory,
+            max_cached_chunks=max_cached_chunks,
+        )
+
+    def _open(self):
+        pa = _import_pyarrow()
+        self._file = pa.parquet.ParquetFile(self.filepath, memory_map=True)
+
+    def _column_names(self) -> List[str]:
+        return self._file.schema_arrow.names
+
+    def _chunk_lengths(self) -> List[int]:
+        return [
+            self._file.metadata.row_group(i).num_rows
+            for i in range(self._file.num_row_groups)
+        ]
+
+    def _read_table(self, chunk_id: int) -> "pyarrow.Table":
+        return self._file.read_row_group(chunk_id, columns=self.columns)
+
+
+class ArrowDataset(_ChunkedArrowDataset):
+    def __init__(
+        self,
+        filepath: str,
+        variables: Optional[List[str]] = None,
+        in_memory: bool = True,
+        max_cached_chunks: int = 8,
+    ):
+        """
+        Dataset of the variables stored in an Arrow IPC (or Feather v2) file, with columns named from <name>_1 to
+        <name>_N. The file is memory-mapped.
+        :param filepath: path to the Arrow file.
+        :param variables: if specified, only the columns of these variables are read.
+        :param in_memory: load the selected columns in memory as float32 arrays. Otherwise, the record batches are
+            read when they are needed.
+        :param max_cached_chunks: maximum number of record batches kept in memory when in_memory is False.
+        """
+        super().__init__(
+            filepath=filepath,
+            variables=variables,
+            in_memory=in_memory,
+            max_cached_chunks=max_cached_chunks,
+        )
+
+    def _open(self):
+        pa = _import_pyarrow()
+        self._file = pa.ipc.open_file(pa.memory_map(self.filepath, "r"))
+
+    def _column_names(self) -> List[str]:
+        return self._file.schema.names
+
+    def _chunk_lengths(self) -> List[int]:
+        return [
+            self._file.get_batch(i).num_rows
+            for i in range(self._file.num_record_batches)
+        ]
+
+    def _read_table(self, chunk_id: int) -> "pyarrow.Table":
+        # Record batches are zero-copy views on the memory-mapped file
+        pa = _import_pyarrow()
+        return pa.Table.from_batches([self._file.get_batch(chunk_id)]).select(
+            self.columns
+        )
@@ -1,56 +1,183 @@
+import hashlib
+import json
 import os
+import shutil
 from collections import defaultdict
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Iterator
 
 import numpy as np
 import pandas as pd
-from torch.utils.data import Dataset
 
+from torch_mist.utils.data.dataset import ColumnarDataset, group_columns
 
-class CSVDataset(Dataset):
+
+class CSVDataset(ColumnarDataset):
     def __init__(
         self,
         filepath: str,
         remove_nan_rows: bool = True,
         rename_columns: Optional[Dict[str, str]] = None,
+        cache_dir: Optional[str] = None,
+        chunksize: int = 100000,
+        variables: Optional[List[str]] = None,
         **kwargs,
     ):
+        """
+        Dataset of the variables stored in a csv file, with columns named from <name>_1 to <name>_N.
+        The values are stored as float32 arrays.
+        :param filepath: path to the csv file.
+        :param remove_nan_rows: remove the rows containing NaNs.
+        :param cache_dir: if specified, the csv file is converted (once) into binary float32 files in this directory,
+            which are memory-mapped instead of loaded in memory. The cache is re-created whenever the csv file, or
+            the options used to read it, change.
+        :param chunksize: number of rows of the csv file parsed at once.
+        :param variables: if specified, only the columns of these variables are read.
+        :param kwargs: additional arguments for pandas.read_csv.
+        """
         super().__init__()
 
         if not os.path.isfile(filepath):
             raise ValueError(f"{os.path.abspath(filepath)} does not exist.")
 
-        df = pd.read_csv(filepath, **kwargs)
-        if remove_nan_rows:
-            df.dropna(inplace=True)
-
-        self.variables = []
-        self.variable_cols = defaultdict(list)
-        self.data = {}
-        last_variable = None
-        for column in df.columns:
-            idx = int(column.split("_")[-1])
-            variable = "_".join(column.split("_")[:-1])
-            self.variable_cols[variable].append(column)
-            if variable != last_variable:
-                assert not (variable in self.variables)
-                self.variables.append(variable)
-                last_variable = variable
-
-            if idx != len(self.variable_cols[variable]):
-                raise ValueError(
-                    "To avoid ambiguities, please make sure the columns in the csv file are sorted"
-                    + " from <name>_1 to <name>_N"
-                )
+        self.filepath = filepath
+        self.remove_nan_rows = remove_nan_rows
+        self.chunksize = chunksize
+        self.read_kwargs = kwargs
+        self.cache_path = None
 
-        print(f"The file '{filepath}' has columns:")
+        columns = list(pd.read_csv(filepath, nrows=0, **kwargs).columns)
+        self.variables, self.variable_cols = group_columns(columns, variables)
+        self.columns = [
+            column
+            for variable in self.variables
+            for column in self.variable_cols[variable]
+        ]
 
+        if cache_dir is None:
+            self.data = self._load()
+        else:
+            self.cache_path = os.path.join(
+                cache_dir,
+                f"{os.path.basename(filepath)}-{self._cache_key()}",
+            )
+            if not os.path.isdir(self.cache_path):
+                self._write_cache()
+            self.data = self._open_cache()
+
+        print(f"The file '{filepath}' has columns:")
         for variable in self.variables:
-            self.data[variable] = df[self.variable_cols[variable]].values
             print(f"  '{variable}' with shape {self.data[variable].shape}")
 
-    def __len__(self):
-        return self.data[self.variables[0]].shape[0]
+    def _read_chunks(self) -> Iterator[Dict[str, np.ndarray]]:
+        # The file is parsed in chunks, which are converted to float32 right away
+        for df in pd.read_csv(
+            self.filepath,
+            chunksize=self.chunksize,
+            usecols=self.columns,
+            **self.read_kwargs,
+        ):
+            if self.remove_nan_rows:
+                df = df.dropna()
+            yield {
+                variable: df[self.variable_cols[variable]].to_numpy(
+                    dtype=np.float32
+                )
+                for variable in self.variables
+            }
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        chunks = defaultdict(list)
+        for chunk in self._read_chunks():
+            for variable, value in chunk.items():
+                chunks[variable].append(value)
+
+        return {
+            variable: np.concatenate(chunks[variable])
+            if len(chunks[variable]) > 0
+            else np.zeros(
+                (0, len(self.variable_cols[variable])), dtype=np.float32
+            )
+            for variable in self.variables
+        }
+
+    def _cache_key(self) -> str:
+        # The content of the file is not hashed, so that opening an existing cache does not require reading the file
+        stat = os.stat(self.filepath)
+        key = json.dumps(
+            [
+                os.path.abspath(self.filepath),
+                stat.st_size,
+                stat.st_mtime_ns,
+                self.remove_nan_rows,
+                self.columns,
+                sorted((k, repr(v)) for k, v in self.read_kwargs.items()),
+            ]
+        )
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def _write_cache(self):
+        # The cache is written in a temporary directory first, so that an interrupted conversion is not used
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        n_rows = 0
+        files = {
+            variable: open(os.path.join(tmp_path, f"{i}.bin"), "wb")
+            for i, variable in enumerate(self.variables)
+        }
+        try:
+            for chunk in self._read_chunks():
+                for variable, value in chunk.items():
+                    files[variable].write(np.ascontiguousarray(value).data)
+                n_rows += len(chunk[self.variables[0]])
+        finally:
+            for file in files.values():
+                file.close()
+
+        with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+            json.dump(
+                {
+                    "n_rows": n_rows,
+                    "shapes": {
+                        variable: [n_rows, len(self.variable_cols[variable])]
+                        for variable in self.variables
+                    },
+                },
+                file,
+            )
+
+        try:
+            os.rename(tmp_path, self.cache_path)
+        except OSError:
+            # The same cache has been created concurrently
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _open_cache(self) -> Dict[str, np.ndarray]:
+        with open(os.path.join(self.cache_path, "meta.json"), "r") as file:
+            meta = json.load(file)
+
+        data = {}
+        for i, variable in enumerate(self.variables):
+            shape = tuple(meta["shapes"][variable])
+            if shape[0] == 0:
+                data[variable] = np.zeros(shape, dtype=np.float32)
+            else:
+                data[variable] = np.memmap(
+                    os.path.join(self.cache_path, f"{i}.bin"),
+                    dtype=np.float32,
+                    mode="r",
+                    shape=shape,
+                )
+        return data
+
+    def __getstate__(self):
+        # Memory-mapped arrays are re-opened instead of being copied (e.g. when sent to worker processes)
+        state = self.__dict__.copy()
+        if not (self.cache_path is None):
+            state["data"] = None
+        return state
 
-    def __getitem__(self, index):
-        return {k: v[index].astype(np.float32) for k, v in self.data.items()}
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not (self.cache_path is None):
+            self.data = self._open_cache()
@@ -1,5 +1,15 @@
 from distutils.dist import Distribution
-from typing import Dict, Sequence, Union, Callable, Any
+from collections import defaultdict
+from typing import (
+    Dict,
+    Sequence,
+    Union,
+    Callable,
+    Any,
+    Optional,
+    List,
+    Tuple,
+)
 
 import numpy as np
 import pandas as pd
@@ -29,27 +39,232 @@ class SampleDataset(Sequence, Dataset):
     def __len__(self):
         return self.n_samples
 
+    def get_batch(self, indices: torch.LongTensor) -> Dict[str, torch.Tensor]:
+        # One indexing operation for each variable, with the same format as the collated entries
+        batch = {}
+        for name, value in self.samples.items():
+            if torch.is_tensor(value):
+                value = value[indices.to(value.device)]
+            else:
+                value = torch.as_tensor(value[indices.numpy()])
+            if value.ndim == 1:
+                value = value.unsqueeze(-1)
+            batch[name] = value
+        return batch
+
+    def valid_mask(self) -> np.ndarray:
+        # Entries without NaNs, computed with one vectorized pass for each variable
+        mask = torch.ones(self.n_samples, dtype=torch.bool)
+        for value in self.samples.values():
+            value = torch.as_tensor(value)
+            if value.is_floating_point() or value.is_complex():
+                mask &= (
+                    ~torch.isnan(value.reshape(self.n_samples, -1))
+                    .any(-1)
+                    .cpu()
+                )
+        return mask.numpy()
+
 
 class DataFrameDataset(Dataset):
-    def __init__(self, df: pd.DataFrame):
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        groups: Optional[Dict[str, List[str]]] = None,
+        integer_variables: Optional[List[str]] = None,
+    ):
+        """
+        Dataset backed by a pandas DataFrame, which is converted once into one contiguous array for each variable.
+        Numerical, boolean and categorical columns (as codes) are stored as float32 arrays of shape [N, 1], and
+        columns containing arrays are stacked.
+        :param df: the DataFrame.
+        :param groups: optional dictionary mapping the name of a variable to the list of (numerical) columns it
+            consists of. The columns that do not belong to any group are used as individual variables.
+        :param integer_variables: optional list of variables (columns or groups) with discrete values (e.g. quantized
+            or categorical inputs), which are stored as int64 arrays instead.
+        """
         if not isinstance(df, pd.DataFrame):
             raise ValueError("df is not an instance of pandas.DataFrame.")
         super().__init__()
-        self.df = df
+
+        if groups is None:
+            groups = {}
+        if integer_variables is None:
+            integer_variables = []
+
+        for name in integer_variables:
+            if not (name in groups) and not (name in df.columns):
+                raise ValueError(
+                    f"The integer variable {name} is neither a group nor a column of the DataFrame."
+                )
+
+        grouped_columns = set()
+        for name, columns in groups.items():
+            for column in columns:
+                if not (column in df.columns):
+                    raise ValueError(
+                        f"The column {column} of the group {name} is not in the DataFrame."
+                    )
+                if column in grouped_columns:
+                    raise ValueError(
+                        f"The column {column} is used in more than one group."
+                    )
+                grouped_columns.add(column)
+
+        self.n_samples = len(df)
+        self.data = {}
+        for name, columns in groups.items():
+            integer = name in integer_variables
+            self.data[name] = np.concatenate(
+                [
+                    self._column_to_array(df[column], integer=integer)
+                    for column in columns
+                ],
+                axis=1,
+            )
+
+        for column in df.columns:
+            if column in grouped_columns:
+                continue
+            if column in self.data:
+                raise ValueError(
+                    f"The name {column} refers to both a group and a column."
+                )
+            self.data[column] = self._column_to_array(
+                df[column], integer=column in integer_variables
+            )
+
+    @staticmethod
+    def _column_to_array(column: pd.Series, integer: bool) -> np.ndarray:
+        # Categorical values are replaced by their codes
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.cat.codes
+
+        if integer:
+            if (
+                not (
+                    pd.api.types.is_integer_dtype(column.dtype)
+                    or pd.api.types.is_bool_dtype(column.dtype)
+                )
+                or column.hasnans
+            ):
+                raise ValueError(
+                    f"The column {column.name} does not contain integer values without missing entries."
+                )
+            return column.to_numpy(dtype=np.int64).reshape(-1, 1)
+        if pd.api.types.is_numeric_dtype(column.dtype):
+            return column.to_numpy(dtype=np.float32, na_value=np.nan).reshape(
+                -1, 1
+            )
+
+        values = column.to_numpy()
+
+        # Columns containing arrays are stacked if all the arrays have the same shape
+        values = [
+            value
+            if isinstance(value, np.ndarray)
+            else np.array([value], dtype=np.float32).reshape(-1)
+            for value in values
+        ]
+        try:
+            return np.stack(values)
+        except ValueError:
+            # Otherwise, the arrays are stored (and batched) one by one
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array
 
     def __len__(self):
-        return len(self.df)
+        return self.n_samples
+
+    def valid_mask(self) -> np.ndarray:
+        mask = np.ones(self.n_samples, dtype=bool)
+        for value in self.data.values():
+            if value.dtype == object:
+                mask &= np.array(
+                    [not np.any(pd.isna(entry)) for entry in value],
+                    dtype=bool,
+                )
+            elif np.issubdtype(value.dtype, np.inexact):
+                mask &= ~np.isnan(value.reshape(self.n_samples, -1)).any(-1)
+        return mask
+
+    def get_batch(self, indices: torch.LongTensor) -> Dict[str, torch.Tensor]:
+        indices = indices.numpy()
+        batch = {}
+        for name, value in self.data.items():
+            value = value[indices]
+            if value.dtype == object:
+                value = np.stack(value)
+            batch[name] = torch.as_tensor(value)
+        return batch
 
     def __getitem__(self, item):
-        values = {
-            k: v
-            if isinstance(v, np.ndarray)
-            else np.array([v], dtype=np.int32).reshape(-1)
-            if isinstance(v, int)
-            else np.array([v], dtype=np.float32).reshape(-1)
-            for k, v in dict(self.df.iloc[item]).items()
+        return {name: value[item] for name, value in self.data.items()}
+
+
+def group_columns(
+    columns: List[str], variables: Optional[List[str]] = None
+) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Group the columns named from <name>_1 to <name>_N into variables.
+    :param columns: the names of the columns.
+    :param variables: if specified, only the columns of these variables are selected.
+    :return: the names of the variables and the dictionary mapping each variable to its columns.
+    """
+    selected = []
+    variable_cols = defaultdict(list)
+    last_variable = None
+    for column in columns:
+        variable = "_".join(column.split("_")[:-1])
+        if not (variables is None) and not (variable in variables):
+            continue
+        idx = int(column.split("_")[-1])
+        variable_cols[variable].append(column)
+        if variable != last_variable:
+            assert not (variable in selected)
+            selected.append(variable)
+            last_variable = variable
+
+        if idx != len(variable_cols[variable]):
+            raise ValueError(
+                "To avoid ambiguities, please make sure the columns are sorted"
+                + " from <name>_1 to <name>_N"
+            )
+
+    if not (variables is None):
+        for variable in variables:
+            if not (variable in variable_cols):
+                raise ValueError(
+                    f"No column corresponds to the variable {variable}. "
+                    + "Please make sure the columns are named from <name>_1 to <name>_N"
+                )
+
+    return selected, variable_cols
+
+
+class ColumnarDataset(Dataset):
+    # Base class for the datasets that store each variable as a float32 array of shape [N, dim]
+    data: Dict[str, np.ndarray]
+
+    def __len__(self):
+        return len(next(iter(self.data.values())))
+
+    def get_batch(self, indices: torch.LongTensor) -> Dict[str, torch.Tensor]:
+        indices = indices.numpy()
+        return {
+            k: torch.as_tensor(np.asarray(v[indices]))
+            for k, v in self.data.items()
         }
-        return values
+
+    def valid_mask(self) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        for value in self.data.values():
+            mask &= ~np.isnan(value).reshape(len(self), -1).any(-1)
+        return mask
+
+    def __getitem__(self, index):
+        return {k: np.array(v[index]) for k, v in self.data.items()}
 
 
 class DistributionDataset(Dataset):
@@ -59,6 +274,10 @@ class DistributionDataset(Dataset):
         max_samples: int = 100000,
         split_dim: int = -1,
     ):
+        """
+        Dataset of max_samples entries sampled from a (joint) distribution. The entries are sampled at each access.
+        Slices (e.g. from a BatchSliceSampler) and get_batch() sample a whole batch with one call.
+        """
         self.joint_dist = joint_dist
         self._n_samples = max_samples
         self.split_dim = split_dim
@@ -66,17 +285,31 @@ class DistributionDataset(Dataset):
     def __len__(self) -> int:
         return self._n_samples
 
+    def _sample(self, n_samples: Optional[int] = None) -> Any:
+        sample_shape = (
+            torch.Size([]) if n_samples is None else torch.Size([n_samples])
+        )
+        return self.joint_dist.sample(sample_shape)
+
+    def get_batch(self, indices: torch.LongTensor) -> Any:
+        return self._sample(len(indices))
+
+    def valid_mask(self) -> np.ndarray:
+        # The entries are drawn at each access, so they can not be filtered in advance
+        return np.ones(self._n_samples, dtype=bool)
+
     def __getitem__(self, idx) -> Union[Dict[str, torch.Tensor], torch.Tensor]:
-        if isinstance(idx, int):
-            sample_shape = torch.Size([])
+        if isinstance(idx, (int, np.integer)):
+            if not (-self._n_samples <= idx < self._n_samples):
+                raise IndexError(
+                    f"Index {idx} is out of range for a dataset of size {self._n_samples}."
+                )
+            return self._sample()
         elif isinstance(idx, slice):
-            sample_shape = torch.Size([len(idx.indices(self._n_samples))])
+            return self._sample(len(range(*idx.indices(self._n_samples))))
         else:
             raise ValueError("Please use int or slices for indexing.")
 
-        samples = self.joint_dist.sample(sample_shape)
-        return samples
-
 
 class WrappedDataset(Dataset):
     def __init__(self, dataset: Dataset, func: Callable):
@@ -1,12 +1,26 @@
-from typing import Dict, Union, Callable, Any
+from typing import (
+    Dict,
+    Union,
+    Callable,
+    Any,
+    Iterator,
+    Optional,
+    Tuple,
+    Hashable,
+)
 
 import numpy as np
 import torch
 from torch.utils.data import (
     DataLoader,
     Dataset,
+    Subset,
+    RandomSampler,
+    SequentialSampler,
 )
 
+from torch.utils.data._utils.pin_memory import pin_memory
+
 from torch_mist.utils.data.sampler import SameAttributeSampler
 
 
@@ -17,7 +31,7 @@ class SameAttributeDataLoader(DataLoader):
         attributes: Union[torch.Tensor, np.ndarray],
         batch_size: int,
         neg_samples: int,
-        **kwargs
+        **kwargs,
     ):
         if len(dataset) != len(attributes):
             raise Exception(
@@ -31,7 +45,7 @@ class SameAttributeDataLoader(DataLoader):
                 batch_size=batch_size,
                 neg_samples=neg_samples,
             ),
-            **kwargs
+            **kwargs,
         )
 
 
@@ -55,14 +69,26 @@ def sample_same_attributes(
     )
 
 
-def sample_same_value(
+DEFAULT_ATTRIBUTES_BATCH_SIZE = 4096
+
+
+def _compute_values(
+    dataset: Dataset,
+    indices: torch.LongTensor,
+    func: Callable[[Any], torch.Tensor],
     dataloader: DataLoader,
-    func: Callable[[Any], Any],
-    neg_samples: int,
-) -> DataLoader:
-    ordered_dataloader = DataLoader(
-        dataset=dataloader.dataset,
-        batch_size=dataloader.batch_size,
+    batch_size: int,
+) -> torch.Tensor:
+    # The values are computed in order with large batches and gathered on the device of func before one transfer
+    subset = Subset(dataset, indices.tolist())
+    loader_class = (
+        InMemoryDataLoader
+        if supports_batch_indexing(subset) and dataloader.num_workers == 0
+        else DataLoader
+    )
+    ordered_dataloader = loader_class(
+        subset,
+        batch_size=batch_size,
         num_workers=dataloader.num_workers,
         prefetch_factor=dataloader.prefetch_factor,
         pin_memory=dataloader.pin_memory,
@@ -73,12 +99,138 @@ def sample_same_value(
         shuffle=False,
     )
 
-    attributes = []
-    for batch in ordered_dataloader:
-        attributes.append(func(batch))
+    values = []
+    with torch.inference_mode():
+        for batch in ordered_dataloader:
+            values.append(func(batch))
+
+    return torch.cat(values, 0).cpu()
+
+
+def sample_same_value(
+    dataloader: DataLoader,
+    func: Callable[[Any], Any],
+    neg_samples: int,
+    cache_key: Optional[Hashable] = None,
+    batch_size: int = DEFAULT_ATTRIBUTES_BATCH_SIZE,
+) -> DataLoader:
+    """
+    Make a dataloader in which the batches are made of groups of neg_samples+1 entries with the same value of func.
+    :param dataloader: the original dataloader.
+    :param func: function computing the values (attributes) for a batch of entries.
+    :param neg_samples: number of entries with the same value of each entry in the batch.
+    :param cache_key: if specified, the values are cached on the underlying dataset (the one wrapped by the subsets),
+        and re-used by the dataloaders of the same dataset (or its subsets) with the same cache_key. Only the values
+        of the most recent cache_key are stored.
+    :param batch_size: batch size used to compute the values.
+    """
+    dataset, index_map = _resolve_subsets(dataloader.dataset)
+    if index_map is None:
+        index_map = torch.arange(len(dataset))
+
+    if cache_key is None:
+        attributes = _compute_values(
+            dataset, index_map, func, dataloader, batch_size
+        )
+    else:
+        cache = getattr(dataset, "_attributes_cache", None)
+        if cache is None or cache["key"] != cache_key:
+            cache = {
+                "key": cache_key,
+                "values": None,
+                "computed": torch.zeros(len(dataset), dtype=torch.bool),
+            }
+            dataset._attributes_cache = cache
+
+        # Only the values that have not been computed yet
+        missing = torch.unique(index_map[~cache["computed"][index_map]])
+        if len(missing) > 0:
+            values = _compute_values(
+                dataset, missing, func, dataloader, batch_size
+            )
+            if cache["values"] is None:
+                cache["values"] = torch.empty(
+                    (len(dataset),) + values.shape[1:], dtype=values.dtype
+                )
+            cache["values"][missing] = values
+            cache["computed"][missing] = True
 
-    attributes = torch.cat(attributes, 0)
+        attributes = cache["values"][index_map]
 
     return sample_same_attributes(
         dataloader, attributes, neg_samples=neg_samples
     )
+
+
+def _resolve_subsets(
+    dataset: Dataset,
+) -> Tuple[Dataset, Optional[torch.LongTensor]]:
+    # Map the indices of (nested) subsets to the indices of the underlying dataset
+    index_map = None
+    while isinstance(dataset, Subset):
+        indices = torch.as_tensor(dataset.indices, dtype=torch.long)
+        index_map = indices if index_map is None else indices[index_map]
+        dataset = dataset.dataset
+    return dataset, index_map
+
+
+def supports_batch_indexing(dataset: Dataset) -> bool:
+    dataset, _ = _resolve_subsets(dataset)
+    return hasattr(dataset, "get_batch")
+
+
+class InMemoryDataLoader(DataLoader):
+    def __init__(self, dataset: Dataset, **kwargs):
+        """
+        DataLoader for datasets stored in memory that implement get_batch(indices) (such as SampleDataset,
+        DataFrameDataset and CSVDataset), or subsets of them.
+        Each batch is gathered with one indexing operation instead of collating the entries one at a time.
+        The batches are loaded in the main process, so num_workers is not used.
+        """
+        super().__init__(dataset, **kwargs)
+        if self.num_workers > 0:
+            print(
+                f"[Warning]: {self.__class__.__name__} loads the batches in the main process, num_workers={self.num_workers} is ignored."
+            )
+        self._source, self._index_map = _resolve_subsets(dataset)
+        if not hasattr(self._source, "get_batch"):
+            raise ValueError(
+                f"{self._source.__class__.__name__} does not implement get_batch()."
+            )
+
+    def _get_batch(self, indices: torch.LongTensor) -> Any:
+        if not (self._index_map is None):
+            indices = self._index_map[indices]
+        batch = self._source.get_batch(indices)
+        if self.pin_memory and torch.cuda.is_available():
+            # Pin the tensors of any (nested) batch structure
+            batch = pin_memory(batch)
+        return batch
+
+    def _batch_indices(self) -> Iterator[torch.LongTensor]:
+        n_samples = len(self.dataset)
+        if isinstance(self.sampler, RandomSampler):
+            # One permutation for each epoch, drawn from the global random state (as for RandomSampler)
+            seed = int(
+                torch.empty((), dtype=torch.int64)
+                .random_(generator=self.generator)
+                .item()
+            )
+            generator = torch.Generator()
+            generator.manual_seed(seed)
+            permutation = torch.randperm(n_samples, generator=generator)
+        elif isinstance(self.sampler, SequentialSampler):
+            permutation = torch.arange(n_samples)
+        else:
+            for indices in self.batch_sampler:
+                yield torch.as_tensor(indices, dtype=torch.long)
+            return
+
+        for batch_indices in permutation.split(self.batch_size):
+            if self.drop_last and len(batch_indices) < self.batch_size:
+                break
+            yield batch_indices
+
+    def __iter__(self) -> Iterator[Any]:
+        for indices in self._batch_indices():
+            yield self._get_batch(indices)
@@ -0,0 +1,122 @@
+import os
+from typing import Optional, List, Dict
+
+import numpy as np
+
+from torch_mist.utils.data.dataset import ColumnarDataset, group_columns
+
+
+def _is_column(name: str) -> bool:
+    # Columns are named from <name>_1 to <name>_N
+    return "_" in name and name.rsplit("_", 1)[1].isdigit()
+
+
+class NumpyDataset(ColumnarDataset):
+    def __init__(
+        self,
+        filepath: str,
+        variables: Optional[List[str]] = None,
+        mmap: bool = True,
+    ):
+        """
+        Dataset of the variables stored in a .npz or .npy file.
+        In .npz files, each variable is either stored as one array of shape [N, dim] (or [N]) named after the
+        variable, or as one array of shape [N] for each column, named from <name>_1 to <name>_N.
+        In .npy files, the variables are the fields of a structured array, named from <name>_1 to <name>_N.
+        :param filepath: path to the .npz or .npy file.
+        :param variables: if specified, only the arrays (or fields) of these variables are read.
+        :param mmap: memory-map .npy files instead of loading them in memory. Fields already stored as float32 are
+            not copied.
+        """
+        super().__init__()
+
+        if not os.path.isfile(filepath):
+            raise ValueError(f"{os.path.abspath(filepath)} does not exist.")
+
+        self.filepath = filepath
+        if filepath.endswith(".npz"):
+            self.data = self._load_npz(variables)
+        elif filepath.endswith(".npy"):
+            self.data = self._load_npy(variables, mmap)
+        else:
+            raise ValueError(
+                f"Unsupported file extension for {filepath}. Please use .npz or .npy."
+            )
+
+        lengths = [len(value) for value in self.data.values()]
+        if not all([length == lengths[0] for length in lengths]):
+            raise ValueError("All the variables must have the same length.")
+
+        print(f"The file '{filepath}' has columns:")
+        for variable, value in self.data.items():
+            print(f"  '{variable}' with shape {value.shape}")
+
+    def _load_npz(
+        self, variables: Optional[List[str]]
+    ) -> Dict[str, np.ndarray]:
+        # The arrays in a .npz file are read lazily, only the selected ones are loaded
+        with np.load(self.filepath) as arrays:
+            names = list(arrays.keys())
+            loaded = {
+                name: arrays[name]
+                for name in names
+                if variables is None or name in variables
+            }
+            # 1-D arrays that are not named as columns are variables of shape [N, 1]
+            whole = [
+                name
+                for name, value in loaded.items()
+                if value.ndim != 1 or not _is_column(name)
+            ]
+            columns = [
+                name
+                for name in names
+                if _is_column(name) and not (name in whole)
+            ]
+            if variables is None:
+                selected, variable_cols = group_columns(columns)
+            else:
+                # The variables that are not stored as a whole are assembled from their columns
+                selected, variable_cols = group_columns(
+                    columns, [v for v in variables if not (v in whole)]
+                )
+
+            data = {
+                name: loaded[name]
+                .reshape(len(loaded[name]), -1)
+                .astype(np.float32, copy=False)
+                for name in whole
+            }
+            for variable in selected:
+                data[variable] = np.stack(
+                    [
+                        loaded[column] if column in loaded else arrays[column]
+                        for column in variable_cols[variable]
+                    ],
+                    axis=1,
+                ).astype(np.float32, copy=False)
+        return data
+
+    def _load_npy(
+        self, variables: Optional[List[str]], mmap: bool
+    ) -> Dict[str, np.ndarray]:
+        array = np.load(self.filepath, mmap_mode="r" if mmap else None)
+        if array.dtype.names is None:
+            raise ValueError(
+                ".npy files must contain a structured array with fields named from <name>_1 to <name>_N."
+            )
+        selected, variable_cols = group_columns(
+            list(array.dtype.names), variables
+        )
+
+        data = {}
+        for variable in selected:
+            fields = variable_cols[variable]
+            if len(fields) == 1 and array.dtype[fields[0]] == np.float32:
+                # A view on the (memory-mapped) field
+                data[variable] = array[fields[0]].reshape(-1, 1)
+            else:
+                data[variable] = np.stack(
+                    [array[field] for field in fields], axis=1
+                ).astype(np.float32, copy=False)
+        return data
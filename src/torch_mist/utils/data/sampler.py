@@ -1,8 +1,7 @@
 from torch.utils.data import Sampler
-from typing import Union, Optional
+from typing import Union
 import torch
 import numpy as np
-from collections import Counter
 
 
 class SameAttributeSampler(Sampler):
@@ -12,7 +11,7 @@ class SameAttributeSampler(Sampler):
         neg_samples: int,
         attributes: Union[torch.Tensor, np.ndarray],
     ):
-        super(SameAttributeSampler, self).__init__(attributes)
+        # Note that Sampler.__init__ does not take the data source in recent versions of torch
 
         # Whenever the number of negatives is specified as 0 or negative, we produce whole batches of negatives
         if neg_samples <= 0:
@@ -24,97 +23,87 @@ class SameAttributeSampler(Sampler):
 
         assert attributes is not None
         if isinstance(attributes, torch.Tensor):
-            attributes = attributes.data.numpy()
+            attributes = attributes.data.cpu().numpy()
         if attributes.ndim == 2:
             assert attributes.shape[1] == 1
             attributes = attributes.reshape(-1)
-        attributes = attributes.astype(np.int32)
+        attributes = attributes.astype(np.int64)
 
-        assert min(attributes) == 0, "Attributes should start from 0"
-        counts = np.bincount(attributes, minlength=max(attributes))
-        for attribute, count in enumerate(counts):
-            assert (
-                count >= neg_samples
-            ), f"The attribute count for {attribute} is less than the number of negatives, please use neg_samples<={count}"
+        assert attributes.min() == 0, "Attributes should start from 0"
+        counts = np.bincount(attributes)
+        too_few = np.nonzero(counts < neg_samples)[0]
+        assert (
+            len(too_few) == 0
+        ), f"The attribute count for {too_few[0]} is less than the number of negatives, please use neg_samples<={counts[too_few[0]]}"
 
-        self.n_attributes = max(attributes) + 1
+        self.attributes = attributes
+        self.n_attributes = len(counts)
         self.neg_samples = neg_samples + 1
         self.batch_size = batch_size
         self.chunks_per_batch = self.batch_size // self.neg_samples
-        self.a_ids = {}
-        self.n_chunks = []
-        for a in range(self.n_attributes):
-            a_ids = np.arange(len(attributes))[attributes == a]
-            self.a_ids[a] = a_ids
-            self.n_chunks.append(a_ids.shape[0] // self.neg_samples)
-
-        self.chunked_attributes = []
-        for a, n in enumerate(self.n_chunks):
-            self.chunked_attributes += [a] * n
-
-        self._len = None
-
-    #
-    # def make_batch(self, shuffled_a_ids, n_valid) -> np.ndarray:
-    #     # Determine which attributes are included in the batch
-    #     att_samples = np.random.choice(n_valid.sum(), self.batch_size // self.neg_samples, replace=False)
-    #     cdf = np.cumsum(n_valid)
-    #     sampled_atts = list(np.sum(att_samples.reshape(-1, 1) >= cdf.reshape(1, -1), -1))
-    #     att_counts = Counter(sampled_atts)
-    #
-    #     ids = []
-    #     for a, count in att_counts.items():
-    #         if n_valid[a] == count:
-    #             abs_ids = shuffled_a_ids[a][-n_valid[a]:]
-    #         else:
-    #             abs_ids = shuffled_a_ids[a][-n_valid[a]:-n_valid[a]+count]
-    #
-    #         n_valid[a] -= count
-    #         # Add them to the sampled ids
-    #         if len(ids) == 0:
-    #             ids = abs_ids
-    #         else:
-    #             ids = np.concatenate([ids, abs_ids], 0)
-    #     return ids.reshape(-1, self.neg_samples).T.reshape(-1)
 
-    def __iter__(self):
-        shuffled_a_ids = {}
-        # Shuffle the ids for each attributes
-        for a, att_ids in self.a_ids.items():
-            permutation = np.random.permutation(att_ids)
-            # Keep multiples of neg_samples
-            permutation = permutation[
-                : (permutation.shape[0] // self.neg_samples) * self.neg_samples
-            ]
-            shuffled_a_ids[a] = permutation.reshape(
-                -1,
-                self.neg_samples,
+        # The ids sorted by attribute form one contiguous segment for each attribute.
+        # Each segment is split in chunks of neg_samples ids (the remainder is not used).
+        segment_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        self.n_chunks = counts // self.neg_samples
+        chunk_attributes = np.repeat(
+            np.arange(self.n_attributes), self.n_chunks
+        )
+        first_chunk = np.concatenate([[0], np.cumsum(self.n_chunks)[:-1]])
+        self.chunk_starts = (
+            segment_starts[chunk_attributes]
+            + (
+                np.arange(len(chunk_attributes))
+                - first_chunk[chunk_attributes]
             )
+            * self.neg_samples
+        )
 
-        shuffled_a_chunks = np.random.permutation(self.chunked_attributes)
-        shuffled_a_chunks = shuffled_a_chunks[
-            : (len(shuffled_a_chunks) // self.chunks_per_batch)
-            * self.chunks_per_batch
-        ]
-        shuffled_a_chunks = shuffled_a_chunks.reshape(
-            -1, self.chunks_per_batch
+    def _make_batches(self) -> np.ndarray:
+        # Sort the ids by attribute, shuffling the ids with the same attribute
+        shuffled_ids = np.lexsort(
+            (np.random.random(len(self.attributes)), self.attributes)
         )
 
-        id_pointers = {a: 0 for a in shuffled_a_ids}
-        for chunk in shuffled_a_chunks:
-            batch_ids = []
-            for a in chunk:
-                batch_ids += list(shuffled_a_ids[a][id_pointers[a]])
-                id_pointers[a] += 1
+        # Shuffle the chunks, and keep multiples of chunks_per_batch
+        n_batches = len(self)
+        chunk_starts = np.random.permutation(self.chunk_starts)[
+            : n_batches * self.chunks_per_batch
+        ].reshape(n_batches, 1, self.chunks_per_batch)
 
-            yield np.array(batch_ids).reshape(-1, self.neg_samples).T.reshape(
-                -1
-            )
+        # The i-th neg_samples block of each batch contains the i-th entry of each chunk
+        positions = chunk_starts + np.arange(self.neg_samples).reshape(
+            1, -1, 1
+        )
+        return shuffled_ids[positions].reshape(n_batches, self.batch_size)
+
+    def __iter__(self):
+        # All the batches of the epoch are computed at once
+        yield from self._make_batches()
 
     def __len__(self):
-        n_neg_samples = 0
-        for a, atts in self.a_ids.items():
-            n_neg_samples += len(atts) // self.neg_samples
+        return len(self.chunk_starts) // self.chunks_per_batch
 
-        n_batches = n_neg_samples // (self.batch_size // self.neg_samples)
-        return n_batches
+
+class BatchSliceSampler(Sampler):
+    def __init__(
+        self, n_samples: int, batch_size: int, drop_last: bool = False
+    ):
+        """
+        Sampler yielding one slice for each batch, to be used with DataLoader(..., batch_size=None) for datasets that
+        load (or sample) a whole batch from a slice, such as DistributionDataset.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            yield slice(start, min(start + self.batch_size, self.n_samples))
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return (self.n_samples + self.batch_size - 1) // self.batch_size
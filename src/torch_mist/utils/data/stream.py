@@ -0,0 +1,212 @@
+import random
+from typing import Callable, Optional, Tuple, Any, Union, List
+
+import torch
+from torch.utils.data import (
+    Dataset,
+    IterableDataset,
+    DataLoader,
+    default_collate,
+    get_worker_info,
+)
+
+from torch_mist.distributions import JointDistribution
+from torch_mist.utils.data.dataset import SampleDataset
+
+_MASK_64 = (1 << 64) - 1
+
+
+def is_iterable_dataset(dataset: Any) -> bool:
+    return isinstance(dataset, IterableDataset)
+
+
+def has_length(data: Union[Dataset, DataLoader]) -> bool:
+    # DataLoaders (and datasets) of streams do not necessarily have a length
+    try:
+        len(data)
+    except TypeError:
+        return False
+    return True
+
+
+def _draw_seed() -> int:
+    # Seeds are drawn from the torch random state, so that they are reproducible with torch.manual_seed
+    return int(torch.empty((), dtype=torch.int64).random_().item())
+
+
+def _uniform_hash(index: int, seed: int) -> float:
+    # splitmix64 hash of the index, mapped to [0, 1)
+    z = (index + (seed + 1) * 0x9E3779B97F4A7C15) & _MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    z ^= z >> 31
+    return z / 2.0**64
+
+
+class HashSplitDataset(IterableDataset):
+    def __init__(
+        self,
+        dataset: IterableDataset,
+        valid_percentage: float,
+        valid: bool,
+        seed: int,
+    ):
+        """
+        One side of a random train/validation split of a stream.
+        Each entry is assigned to the validation split by hashing its position in the stream, so the two splits are
+        disjoint as long as the stream yields the entries in the same order at each pass.
+        :param dataset: the stream to split.
+        :param valid_percentage: the fraction of entries in the validation split.
+        :param valid: if True, yield the validation entries, otherwise the training ones.
+        :param seed: the seed of the hash function. The two sides of a split must use the same seed.
+        """
+        super().__init__()
+        self.dataset = dataset
+        self.valid_percentage = valid_percentage
+        self.valid = valid
+        self.seed = seed
+
+    def __iter__(self):
+        for i, entry in enumerate(self.dataset):
+            if (
+                _uniform_hash(i, self.seed) < self.valid_percentage
+            ) == self.valid:
+                yield entry
+
+
+def split_iterable_dataset(
+    dataset: IterableDataset, valid_percentage: float
+) -> Tuple[HashSplitDataset, HashSplitDataset]:
+    seed = _draw_seed()
+    return (
+        HashSplitDataset(dataset, valid_percentage, valid=False, seed=seed),
+        HashSplitDataset(dataset, valid_percentage, valid=True, seed=seed),
+    )
+
+
+class ShuffleBufferDataset(IterableDataset):
+    def __init__(self, dataset: IterableDataset, buffer_size: int):
+        """
+        Approximately shuffle a stream by sampling the entries from a buffer of buffer_size entries.
+        The order is different at each pass, and determined by the torch random state.
+        """
+        super().__init__()
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be a positive integer.")
+        self.dataset = dataset
+        self.buffer_size = buffer_size
+
+    def __iter__(self):
+        generator = random.Random(_draw_seed())
+        buffer = []
+        for entry in self.dataset:
+            if len(buffer) < self.buffer_size:
+                buffer.append(entry)
+            else:
+                i = generator.randrange(self.buffer_size)
+                yield buffer[i]
+                buffer[i] = entry
+
+        generator.shuffle(buffer)
+        yield from buffer
+
+
+class FilteredIterableDataset(IterableDataset):
+    def __init__(self, dataset: IterableDataset, condition: Callable):
+        # The entries of the stream are filtered while iterating
+        super().__init__()
+        self.dataset = dataset
+        self.condition = condition
+
+    def __iter__(self):
+        for entry in self.dataset:
+            if self.condition(entry):
+                yield entry
+
+
+class DistributionStreamDataset(IterableDataset):
+    def __init__(
+        self,
+        joint_dist: JointDistribution,
+        batch_size: int,
+        max_batches: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        """
+        Infinite stream of batches sampled from a joint distribution, each drawn with one call.
+        The stream yields whole batches, so it is meant to be used with DataLoader(..., batch_size=None).
+        :param joint_dist: the distribution to sample from.
+        :param batch_size: the number of samples in each batch.
+        :param max_batches: if specified, the total number of batches (split among the workers).
+        :param seed: if specified, each worker samples with its own (cpu) random state seeded with seed+worker_id,
+            without changing the global random state. Otherwise, the samples are drawn from the global random state,
+            which is seeded differently for each worker by the DataLoader.
+        """
+        super().__init__()
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        self.joint_dist = joint_dist
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.seed = seed
+
+    def _sample(self) -> Any:
+        return self.joint_dist.sample(torch.Size([self.batch_size]))
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+
+        n_batches = None
+        if not (self.max_batches is None):
+            n_batches = self.max_batches // num_workers + (
+                worker_id < self.max_batches % num_workers
+            )
+
+        rng_state = None
+        if not (self.seed is None):
+            with torch.random.fork_rng(devices=[]):
+                torch.manual_seed(self.seed + worker_id)
+                rng_state = torch.get_rng_state()
+
+        i = 0
+        while n_batches is None or i < n_batches:
+            if rng_state is None:
+                yield self._sample()
+            else:
+                with torch.random.fork_rng(devices=[]):
+                    torch.set_rng_state(rng_state)
+                    samples = self._sample()
+                    rng_state = torch.get_rng_state()
+                yield samples
+            i += 1
+
+
+def reservoir_sample(
+    dataset: IterableDataset,
+    n_samples: int,
+    max_entries: Optional[int] = None,
+) -> Union[SampleDataset, List[Any]]:
+    """
+    Uniformly sample n_samples entries from a stream with reservoir sampling, e.g. to obtain a fixed validation set.
+    :param dataset: the stream.
+    :param n_samples: the number of entries to sample.
+    :param max_entries: if specified, only the first max_entries entries of the stream are considered.
+    :return: a SampleDataset if the entries are dictionaries, the list of entries otherwise.
+    """
+    generator = random.Random(_draw_seed())
+    reservoir = []
+    for i, entry in enumerate(dataset):
+        if not (max_entries is None) and i >= max_entries:
+            break
+        if i < n_samples:
+            reservoir.append(entry)
+        else:
+            j = generator.randint(0, i)
+            if j < n_samples:
+                reservoir[j] = entry
+
+    if len(reservoir) > 0 and isinstance(reservoir[0], dict):
+        return SampleDataset(default_collate(reservoir))
+    return reservoir
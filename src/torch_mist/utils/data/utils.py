@@ -1,15 +1,41 @@
+import hashlib
+import itertools
+import os
 from typing import Optional, Union, Tuple, Dict, Callable, List, Any
 
 import numpy as np
 import pandas as pd
 import torch
-from torch.utils.data import DataLoader, random_split, Dataset, Subset
+from torch import nn
+from torch.utils.data import (
+    DataLoader,
+    random_split,
+    Dataset,
+    Subset,
+    ConcatDataset,
+)
 
 from torch_mist.estimators import MIEstimator, TransformedMIEstimator
 from torch_mist.estimators.hybrid import PQHybridMIEstimator
-from torch_mist.utils.data import SampleDataset, SameAttributeDataLoader
+from torch_mist.utils.data import (
+    SampleDataset,
+    SameAttributeDataLoader,
+    CSVDataset,
+    NumpyDataset,
+)
 from torch_mist.utils.data.dataset import DataFrameDataset
-from torch_mist.utils.data.loader import sample_same_value
+from torch_mist.utils.data.loader import (
+    sample_same_value,
+    supports_batch_indexing,
+    InMemoryDataLoader,
+)
+from torch_mist.utils.data.stream import (
+    is_iterable_dataset,
+    split_iterable_dataset,
+    ShuffleBufferDataset,
+    FilteredIterableDataset,
+    reservoir_sample,
+)
 
 
 TensorDictLike = Union[
@@ -18,6 +44,7 @@ TensorDictLike = Union[
     Dataset,
     DataLoader,
     pd.DataFrame,
+    str,
 ]
 
 
@@ -87,7 +114,56 @@ def is_valid_entry(
         return True
 
 
-def make_dataset(data: TensorDictLike) -> Dataset:
+def load_dataset(
+    filepath: str, variables: Optional[List[str]] = None, **kwargs
+) -> Dataset:
+    """
+    Load the dataset stored in a file, depending on its extension (.csv, .npz, .npy, .parquet, .arrow or .feather).
+    :param filepath: path to the file.
+    :param variables: if specified, only the columns of these variables are read.
+    :param kwargs: additional arguments for the dataset.
+    """
+    extension = os.path.splitext(filepath)[-1].lower()
+    if extension == ".csv":
+        return CSVDataset(filepath, variables=variables, **kwargs)
+    elif extension in [".npz", ".npy"]:
+        return NumpyDataset(filepath, variables=variables, **kwargs)
+    elif extension in [".parquet", ".pq"]:
+        # pyarrow is required only for these formats
+        from torch_mist.utils.data.arrow import ParquetDataset
+
+        return ParquetDataset(filepath, variables=variables, **kwargs)
+    elif extension in [".arrow", ".feather", ".ipc"]:
+        from torch_mist.utils.data.arrow import ArrowDataset
+
+        return ArrowDataset(filepath, variables=variables, **kwargs)
+    else:
+        raise ValueError(
+            f"Unsupported file extension {extension}. "
+            + "Please use .csv, .npz, .npy, .parquet, .arrow or .feather files."
+        )
+
+
+def make_dataset(
+    data: TensorDictLike,
+    groups: Optional[Dict[str, List[str]]] = None,
+    integer_variables: Optional[List[str]] = None,
+) -> Dataset:
+    """
+    Convert the data into a dataset.
+    :param data: the data (a tuple (x, y), a dictionary, a pandas.DataFrame, a path to a file or a dataset).
+    :param groups: for DataFrames, optional dictionary mapping the name of a variable to the list of the columns it
+        consists of (see DataFrameDataset).
+    :param integer_variables: for DataFrames, optional list of the variables stored as integers instead of floats
+        (see DataFrameDataset).
+    """
+    if not (groups is None and integer_variables is None) and not isinstance(
+        data, pd.DataFrame
+    ):
+        raise ValueError(
+            "groups and integer_variables can be specified only for DataFrames."
+        )
+
     # Validate the input combinations
     if isinstance(data, list) or isinstance(data, tuple):
         if len(data) != 2:
@@ -107,19 +183,41 @@ def make_dataset(data: TensorDictLike) -> Dataset:
     elif isinstance(data, dict):
         dataset = SampleDataset(data)
     elif isinstance(data, pd.DataFrame):
-        dataset = DataFrameDataset(data)
+        dataset = DataFrameDataset(
+            data, groups=groups, integer_variables=integer_variables
+        )
+    elif isinstance(data, str):
+        dataset = load_dataset(data)
     else:
         dataset = data
 
     return dataset
 
 
+def compute_valid_mask(dataset: Dataset) -> np.ndarray:
+    # Datasets backed by arrays compute the mask of the valid entries (without NaNs) with vectorized operations
+    if hasattr(dataset, "valid_mask"):
+        return np.asarray(dataset.valid_mask(), dtype=bool)
+    elif isinstance(dataset, Subset):
+        return compute_valid_mask(dataset.dataset)[
+            np.asarray(dataset.indices, dtype=np.int64)
+        ]
+    elif isinstance(dataset, ConcatDataset):
+        return np.concatenate(
+            [compute_valid_mask(d) for d in dataset.datasets]
+        )
+
+    # Check each entry for the other datasets
+    return np.array([is_valid_entry(entry) for entry in dataset], dtype=bool)
+
+
 def filter_dataset(dataset: Dataset):
+    # The invalid entries of streams are skipped while iterating
+    if is_iterable_dataset(dataset):
+        return FilteredIterableDataset(dataset, is_valid_entry)
+
     # Remove invalid entries
-    valid_ids = []
-    for idx, entry in enumerate(dataset):
-        if is_valid_entry(entry):
-            valid_ids.append(idx)
+    valid_ids = np.nonzero(compute_valid_mask(dataset))[0].tolist()
     if len(valid_ids) != len(dataset):
         print(
             f"[Warning]: Removing {len(dataset)-len(valid_ids)} entries from the dataset"
@@ -133,11 +231,47 @@ def is_data_loader(data: TensorDictLike):
     return isinstance(data, DataLoader)
 
 
+def _make_dataloader(
+    dataset: Dataset,
+    batch_size: int,
+    num_workers: int = 0,
+    shuffle: bool = True,
+    pin_memory: bool = False,
+    shuffle_buffer_size: int = 10000,
+) -> DataLoader:
+    # Streams are shuffled with a buffer, since the entries can not be accessed in a random order
+    if is_iterable_dataset(dataset):
+        if shuffle and shuffle_buffer_size > 1:
+            dataset = ShuffleBufferDataset(dataset, shuffle_buffer_size)
+        return DataLoader(
+            dataset,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            pin_memory=pin_memory,
+        )
+
+    # Datasets stored in memory are loaded one batch at a time instead of one entry at a time (in the main process)
+    if supports_batch_indexing(dataset) and num_workers == 0:
+        loader_class = InMemoryDataLoader
+    else:
+        loader_class = DataLoader
+
+    return loader_class(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        shuffle=shuffle,
+        pin_memory=pin_memory,
+    )
+
+
 def make_default_dataloader(
     data: TensorDictLike,
     batch_size: Optional[int] = None,
     num_workers: int = 0,
     filter_invalid_data: bool = True,
+    pin_memory: bool = False,
+    shuffle_buffer_size: int = 10000,
 ) -> DataLoader:
     if is_data_loader(data):
         dataloader = data
@@ -149,11 +283,13 @@ def make_default_dataloader(
         if filter_invalid_data:
             dataset = filter_dataset(dataset)
 
-        dataloader = DataLoader(
+        dataloader = _make_dataloader(
             dataset,
             batch_size=batch_size,
             num_workers=num_workers,
             shuffle=True,
+            pin_memory=pin_memory,
+            shuffle_buffer_size=shuffle_buffer_size,
         )
     return dataloader
 
@@ -165,7 +301,16 @@ def make_default_dataloaders(
     batch_size: Optional[int] = None,
     filter_invalid_data: bool = True,
     num_workers: int = 0,
+    pin_memory: bool = False,
+    shuffle_buffer_size: int = 10000,
+    max_valid_samples: Optional[int] = None,
 ) -> Tuple[DataLoader, Optional[DataLoader]]:
+    """
+    Make the train and validation dataloaders.
+    Streams (IterableDataset) are shuffled with a buffer of shuffle_buffer_size entries, and split into train and
+    validation by hashing the position of the entries. If max_valid_samples is specified, the validation entries of a
+    stream are reduced (with one pass) to max_valid_samples entries stored in memory.
+    """
     # Make the datasets if necessary
     if is_data_loader(data):
         train_loader = data
@@ -192,17 +337,25 @@ def make_default_dataloaders(
         valid_set = make_dataset(valid_data)
         valid_loader = None
 
-    if valid_set and filter_invalid_data:
+    if not (valid_set is None) and filter_invalid_data:
         valid_set = filter_dataset(valid_set)
 
     # Create a validation set if specified
     if valid_percentage > 0:
         if valid_set is None and valid_loader is None:
-            # Make a random train/valid split
-            n_valid = int(len(train_set) * valid_percentage)
-            train_set, valid_set = random_split(
-                train_set, [len(train_set) - n_valid, n_valid]
-            )
+            if is_iterable_dataset(train_set):
+                # Streams are split without knowing their length
+                train_set, valid_set = split_iterable_dataset(
+                    train_set, valid_percentage
+                )
+                if not (max_valid_samples is None):
+                    valid_set = reservoir_sample(valid_set, max_valid_samples)
+            else:
+                # Make a random train/valid split
+                n_valid = int(len(train_set) * valid_percentage)
+                train_set, valid_set = random_split(
+                    train_set, [len(train_set) - n_valid, n_valid]
+                )
             train_loader = None
         else:
             print(
@@ -210,19 +363,23 @@ def make_default_dataloaders(
             )
 
     if train_loader is None:
-        train_loader = DataLoader(
+        train_loader = _make_dataloader(
             train_set,
             batch_size=batch_size,
-            shuffle=True,
             num_workers=num_workers,
+            shuffle=True,
+            pin_memory=pin_memory,
+            shuffle_buffer_size=shuffle_buffer_size,
         )
 
     if valid_loader is None and not (valid_set is None):
-        valid_loader = DataLoader(
+        # The order of the validation entries is irrelevant, streams are not shuffled
+        valid_loader = _make_dataloader(
             valid_set,
             batch_size=batch_size,
             num_workers=num_workers,
-            shuffle=True,
+            shuffle=not is_iterable_dataset(valid_set),
+            pin_memory=pin_memory,
         )
 
     assert is_data_loader(train_loader)
@@ -231,6 +388,43 @@ def make_default_dataloaders(
     return train_loader, valid_loader
 
 
+def _module_state_hash(module: nn.Module) -> str:
+    # Hash of the state_dict of the module. The hash is computed once and stored on the module together with the
+    # version counters of its parameters and buffers, which are increased by any in-place update
+    # (optimizer steps, fit, load_state_dict). It is computed again only if the state has changed since.
+    versions = tuple(
+        (id(value), value._version)
+        for value in itertools.chain(module.parameters(), module.buffers())
+    )
+    cached = getattr(module, "_cached_state_hash", None)
+    if not (cached is None) and cached[0] == versions:
+        return cached[1]
+
+    state_hash = hashlib.sha1()
+    for name, value in module.state_dict().items():
+        state_hash.update(name.encode())
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu().contiguous().reshape(-1)
+            state_hash.update(str(value.dtype).encode())
+            state_hash.update(value.view(torch.uint8).numpy().tobytes())
+        else:
+            state_hash.update(repr(value).encode())
+    module._cached_state_hash = (versions, state_hash.hexdigest())
+    return module._cached_state_hash[1]
+
+
+def _state_hash(modules: List[Any]) -> str:
+    # Hash of the type and the state_dict of the modules
+    state_hash = hashlib.sha1()
+    for module in modules:
+        state_hash.update(type(module).__qualname__.encode())
+        if not isinstance(module, nn.Module):
+            state_hash.update(str(id(module)).encode())
+            continue
+        state_hash.update(_module_state_hash(module).encode())
+    return state_hash.hexdigest()
+
+
 def update_dataloader(
     estimator: MIEstimator,
     dataloader: DataLoader,
@@ -242,7 +436,7 @@ def update_dataloader(
     transforms = []
     while isinstance(_estimator, TransformedMIEstimator):
         transforms.append(_estimator.transforms)
-        _estimator = estimator.base_estimator
+        _estimator = _estimator.base_estimator
 
     # If required, change the data-loader to sample batches with the same attribute only
     if isinstance(_estimator, PQHybridMIEstimator):
@@ -261,11 +455,17 @@ def update_dataloader(
 
             for transform in transforms:
                 y = transform["y->y"](y)
-            return y.data.cpu()
+            return y.data
 
         if not isinstance(dataloader, SameAttributeDataLoader):
+            # The attributes are cached on the dataset until the quantization (or the transforms) change
             dataloader = sample_same_value(
-                dataloader, compute_attributes, neg_samples=neg_samples
+                dataloader,
+                compute_attributes,
+                neg_samples=neg_samples,
+                cache_key=_state_hash(
+                    [transform["y->y"] for transform in transforms]
+                ),
             )
 
     return dataloader
@@ -1,7 +1,18 @@
 import copy
 import inspect
 import random
-from typing import Optional, Any, Union, Type, Dict, Tuple, List, Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Optional,
+    Any,
+    Union,
+    Type,
+    Dict,
+    Tuple,
+    List,
+    Callable,
+    Iterator,
+)
 
 import torch
 import numpy as np
@@ -13,15 +24,20 @@ from tqdm.auto import tqdm
 from torch_mist.estimators import MultiMIEstimator
 from torch_mist.estimators.base import MIEstimator
 from torch_mist.estimators.factories import instantiate_estimator
+from torch_mist.utils.data import CSVDataset
+from torch_mist.utils.data.dataset import SampleDataset
+from torch_mist.utils.data.stream import is_iterable_dataset, has_length
 from torch_mist.utils.data.utils import (
     infer_dims,
     TensorDictLike,
     make_dataset,
     is_data_loader,
-    is_valid_entry,
+    compute_valid_mask,
+    load_dataset,
 )
 from torch_mist.utils.logging import PandasLogger
 from torch_mist.utils.logging.logger.base import Logger, DummyLogger
+from torch_mist.utils.train.ensemble import train_ensemble
 from torch_mist.utils.train.mi_estimator import train_mi_estimator
 from torch_mist.utils.evaluation import evaluate_mi
 
@@ -100,7 +116,8 @@ def _determine_train_duration(
     data: TensorDictLike,
 ) -> Tuple[Optional[int], Optional[int]]:
     if max_epochs is None and max_iterations is None:
-        if is_data_loader(data):
+        # The number of iterations in one epoch is unknown for streams
+        if is_data_loader(data) and has_length(data):
             max_epochs = DEFAULT_MAX_EPOCHS
             print(
                 f"[Info]: max_epochs and max_iterations are not specified, using max_epochs={max_epochs} by default."
@@ -136,8 +153,19 @@ def estimate_mi(
     tolerance: float = 0.001,
     return_estimator: bool = False,
     fast_train: bool = False,
+    log_every: Optional[int] = None,
+    precision: str = "fp32",
+    grad_accumulation_steps: int = 1,
+    grad_cache: bool = False,
+    snapshot: str = "memory",
+    checkpoint_path: Optional[str] = None,
+    checkpoint_every: Optional[int] = None,
+    resume_from: Optional[str] = None,
+    valid_every: Optional[int] = None,
     x_key: str = "x",
     y_key: str = "y",
+    groups: Optional[Dict[str, List[str]]] = None,
+    integer_variables: Optional[List[str]] = None,
     **estimator_params,
 ) -> Union[
     float,
@@ -146,12 +174,37 @@ def estimate_mi(
     Tuple[float, MIEstimator],
     Tuple[float, MIEstimator, pd.DataFrame],
 ]:
+    # Files are loaded once, reading only the columns of x and y
+    data, valid_data, test_data = [
+        load_dataset(d, variables=[x_key, y_key]) if isinstance(d, str) else d
+        for d in [data, valid_data, test_data]
+    ]
+
+    # The columns of DataFrames are grouped into variables (e.g. x and y) and converted to integers if specified
+    if not (groups is None and integer_variables is None):
+        data, valid_data, test_data = [
+            make_dataset(d, groups=groups, integer_variables=integer_variables)
+            if isinstance(d, pd.DataFrame)
+            else d
+            for d in [data, valid_data, test_data]
+        ]
+
+    # The training data is converted once, so that the values cached on the dataset (e.g. the quantized attributes
+    # of hybrid estimators) are shared by training and evaluation
+    if not isinstance(data, DataLoader):
+        data = make_dataset(data)
+
     max_iterations, max_epochs = _determine_train_duration(
         max_iterations=max_iterations, max_epochs=max_epochs, data=data
     )
 
     estimator = _instantiate_estimator(
-        estimator=estimator, data=data, verbose=verbose, **estimator_params
+        estimator=estimator,
+        data=data,
+        x_key=x_key,
+        y_key=y_key,
+        verbose=verbose,
+        **estimator_params,
     )
 
     # If using different key instead of 'x' and 'y'
@@ -189,6 +242,15 @@ def estimate_mi(
         tolerance=tolerance,
         num_workers=num_workers,
         fast_train=fast_train,
+        log_every=log_every,
+        precision=precision,
+        grad_accumulation_steps=grad_accumulation_steps,
+        grad_cache=grad_cache,
+        snapshot=snapshot,
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=checkpoint_every,
+        resume_from=resume_from,
+        valid_every=valid_every,
     )
 
     if verbose:
@@ -230,6 +292,121 @@ def estimate_mi(
         return tuple(out)
 
 
+def _make_replicas(
+    estimator: Union[MIEstimator, str],
+    data: TensorDictLike,
+    n_replicas: int,
+    seed: Optional[int],
+    **estimator_params,
+) -> List[MIEstimator]:
+    replicas = []
+    for i in range(n_replicas):
+        if not (seed is None):
+            torch.manual_seed(seed + i)
+        if isinstance(estimator, MIEstimator):
+            # Copy the estimator and re-initialize its parameters
+            replica = copy.deepcopy(estimator)
+            for module in replica.modules():
+                if hasattr(module, "reset_parameters"):
+                    module.reset_parameters()
+        else:
+            replica = _instantiate_estimator(
+                estimator=estimator,
+                data=data,
+                verbose=False,
+                **estimator_params,
+            )
+        replicas.append(replica)
+    return replicas
+
+
+def estimate_mi_ensemble(
+    data: TensorDictLike,
+    estimator: Union[MIEstimator, str] = DEFAULT_ESTIMATOR,
+    n_replicas: int = 10,
+    seed: Optional[int] = None,
+    test_data: Optional[TensorDictLike] = None,
+    device: Union[torch.device, str] = torch.device("cpu"),
+    max_epochs: Optional[int] = None,
+    max_iterations: Optional[int] = None,
+    optimizer_class: Type[Optimizer] = Adam,
+    optimizer_params: Optional[Dict[str, Any]] = None,
+    verbose: bool = True,
+    batch_size: Optional[int] = DEFAULT_BATCH_SIZE,
+    evaluation_batch_size: Optional[int] = None,
+    num_workers: int = 0,
+    return_estimators: bool = False,
+    **estimator_params,
+) -> Union[
+    Tuple[float, float, np.ndarray],
+    Tuple[float, float, np.ndarray, List[MIEstimator]],
+]:
+    """
+    Estimate mutual information with n_replicas replicas of the same estimator initialized with different seeds.
+    The replicas are trained together with vectorized operations on the same batches (see train_ensemble).
+    Only discriminative estimators without running statistics are supported.
+    :return: the mean and standard deviation of the estimates, the estimate of each replica and (optionally)
+        the trained replicas.
+    """
+    if n_replicas < 1:
+        raise ValueError("n_replicas must be a positive integer.")
+
+    max_iterations, max_epochs = _determine_train_duration(
+        max_iterations=max_iterations, max_epochs=max_epochs, data=data
+    )
+
+    replicas = _make_replicas(
+        estimator=estimator,
+        data=data,
+        n_replicas=n_replicas,
+        seed=seed,
+        **estimator_params,
+    )
+
+    if verbose:
+        print(f"Training {n_replicas} replicas of the estimator")
+
+    train_ensemble(
+        replicas=replicas,
+        train_data=data,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        device=device,
+        max_epochs=max_epochs,
+        max_iterations=max_iterations,
+        optimizer_class=optimizer_class,
+        optimizer_params=optimizer_params,
+        verbose=verbose,
+    )
+
+    if test_data is None:
+        print(
+            "[Warning]: using data to estimate the value of mutual information. Please specify test_data."
+        )
+        test_data = data
+
+    if evaluation_batch_size is None:
+        evaluation_batch_size = batch_size
+
+    mi_values = np.array(
+        [
+            evaluate_mi(
+                estimator=replica,
+                data=test_data,
+                batch_size=evaluation_batch_size,
+                device=device,
+                num_workers=num_workers,
+            )
+            for replica in replicas
+        ]
+    )
+
+    out = [np.mean(mi_values), np.std(mi_values), mi_values]
+    if return_estimators:
+        out.append(replicas)
+    return tuple(out)
+
+
 def _train_on_fold(
     chunks: List[Dataset],
     fold: int,
@@ -302,6 +479,88 @@ def _train_on_fold(
     return mi_values, iterations, epochs
 
 
+# Folds of the dataset in the worker processes used by k_fold_mi_estimate
+_worker_chunks = None
+
+
+def _init_fold_worker(
+    dataset: Dataset, ids_folds: List[List[int]], n_threads: int
+):
+    global _worker_chunks
+
+    # Avoid oversubscription when the folds are trained in parallel
+    torch.set_num_threads(n_threads)
+    _worker_chunks = [Subset(dataset, ids_fold) for ids_fold in ids_folds]
+
+
+def _set_seed(seed: int):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def _train_on_seeded_fold(
+    chunks: List[Subset], fold: int, seed: Optional[int], **train_params
+) -> Tuple[Dict[str, float], int, int]:
+    # Each fold trained in a worker process uses its own seed, so that the results do not depend on the number of jobs
+    if not (seed is None):
+        _set_seed(seed + fold)
+    return _train_on_fold(chunks=chunks, fold=fold, **train_params)
+
+
+def _train_on_fold_in_worker(
+    fold: int, seed: Optional[int], **train_params
+) -> Tuple[Dict[str, float], int, int]:
+    return _train_on_seeded_fold(
+        chunks=_worker_chunks, fold=fold, seed=seed, **train_params
+    )
+
+
+def _train_folds_in_parallel(
+    chunks: List[Subset],
+    n_folds: int,
+    n_jobs: int,
+    seed: Optional[int],
+    **train_params,
+) -> Iterator[Tuple[Dict[str, float], int, int]]:
+    dataset = chunks[0].dataset
+
+    # The tensors of a SampleDataset are moved to shared memory, so that the dataset is not copied for each worker.
+    # The other datasets are pickled once for each worker (CSVDataset with a cache_dir re-opens its memory-mapped
+    # cache instead of copying the values).
+    if isinstance(dataset, SampleDataset):
+        for value in dataset.samples.values():
+            if isinstance(value, torch.Tensor):
+                value.share_memory_()
+    elif not (
+        isinstance(dataset, CSVDataset) and not (dataset.cache_path is None)
+    ):
+        print(
+            f"[Info]: The {dataset.__class__.__name__} is copied in each of the {n_jobs} worker processes."
+        )
+
+    n_threads = max(1, torch.get_num_threads() // n_jobs)
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=torch.multiprocessing.get_context("spawn"),
+        initializer=_init_fold_worker,
+        initargs=(dataset, [chunk.indices for chunk in chunks], n_threads),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _train_on_fold_in_worker,
+                fold=fold,
+                seed=seed,
+                **train_params,
+            )
+            for fold in range(n_folds)
+        ]
+
+        # The results are returned in the order of the folds
+        for future in futures:
+            yield future.result()
+
+
 def _prepare_k_fold_data(
     data: TensorDictLike,
     folds: int,
@@ -309,6 +568,10 @@ def _prepare_k_fold_data(
     verbose: bool,
 ) -> List[Dataset]:
     full_dataset = make_dataset(data)
+    if is_iterable_dataset(full_dataset):
+        raise ValueError(
+            "k-fold cross-validation is not supported for streams (IterableDataset)."
+        )
 
     # Create k train-test splits
     if verbose:
@@ -316,9 +579,7 @@ def _prepare_k_fold_data(
         print(f"Creating the {folds} train/validation/test splits")
 
     if not (seed is None):
-        torch.manual_seed(seed)
-        np.random.seed(seed)
-        random.seed(seed)
+        _set_seed(seed)
 
     # Create a permutation
     ids_permutation = np.random.permutation(len(full_dataset))
@@ -334,9 +595,9 @@ def _prepare_k_fold_data(
     ids_folds = np.split(ids_permutation, folds)
 
     # Filter out the invalid ids (for NaN entries if any)
+    valid_mask = compute_valid_mask(full_dataset)
     ids_folds = [
-        [idx for idx in ids_fold if is_valid_entry(full_dataset[idx])]
-        for ids_fold in ids_folds
+        ids_fold[valid_mask[ids_fold]].tolist() for ids_fold in ids_folds
     ]
 
     chunks = [Subset(full_dataset, ids_fold) for ids_fold in ids_folds]
@@ -361,6 +622,7 @@ def k_fold_mi_estimate(
     batch_size: int = DEFAULT_BATCH_SIZE,
     device: Union[str, torch.device] = torch.device("cpu"),
     n_estimations: Optional[int] = None,
+    n_jobs: int = 1,
     **kwargs,
 ) -> Tuple[float, Any]:
     if isinstance(data, DataLoader):
@@ -394,17 +656,35 @@ def k_fold_mi_estimate(
         tqdm(total=n_estimations, desc="Fold", position=1) if verbose else None
     )
 
-    for fold in range(n_estimations):
-        mi_values, iterations, epochs = _train_on_fold(
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer.")
+
+    train_params = dict(
+        estimator=estimator,
+        device=device,
+        batch_size=batch_size,
+        verbose=verbose_train,
+        **kwargs,
+    )
+
+    # The folds are trained in n_jobs processes if n_jobs>1, seeding each fold with seed + fold.
+    # Sequentially trained folds share the random state set by the seed, as in previous versions,
+    # therefore the results with n_jobs=1 differ from the parallel ones.
+    if n_jobs > 1:
+        fold_results = _train_folds_in_parallel(
             chunks=chunks,
-            estimator=estimator,
-            fold=fold,
-            device=device,
-            batch_size=batch_size,
-            verbose=verbose_train,
-            **kwargs,
+            n_folds=n_estimations,
+            n_jobs=min(n_jobs, n_estimations),
+            seed=seed,
+            **train_params,
+        )
+    else:
+        fold_results = (
+            _train_on_fold(chunks=chunks, fold=fold, **train_params)
+            for fold in range(n_estimations)
         )
 
+    for mi_values, iterations, epochs in fold_results:
         total_iterations += iterations
         total_epochs += epochs
 
@@ -1,4 +1,4 @@
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, Union, Tuple, Any
 
 import torch
 from torch.utils.data import DataLoader
@@ -19,7 +19,19 @@ def evaluate_mi(
     device: torch.device = torch.device("cpu"),
     batch_size: Optional[int] = None,
     num_workers: int = 0,
-) -> Union[float, Dict[str, float]]:
+    confidence: Optional[float] = None,
+    interval_method: str = "batch_means",
+    bootstrap_samples: int = 1000,
+) -> Union[
+    float,
+    Dict[str, float],
+    Tuple[float, Tuple[float, float]],
+    Tuple[Dict[str, float], Dict[str, Tuple[float, float]]],
+]:
+    """
+    Evaluate the mutual information estimated by the estimator on the data.
+    If confidence is specified, the (lower, upper) confidence intervals are also returned (see evaluate).
+    """
     # Make a dataloader if necessary
     dataloader = make_default_dataloader(
         data=data,
@@ -34,11 +46,19 @@ def evaluate_mi(
         method="mutual_information",
         data=dataloader,
         device=device,
+        confidence=confidence,
+        interval_method=interval_method,
+        bootstrap_samples=bootstrap_samples,
     )
 
+    if confidence is None:
+        return _rename_keys(values)
+    return _rename_keys(values[0]), _rename_keys(values[1])
+
+
+def _rename_keys(values: Union[Any, Dict[Tuple[str, str], Any]]) -> Any:
     if isinstance(values, dict):
         values = {
             f"I({x_key};{y_key})": v for (x_key, y_key), v in values.items()
         }
-
     return values
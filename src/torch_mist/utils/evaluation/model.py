@@ -1,14 +1,72 @@
-import collections
-from typing import Optional, Union, Dict
+from typing import Optional, Union, Dict, List, Tuple, Any
 
 import torch
-import numpy as np
 from torch import nn
 from torch.utils.data import DataLoader
 
+from torch_mist.utils.caching import step_cache
+from torch_mist.utils.data.loader import (
+    InMemoryDataLoader,
+    supports_batch_indexing,
+)
 from torch_mist.utils.data.utils import prepare_variables, TensorDictLike
 
 
+def _batch_size(
+    v_args: List[torch.Tensor], v_kwargs: Dict[str, torch.Tensor]
+) -> int:
+    return next(iter(list(v_args) + list(v_kwargs.values()))).shape[0]
+
+
+def _confidence_interval(
+    batch_values: torch.Tensor,
+    batch_sizes: torch.Tensor,
+    confidence: float,
+    method: str,
+    bootstrap_samples: int,
+) -> Tuple[float, float]:
+    # Interval for the mean over the entries, treating each batch as one observation of size batch_size
+    n_batches = len(batch_values)
+    if n_batches < 2:
+        print(
+            "[Warning]: At least two batches are required to compute a confidence interval."
+        )
+        return float("nan"), float("nan")
+
+    weights = batch_sizes / batch_sizes.sum()
+    mean = (weights * batch_values).sum()
+
+    if method == "batch_means":
+        variance = (
+            (weights**2 * (batch_values - mean) ** 2).sum()
+            * n_batches
+            / (n_batches - 1)
+        )
+        z = torch.distributions.Normal(0.0, 1.0).icdf(
+            torch.tensor(0.5 + confidence / 2, dtype=torch.float64)
+        )
+        half_width = z * variance**0.5
+        return (mean - half_width).item(), (mean + half_width).item()
+    elif method == "bootstrap":
+        # Resample the batches with replacement, drawing from the global random state
+        ids = torch.randint(n_batches, (bootstrap_samples, n_batches))
+        resampled = (batch_values[ids] * batch_sizes[ids]).sum(
+            -1
+        ) / batch_sizes[ids].sum(-1)
+        low, high = torch.quantile(
+            resampled,
+            torch.tensor(
+                [0.5 - confidence / 2, 0.5 + confidence / 2],
+                dtype=resampled.dtype,
+            ),
+        )
+        return low.item(), high.item()
+    else:
+        raise ValueError(
+            f"Unknown confidence interval method {method}, please use 'batch_means' or 'bootstrap'."
+        )
+
+
 def evaluate(
     model: nn.Module,
     method: str,
@@ -16,17 +74,48 @@ def evaluate(
     device: torch.device = torch.device("cpu"),
     batch_size: Optional[int] = None,
     num_workers: int = 0,
-) -> Union[float, Dict[str, float]]:
+    confidence: Optional[float] = None,
+    interval_method: str = "batch_means",
+    bootstrap_samples: int = 1000,
+) -> Union[
+    float,
+    Dict[Any, float],
+    Tuple[float, Tuple[float, float]],
+    Tuple[Dict[Any, float], Dict[Any, Tuple[float, float]]],
+]:
+    """
+    Average the value of a method of the model over the data, weighting each batch by its size.
+    The values are accumulated on the device, and transferred once at the end.
+    :param model: the model to evaluate.
+    :param method: the name of the method returning the (mean) value for a batch, or a dictionary of values.
+    :param data: the data or the dataloader.
+    :param device: the device used for the evaluation.
+    :param batch_size: the batch size (required if data is not a dataloader).
+    :param num_workers: the number of workers of the dataloader.
+    :param confidence: if specified, the confidence level (e.g. 0.95) of the intervals computed for each value.
+    :param interval_method: 'batch_means' for a normal interval using the variance of the batch values, or
+        'bootstrap' for a percentile interval obtained by resampling the batches.
+    :param bootstrap_samples: the number of resamplings for the bootstrap intervals.
+    :return: the average value(s), and the (lower, upper) interval(s) if confidence is specified.
+    """
     if not hasattr(model, method):
         raise ValueError(f"{model.__class__.__name__} has no method {method}.")
 
+    if not (confidence is None) and not (0 < confidence < 1):
+        raise ValueError("confidence must be between 0 and 1.")
+
     # Make a dataloader if necessary
     if isinstance(data, DataLoader):
         dataloader = data
     else:
         if batch_size is None:
             raise ValueError("Plase specify a value for batch_size.")
-        dataloader = DataLoader(
+        loader_class = (
+            InMemoryDataLoader
+            if supports_batch_indexing(data) and num_workers == 0
+            else DataLoader
+        )
+        dataloader = loader_class(
             data,
             batch_size=batch_size,
             num_workers=num_workers,
@@ -35,27 +124,58 @@ def evaluate(
     model.eval()
     model = model.to(device)
 
-    values = None
-    for samples in dataloader:
-        v_args, v_kwargs = prepare_variables(samples, device)
-        estimation = getattr(model, method)(*v_args, **v_kwargs)
+    # Sums of the values weighted by the batch sizes, and values of each batch (for the intervals)
+    sums = {}
+    batch_values = {}
+    batch_sizes = []
+    is_dict = False
+    # No computational graph is stored during the evaluation
+    with torch.no_grad():
+        for samples in dataloader:
+            v_args, v_kwargs = prepare_variables(samples, device)
+            with step_cache(model):
+                estimation = getattr(model, method)(*v_args, **v_kwargs)
 
-        if values is None:
-            if isinstance(estimation, dict):
-                values = collections.defaultdict(list)
-            else:
-                values = []
+            is_dict = isinstance(estimation, dict)
+            if not is_dict:
+                estimation = {None: estimation}
 
-        if isinstance(estimation, dict):
+            n = _batch_size(v_args, v_kwargs)
+            batch_sizes.append(n)
             for key, value in estimation.items():
-                values[key].append(value.item())
-        else:
-            values.append(estimation.item())
+                value = torch.as_tensor(value).detach().float()
+                sums[key] = sums[key] + value * n if key in sums else value * n
+                if not (confidence is None):
+                    batch_values.setdefault(key, []).append(value)
 
-    if isinstance(values, dict):
-        for k, v in values.items():
-            values[k] = np.mean(v)
-    else:
-        values = np.mean(values)
+    if len(batch_sizes) == 0:
+        raise ValueError("The data is empty.")
+
+    # One transfer for all the values
+    keys = list(sums.keys())
+    n_samples = sum(batch_sizes)
+    means = (torch.stack([sums[key] for key in keys]) / n_samples).tolist()
+    values = dict(zip(keys, means))
+
+    if not (confidence is None):
+        stacked = torch.stack(
+            [torch.stack(batch_values[key]) for key in keys]
+        ).cpu()
+        sizes = torch.tensor(batch_sizes, dtype=stacked.dtype)
+        intervals = {
+            key: _confidence_interval(
+                batch_values=stacked[i],
+                batch_sizes=sizes,
+                confidence=confidence,
+                method=interval_method,
+                bootstrap_samples=bootstrap_samples,
+            )
+            for i, key in enumerate(keys)
+        }
+        if not is_dict:
+            return values[None], intervals[None]
+        return values, intervals
 
+    if not is_dict:
+        return values[None]
     return values
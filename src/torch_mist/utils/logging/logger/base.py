@@ -77,7 +77,6 @@ class Logger:
     def on_iteration_end(self):
         self._iteration += 1
         self._log_buffer()
-        self._log_buffer()
 
     def on_epoch_start(self):
         self._epoch += 1
@@ -166,15 +165,21 @@ class Logger:
                 for metric, values in data.items():
                     first_value = values[0]
                     if (
-                        isinstance(first_value, float)
-                        or (
-                            isinstance(first_value, torch.Tensor)
-                            and first_value.numel() == 1
-                        )
-                        or (
-                            isinstance(first_value, np.ndarray)
-                            and first_value.size == 1
+                        isinstance(first_value, torch.Tensor)
+                        and first_value.numel() == 1
+                    ):
+                        # The values are averaged on device, synchronizing only once
+                        agg_values[metric] = (
+                            torch.stack(
+                                [value.reshape(()) for value in values]
+                            )
+                            .float()
+                            .mean()
+                            .item()
                         )
+                    elif isinstance(first_value, float) or (
+                        isinstance(first_value, np.ndarray)
+                        and first_value.size == 1
                     ):
                         agg_values[metric] = np.mean(values)
                     else:
@@ -224,6 +229,19 @@ class Logger:
         self._iteration = 0
         self._epoch = 0
 
+    def state_dict(self) -> Dict[str, Any]:
+        # Counters and values that have not been logged yet, used to resume the training
+        return {
+            "iteration": self._iteration,
+            "epoch": self._epoch,
+            "buffer": self._buffer,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        self._iteration = state_dict["iteration"]
+        self._epoch = state_dict["epoch"]
+        self._buffer = state_dict["buffer"]
+
     def detach_all_hooks(self):
         logged_methods = list(self._logged_methods)
         for method_name in logged_methods:
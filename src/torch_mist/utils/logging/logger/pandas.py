@@ -46,6 +46,15 @@ class PandasLogger(Logger):
     def get_log(self) -> pd.DataFrame:
         return pd.DataFrame(self.__log)
 
+    def state_dict(self) -> Dict[str, Any]:
+        state_dict = super().state_dict()
+        state_dict["log"] = list(self.__log)
+        return state_dict
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        super().load_state_dict(state_dict)
+        self.__log = list(state_dict["log"])
+
     def _reset_log(self):
         self.__log = []
 
@@ -2,32 +2,39 @@ from typing import Dict, Union
 
 import torch
 
+# The metrics are returned as (detached) tensors on the same device of the output to avoid a synchronization
+# at every step. The values are moved to the host only when the logger aggregates them.
 
-def compute_mean_std(input, output) -> Dict[str, float]:
+
+def compute_mean_std(input, output) -> Dict[str, torch.Tensor]:
     assert isinstance(output, torch.Tensor) or isinstance(output, dict)
     if isinstance(output, dict):
         summary = {}
         for name, value in output.items():
             name = str(name)
             assert isinstance(value, torch.Tensor)
-            summary[f"{name}/mean"] = torch.mean(value).item()
-            summary[f"{name}/std"] = torch.std(value).item()
+            value = value.detach()
+            summary[f"{name}/mean"] = torch.mean(value)
+            summary[f"{name}/std"] = torch.std(value)
         return summary
     else:
+        output = output.detach()
         return {
-            "mean": torch.mean(output).item(),
-            "std": torch.std(output).item(),
+            "mean": torch.mean(output),
+            "std": torch.std(output),
         }
 
 
-def compute_mean(input, output) -> Union[float, Dict[str, float]]:
+def compute_mean(
+    input, output
+) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
     assert isinstance(output, torch.Tensor) or isinstance(output, dict)
     if isinstance(output, dict):
         summary = {}
         for name, value in output.items():
             name = str(name)
             assert isinstance(value, torch.Tensor)
-            summary[name] = value.mean().item()
+            summary[name] = value.detach().mean()
         return summary
     else:
-        return output.mean().item()
+        return output.detach().mean()
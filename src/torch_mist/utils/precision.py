@@ -0,0 +1,99 @@
+import inspect
+from contextlib import nullcontext
+from typing import Callable, Optional, TypeVar, Union, ContextManager
+
+import torch
+
+T = TypeVar("T")
+
+# Data type used for the computation (in autocast regions) for each precision
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+# Device types on which float16 computation and gradient scaling are supported
+_FP16_DEVICE_TYPES = ["cuda", "xpu", "mps"]
+
+
+def _device_type(device: Union[str, torch.device]) -> str:
+    return torch.device(device).type
+
+
+def check_precision(
+    precision: str, device: Union[str, torch.device] = "cpu"
+) -> str:
+    """
+    Validate the precision for the specified device.
+    :param precision: one of 'fp32', 'bf16' or 'fp16'.
+    :param device: the device used for the computation.
+    :return: the precision to use. float16 is replaced with bfloat16 on devices that do not support it.
+    """
+    if not (precision in PRECISIONS):
+        raise ValueError(
+            f"Unknown precision {precision}, please use one of {list(PRECISIONS)}."
+        )
+
+    if precision == "fp16" and not (
+        _device_type(device) in _FP16_DEVICE_TYPES
+    ):
+        print(
+            f"[Warning]: fp16 is not supported on {_device_type(device)}, using bf16 instead."
+        )
+        precision = "bf16"
+    return precision
+
+
+def autocast(
+    precision: str, device: Union[str, torch.device] = "cpu"
+) -> ContextManager:
+    # Mixed precision region for the forward pass
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=_device_type(device), dtype=dtype)
+
+
+def make_grad_scaler(
+    precision: str, device: Union[str, torch.device] = "cpu"
+) -> Optional["torch.amp.GradScaler"]:
+    # Gradients are scaled only for float16, bfloat16 has the same range as float32
+    if precision != "fp16":
+        return None
+    if hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler(_device_type(device))
+    return torch.cuda.amp.GradScaler()
+
+
+def _to_full_precision(value):
+    if torch.is_tensor(value) and value.dtype in [
+        torch.float16,
+        torch.bfloat16,
+    ]:
+        return value.float()
+    return value
+
+
+def full_precision(method: Callable[..., T]) -> Callable[..., T]:
+    """
+    Decorator to compute a method in float32 inside mixed precision regions.
+    The autocast is disabled and the half precision tensor arguments are converted to float32.
+    """
+
+    def wrapper(*args, **kwargs):
+        tensors = [arg for arg in args if torch.is_tensor(arg)] + [
+            arg for arg in kwargs.values() if torch.is_tensor(arg)
+        ]
+        if len(tensors) == 0:
+            return method(*args, **kwargs)
+
+        args = [_to_full_precision(arg) for arg in args]
+        kwargs = {k: _to_full_precision(v) for k, v in kwargs.items()}
+        with torch.autocast(device_type=tensors[0].device.type, enabled=False):
+            return method(*args, **kwargs)
+
+    wrapper.__signature__ = inspect.signature(method)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
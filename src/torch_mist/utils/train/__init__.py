@@ -1,2 +1,3 @@
 from .mi_estimator import train_mi_estimator
 from .model import train_model
+from .ensemble import train_ensemble
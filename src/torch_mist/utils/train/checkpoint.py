@@ -0,0 +1,115 @@
+import os
+import random
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+import torch
+from torch import nn
+from torch.optim import Optimizer
+from torch.optim.lr_scheduler import LRScheduler
+
+from torch_mist.utils.logging.logger.base import Logger
+from torch_mist.utils.train.utils import RunTerminationManager
+
+
+def get_rng_state() -> Dict[str, Any]:
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "random": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]):
+    torch.set_rng_state(state["torch"].cpu())
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in state["cuda"]])
+
+
+def save_checkpoint(
+    path: str,
+    model: nn.Module,
+    opt: Optimizer,
+    lr_scheduler: Optional[LRScheduler],
+    grad_scaler: Optional["torch.amp.GradScaler"],
+    logger: Logger,
+    run_manager: RunTerminationManager,
+    epoch: int,
+    n_batches: int,
+    epoch_rng_state: Dict[str, Any],
+    stopped: bool = False,
+):
+    """
+    Save the state of the training procedure.
+    :param epoch: the (0-based) index of the current epoch.
+    :param n_batches: the number of batches of the current epoch that have already been used.
+    :param epoch_rng_state: the random state at the beginning of the current epoch, which determines the order of
+        the batches.
+    :param stopped: True if the training procedure is over.
+    """
+    checkpoint = {
+        "model": model.state_dict(),
+        "optimizer": opt.state_dict(),
+        "lr_scheduler": (
+            None if lr_scheduler is None else lr_scheduler.state_dict()
+        ),
+        "grad_scaler": (
+            None if grad_scaler is None else grad_scaler.state_dict()
+        ),
+        "logger": logger.state_dict(),
+        "run_manager": run_manager.state_dict(),
+        "epoch": epoch,
+        "n_batches": n_batches,
+        "epoch_rng_state": epoch_rng_state,
+        "rng_state": get_rng_state(),
+        "stopped": stopped,
+    }
+
+    # The checkpoint is written to a temporary file first, so that an interruption while writing does not corrupt
+    # the previous checkpoint
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(
+    path: str,
+    model: nn.Module,
+    opt: Optimizer,
+    lr_scheduler: Optional[LRScheduler],
+    grad_scaler: Optional["torch.amp.GradScaler"],
+    logger: Logger,
+    run_manager: RunTerminationManager,
+    device: Union[str, torch.device] = "cpu",
+) -> Dict[str, Any]:
+    """
+    Restore the state of the training procedure saved with save_checkpoint.
+    :return: the checkpoint, which contains the position in the training procedure and the random states.
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"The checkpoint {path} does not exist.")
+
+    # The checkpoint contains the (numpy and python) random states, which are not weights
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+
+    model.load_state_dict(checkpoint["model"])
+    opt.load_state_dict(checkpoint["optimizer"])
+    if not (lr_scheduler is None) and not (checkpoint["lr_scheduler"] is None):
+        lr_scheduler.load_state_dict(checkpoint["lr_scheduler"])
+    if not (grad_scaler is None) and not (checkpoint["grad_scaler"] is None):
+        grad_scaler.load_state_dict(checkpoint["grad_scaler"])
+    # The logger counts the interrupted epoch again when it is resumed
+    logger_state = dict(checkpoint["logger"])
+    if checkpoint["n_batches"] > 0:
+        logger_state["epoch"] -= 1
+    logger.load_state_dict(logger_state)
+    run_manager.load_state_dict(checkpoint["run_manager"])
+
+    return checkpoint
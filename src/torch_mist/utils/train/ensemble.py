@@ -0,0 +1,174 @@
+import copy
+import itertools
+from typing import Type, Optional, Dict, Any, Union, List, Tuple
+
+import torch
+from torch import nn
+from torch.func import stack_module_state, functional_call, vmap
+from torch.optim import Optimizer, Adam
+from tqdm.autonotebook import tqdm
+
+from torch_mist.baseline import ExponentialMovingAverage
+from torch_mist.distributions import MemoryBank
+from torch_mist.distributions.transforms import EMANormalize
+from torch_mist.estimators.base import MIEstimator
+from torch_mist.estimators.discriminative import DiscriminativeMIEstimator
+from torch_mist.utils.caching import caching
+from torch_mist.utils.data.utils import (
+    prepare_variables,
+    TensorDictLike,
+    make_default_dataloader,
+)
+from torch_mist.utils.train.model import (
+    compute_training_time,
+    get_iterations_per_epoch,
+)
+
+# Modules that update their state in the forward pass, which can not be shared by the replicas
+_STATEFUL_MODULES = (ExponentialMovingAverage, MemoryBank, EMANormalize)
+
+
+def check_ensemble_support(estimator: nn.Module):
+    if not isinstance(estimator, DiscriminativeMIEstimator):
+        raise ValueError(
+            "Ensemble training is supported only for discriminative estimators such as NWJ, InfoNCE, SMILE, JS or TUBA."
+        )
+    if len(estimator._components_to_pretrain) > 0:
+        raise ValueError(
+            "Ensemble training does not support components that require pre-training."
+        )
+    for module in estimator.modules():
+        if isinstance(module, _STATEFUL_MODULES):
+            raise ValueError(
+                f"Ensemble training does not support {module.__class__.__name__}, since it is updated during training."
+            )
+
+
+class _MethodCall(nn.Module):
+    # Expose a method of the module as forward, so that it can be used with functional_call
+    def __init__(self, module: nn.Module, method: str):
+        super().__init__()
+        self.module = module
+        self.method = method
+
+    def forward(self, *args, **kwargs):
+        return getattr(self.module, self.method)(*args, **kwargs)
+
+
+def _stack_replicas(
+    replicas: List[nn.Module],
+) -> Tuple[Dict[str, torch.Tensor], Dict[str, torch.Tensor]]:
+    params, buffers = stack_module_state(replicas)
+    params = {f"module.{name}": value for name, value in params.items()}
+    buffers = {f"module.{name}": value for name, value in buffers.items()}
+    return params, buffers
+
+
+@torch.no_grad()
+def _unstack_replicas(
+    replicas: List[nn.Module],
+    params: Dict[str, torch.Tensor],
+    buffers: Dict[str, torch.Tensor],
+):
+    for i, replica in enumerate(replicas):
+        for name, value in replica.named_parameters():
+            value.copy_(params[f"module.{name}"][i])
+        for name, value in replica.named_buffers():
+            value.copy_(buffers[f"module.{name}"][i])
+
+
+def train_ensemble(
+    replicas: List[MIEstimator],
+    train_data: TensorDictLike,
+    batch_size: Optional[int] = None,
+    num_workers: int = 0,
+    device: Union[torch.device, str] = torch.device("cpu"),
+    max_epochs: Optional[int] = None,
+    max_iterations: Optional[int] = None,
+    optimizer_class: Type[Optimizer] = Adam,
+    optimizer_params: Optional[Dict[str, Any]] = None,
+    verbose: bool = True,
+    train_method: str = "loss",
+):
+    """
+    Train several replicas of the same estimator (with different initializations) on the same batches.
+    The parameters of the replicas are stacked and the replicas are evaluated with one vectorized (vmap) call
+    for each step. The replicas are updated in place at the end of the training.
+    :param replicas: the estimators to train. They must have the same architecture.
+    """
+    if len(replicas) == 0:
+        raise ValueError("Please specify at least one replica.")
+    for replica in replicas:
+        check_ensemble_support(replica)
+
+    train_loader = make_default_dataloader(
+        data=train_data, batch_size=batch_size, num_workers=num_workers
+    )
+
+    max_epochs, max_iterations, _ = compute_training_time(
+        iterations_per_epoch=get_iterations_per_epoch(train_loader),
+        max_epochs=max_epochs,
+        max_iterations=max_iterations,
+        warmup_percentage=0,
+    )
+
+    replicas = [replica.to(device) for replica in replicas]
+    params, buffers = _stack_replicas(replicas)
+
+    # The stacked tensors replace the (meta) parameters of the model in the forward pass
+    model = _MethodCall(copy.deepcopy(replicas[0]).to("meta"), train_method)
+    model.train()
+
+    def compute_loss(params, buffers, args, kwargs) -> torch.Tensor:
+        return functional_call(model, (params, buffers), args, kwargs)
+
+    # The batch and the negative samples are shared by all the replicas
+    compute_losses = vmap(
+        compute_loss, in_dims=(0, 0, None, None), randomness="same"
+    )
+
+    if optimizer_params is None:
+        optimizer_params = {"lr": 5e-4}
+
+    # The optimizer updates each entry of the stacked parameters independently
+    opt = optimizer_class(
+        [param for param in params.values() if param.requires_grad],
+        **optimizer_params,
+    )
+
+    tqdm_iteration = (
+        tqdm(total=max_iterations, desc="Iteration") if verbose else None
+    )
+
+    iteration = 0
+    # The caches rely on the memory location of the tensors, which are not accessible inside vmap
+    with caching(False):
+        # The number of epochs is not bounded for streams, unless specified
+        epochs = itertools.count() if max_epochs is None else range(max_epochs)
+        for epoch in epochs:
+            if iteration >= max_iterations:
+                break
+            start_iteration = iteration
+            for samples in train_loader:
+                if iteration >= max_iterations:
+                    break
+                v_args, v_kwargs = prepare_variables(samples, device)
+
+                opt.zero_grad()
+                losses = compute_losses(
+                    params, buffers, tuple(v_args), v_kwargs
+                )
+
+                # The replicas are independent, the gradient of the sum is the gradient of each loss
+                losses.sum().backward()
+                opt.step()
+
+                iteration += 1
+                if tqdm_iteration:
+                    tqdm_iteration.update(1)
+
+            # Stop if the data is empty
+            if iteration == start_iteration:
+                break
+
+    _unstack_replicas(replicas, params, buffers)
@@ -0,0 +1,157 @@
+from typing import Any, List, Optional, Tuple, Union, Callable
+
+import torch
+from torch import nn
+
+from torch_mist.baseline import LearnableBaseline
+from torch_mist.critic import SeparableCritic
+from torch_mist.distributions import EmpiricalDistribution
+from torch_mist.estimators.discriminative import (
+    DiscriminativeMIEstimator,
+    FLO,
+)
+from torch_mist.utils.caching import step_cache
+from torch_mist.utils.data.utils import prepare_variables
+from torch_mist.utils.logging.logger.base import Logger, DummyLogger
+from torch_mist.utils.precision import autocast
+
+
+def check_grad_cache_support(model: nn.Module):
+    # The loss must depend on the parameters only through the embeddings f_x(x) and f_y(y)
+    if not isinstance(model, DiscriminativeMIEstimator) or isinstance(
+        model, FLO
+    ):
+        raise ValueError(
+            "grad_cache is supported only for discriminative estimators such as InfoNCE, SMILE, JS, NWJ or MINE."
+        )
+    if not isinstance(model.critic, SeparableCritic):
+        raise ValueError("grad_cache requires a SeparableCritic.")
+    if not isinstance(model.proposal, EmpiricalDistribution):
+        raise ValueError(
+            "grad_cache requires the negatives to be sampled from the batch."
+        )
+    baseline = getattr(model, "baseline", None)
+    if isinstance(baseline, nn.Module) and any(
+        isinstance(module, LearnableBaseline) for module in baseline.modules()
+    ):
+        raise ValueError("grad_cache does not support learnable baselines.")
+
+
+def _get_xy(
+    samples: Any, device: Union[str, torch.device]
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    v_args, v_kwargs = prepare_variables(samples, device)
+    if len(v_args) == 2:
+        return v_args[0], v_args[1]
+    return v_kwargs["x"], v_kwargs["y"]
+
+
+def _get_rng_state(
+    device: Union[str, torch.device]
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    device = torch.device(device)
+    cuda_state = None
+    if device.type == "cuda":
+        cuda_state = torch.cuda.get_rng_state(device)
+    return torch.get_rng_state(), cuda_state
+
+
+def _set_rng_state(
+    state: Tuple[torch.Tensor, Optional[torch.Tensor]],
+    device: Union[str, torch.device],
+):
+    cpu_state, cuda_state = state
+    torch.set_rng_state(cpu_state)
+    if not (cuda_state is None):
+        torch.cuda.set_rng_state(cuda_state, torch.device(device))
+
+
+def grad_cache_backward(
+    model: DiscriminativeMIEstimator,
+    micro_batches: List[Any],
+    device: Union[str, torch.device],
+    train_method: str = "loss",
+    eval_method: Optional[str] = None,
+    logger: Optional[Logger] = None,
+    train_logged_methods: Optional[
+        List[Union[str, Tuple[str, Callable]]]
+    ] = None,
+    eval_logged_methods: Optional[
+        List[Union[str, Tuple[str, Callable]]]
+    ] = None,
+    precision: str = "fp32",
+    grad_scaler: Optional["torch.amp.GradScaler"] = None,
+) -> torch.Tensor:
+    """
+    Compute the gradient of the loss on the concatenation of the micro-batches (the macro-batch), using all the
+    samples in the macro-batch as negatives, while keeping the activations of only one micro-batch in memory.
+    1) The embeddings f_x(x) and f_y(y) of the macro-batch are computed without storing the activations.
+    2) The loss and its gradient with respect to the embeddings are computed on the macro-batch.
+    3) The embeddings are re-computed one micro-batch at a time and the gradient is back-propagated to the
+       parameters of f_x and f_y. The random number generator is restored to its state in 1) for each
+       micro-batch, so that stochastic layers (e.g. dropout) produce the same embeddings.
+    :return: the (detached) value of the loss on the macro-batch.
+    """
+    if logger is None:
+        logger = DummyLogger()
+    if train_logged_methods is None:
+        train_logged_methods = []
+    if eval_logged_methods is None:
+        eval_logged_methods = []
+
+    critic = model.critic
+    xs, ys = zip(*[_get_xy(samples, device) for samples in micro_batches])
+
+    # 1) Embeddings of the macro-batch (without activations)
+    f_x, f_y, rng_states = [], [], []
+    with torch.no_grad(), autocast(precision, device):
+        for x, y in zip(xs, ys):
+            rng_states.append(_get_rng_state(device))
+            f_x.append(critic.f_x(x))
+            f_y.append(critic.f_y(y))
+    f_x = torch.cat(f_x).detach().requires_grad_(True)
+    f_y = torch.cat(f_y).detach().requires_grad_(True)
+
+    # 2) Loss on the macro-batch and gradient with respect to the embeddings
+    with step_cache(model), critic.precomputed_embeddings():
+        with autocast(precision, device):
+            with logger.logged_methods(model, train_logged_methods):
+                loss = getattr(model, train_method)(x=f_x, y=f_y)
+
+            if not (eval_method is None) and not isinstance(
+                logger, DummyLogger
+            ):
+                with logger.logged_methods(model, eval_logged_methods):
+                    getattr(model, eval_method)(x=f_x, y=f_y)
+
+        if grad_scaler is None:
+            loss.backward()
+        else:
+            grad_scaler.scale(loss).backward()
+
+    # 3) Back-propagation through the embedding networks, one micro-batch at a time
+    cuda_devices = []
+    if torch.device(device).type == "cuda":
+        cuda_devices = [torch.device(device)]
+    start = 0
+    for x, y, rng_state in zip(xs, ys, rng_states):
+        end = start + x.shape[0]
+        # The state of the random number generator is restored at the end of the re-computation
+        with torch.random.fork_rng(devices=cuda_devices):
+            _set_rng_state(rng_state, device)
+            with autocast(precision, device):
+                e_x = critic.f_x(x)
+                e_y = critic.f_y(y)
+        tensors = [
+            e for e in [e_x, e_y] if torch.is_tensor(e) and e.requires_grad
+        ]
+        grads = [
+            g[start:end].to(e.dtype)
+            for e, g in zip([e_x, e_y], [f_x.grad, f_y.grad])
+            if torch.is_tensor(e) and e.requires_grad
+        ]
+        if len(tensors) > 0:
+            torch.autograd.backward(tensors, grads)
+        start = end
+
+    return loss.detach()
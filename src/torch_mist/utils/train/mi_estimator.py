@@ -62,6 +62,15 @@ def train_mi_estimator(
     eval_logged_methods: Optional[
         List[Union[str, Tuple[str, Callable]]]
     ] = None,
+    log_every: Optional[int] = None,
+    precision: str = "fp32",
+    grad_accumulation_steps: int = 1,
+    grad_cache: bool = False,
+    snapshot: str = "memory",
+    checkpoint_path: Optional[str] = None,
+    checkpoint_every: Optional[int] = None,
+    resume_from: Optional[str] = None,
+    valid_every: Optional[int] = None,
 ) -> Optional[Any]:
     # Create the training and validation dataloaders
     train_loader, valid_loader = make_default_dataloaders(
@@ -111,4 +120,13 @@ def train_mi_estimator(
         logger=logger,
         train_logged_methods=train_logged_methods,
         eval_logged_methods=eval_logged_methods,
+        log_every=log_every,
+        precision=precision,
+        grad_accumulation_steps=grad_accumulation_steps,
+        grad_cache=grad_cache,
+        snapshot=snapshot,
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=checkpoint_every,
+        resume_from=resume_from,
+        valid_every=valid_every,
     )
@@ -1,4 +1,16 @@
-from typing import Type, Optional, Dict, Any, Union, Tuple, List, Callable
+import itertools
+import time
+from typing import (
+    Type,
+    Optional,
+    Dict,
+    Any,
+    Union,
+    Tuple,
+    List,
+    Callable,
+    Iterator,
+)
 
 import numpy as np
 import torch
@@ -15,6 +27,8 @@ from torch import nn
 from torch.utils.data import DataLoader
 
 from torch_mist.nn import Model
+from torch_mist.utils.caching import step_cache
+from torch_mist.utils.data.stream import has_length
 from torch_mist.utils.data.utils import (
     prepare_variables,
     TensorDictLike,
@@ -24,6 +38,21 @@ from torch_mist.utils.data.utils import (
 from torch_mist.utils.evaluation import evaluate
 from torch_mist.utils.logging import PandasLogger
 from torch_mist.utils.logging.logger.base import Logger, DummyLogger
+from torch_mist.utils.precision import (
+    autocast,
+    check_precision,
+    make_grad_scaler,
+)
+from torch_mist.utils.train.checkpoint import (
+    get_rng_state,
+    set_rng_state,
+    save_checkpoint,
+    load_checkpoint,
+)
+from torch_mist.utils.train.grad_cache import (
+    check_grad_cache_support,
+    grad_cache_backward,
+)
 from torch_mist.utils.train.utils import RunTerminationManager
 
 
@@ -68,6 +97,83 @@ def instantiate_optimizer(
     return opt, lr_scheduler
 
 
+def _skip_batches(
+    train_loader: DataLoader,
+    n_batches: int,
+    rng_state: Optional[Dict[str, Any]] = None,
+) -> Iterator[Any]:
+    # The order of the batches is determined when the first batch is requested.
+    # The first n_batches are skipped, then the random state (if specified) is restored.
+    iterator = iter(train_loader)
+    for _ in range(n_batches):
+        next(iterator)
+    if n_batches > 0 and not (rng_state is None):
+        set_rng_state(rng_state)
+    yield from iterator
+
+
+def _group_batches(
+    batches: Iterator[Any], n_batches: int
+) -> Iterator[List[Any]]:
+    # Group consecutive batches, the last group can contain less than n_batches
+    group = []
+    for samples in batches:
+        group.append(samples)
+        if len(group) == n_batches:
+            yield group
+            group = []
+    if len(group) > 0:
+        yield group
+
+
+def _n_samples(samples: Any) -> int:
+    # Number of entries in a batch of samples (a tensor, a list/tuple or a dictionary of tensors)
+    if torch.is_tensor(samples):
+        return samples.shape[0]
+    if isinstance(samples, dict):
+        samples = list(samples.values())
+    return samples[0].shape[0]
+
+
+def _accumulate_gradient(
+    model: nn.Module,
+    samples: Any,
+    device: Union[str, torch.device],
+    weight: float,
+    train_method: str,
+    eval_method: Optional[str],
+    logger: Logger,
+    train_logged_methods: Optional[List[Union[str, Tuple[str, Callable]]]],
+    eval_logged_methods: Optional[List[Union[str, Tuple[str, Callable]]]],
+    precision: str,
+    grad_scaler: Optional["torch.amp.GradScaler"],
+) -> torch.Tensor:
+    v_args, v_kwargs = prepare_variables(samples, device)
+
+    # The cached values are dropped at the end of each step
+    with step_cache(model):
+        # The forward pass runs in mixed precision (if specified)
+        with autocast(precision, device):
+            with logger.logged_methods(model, train_logged_methods):
+                loss = getattr(model, train_method)(*v_args, **v_kwargs)
+
+            # Compute the evaluation only if necessary
+            if not (eval_method is None) and not isinstance(
+                logger, DummyLogger
+            ):
+                with logger.logged_methods(model, eval_logged_methods):
+                    getattr(model, eval_method)(*v_args, **v_kwargs)
+
+        # The gradients are averaged over the micro-batches, weighted by their size
+        loss = loss * weight
+        if grad_scaler is None:
+            loss.backward()
+        else:
+            grad_scaler.scale(loss).backward()
+
+    return loss.detach()
+
+
 def train_epoch(
     model: nn.Module,
     train_loader: DataLoader,
@@ -85,6 +191,14 @@ def train_epoch(
         List[Union[str, Tuple[str, Callable]]]
     ] = None,
     max_iterations: Optional[int] = None,
+    progress_refresh_interval: float = 0.5,
+    precision: str = "fp32",
+    grad_scaler: Optional["torch.amp.GradScaler"] = None,
+    grad_accumulation_steps: int = 1,
+    grad_cache: bool = False,
+    skip_batches: int = 0,
+    resume_rng_state: Optional[Dict[str, Any]] = None,
+    iteration_callback: Optional[Callable[[int], None]] = None,
 ):
     if not hasattr(model, train_method):
         raise ValueError(
@@ -97,38 +211,97 @@ def train_epoch(
                 f"{model.__class__.__name__} does not have a {eval_method}() method."
             )
 
+    # The loss is accumulated on device and shown on the progress bar at most every progress_refresh_interval seconds
+    loss_sum, n_losses = 0.0, 0
+    last_refresh = time.monotonic()
+
+    # When resuming, the batches used before the checkpoint are skipped
+    if tqdm_iteration and skip_batches > 0:
+        tqdm_iteration.update(skip_batches // grad_accumulation_steps)
+    n_batches = skip_batches
+
     with logger.train():
         model.train()
         with logger.epoch():
-            for samples in train_loader:
-                v_args, v_kwargs = prepare_variables(samples, device)
-
+            for micro_batches in _group_batches(
+                _skip_batches(train_loader, skip_batches, resume_rng_state),
+                grad_accumulation_steps,
+            ):
                 if max_iterations:
                     if logger._iteration >= max_iterations:
                         break
 
+                # One iteration corresponds to one update of the parameters
                 with logger.iteration():
-                    with logger.logged_methods(model, train_logged_methods):
-                        loss = getattr(model, train_method)(
-                            *v_args, **v_kwargs
-                        )
-
-                    # Compute the evaluation only if necessary
-                    if not (eval_method is None) and not isinstance(
-                        logger, DummyLogger
-                    ):
-                        with logger.logged_methods(model, eval_logged_methods):
-                            getattr(model, eval_method)(*v_args, **v_kwargs)
-
                     opt.zero_grad()
-                    loss.backward()
-                    opt.step()
+                    if grad_cache:
+                        loss = grad_cache_backward(
+                            model=model,
+                            micro_batches=micro_batches,
+                            device=device,
+                            train_method=train_method,
+                            eval_method=eval_method,
+                            logger=logger,
+                            train_logged_methods=train_logged_methods,
+                            eval_logged_methods=eval_logged_methods,
+                            precision=precision,
+                            grad_scaler=grad_scaler,
+                        )
+                    else:
+                        loss = 0.0
+                        sizes = [
+                            _n_samples(samples) for samples in micro_batches
+                        ]
+                        for samples, size in zip(micro_batches, sizes):
+                            loss = loss + _accumulate_gradient(
+                                model=model,
+                                samples=samples,
+                                device=device,
+                                weight=size / sum(sizes),
+                                train_method=train_method,
+                                eval_method=eval_method,
+                                logger=logger,
+                                train_logged_methods=train_logged_methods,
+                                eval_logged_methods=eval_logged_methods,
+                                precision=precision,
+                                grad_scaler=grad_scaler,
+                            )
+
+                    if grad_scaler is None:
+                        opt.step()
+                    else:
+                        grad_scaler.step(opt)
+                        grad_scaler.update()
                     if not (lr_scheduler is None):
                         lr_scheduler.step()
 
+                # Called with the number of batches of the epoch used so far (e.g. to save a checkpoint or validate).
+                # The epoch is interrupted if the callback returns True.
+                n_batches += len(micro_batches)
+                stop = False
+                if iteration_callback:
+                    # The callback may evaluate the model, outside of the train split
+                    logger.on_split_end("train")
+                    stop = iteration_callback(n_batches)
+                    logger.on_split_start("train")
+                    model.train()
+
                 if tqdm_iteration:
                     tqdm_iteration.update(1)
-                    tqdm_iteration.set_postfix_str(f"loss: {loss}")
+                    loss_sum = loss_sum + loss.detach()
+                    n_losses += 1
+                    if (
+                        time.monotonic() - last_refresh
+                        >= progress_refresh_interval
+                    ):
+                        tqdm_iteration.set_postfix_str(
+                            f"loss: {(loss_sum / n_losses).item():.4f}"
+                        )
+                        loss_sum, n_losses = 0.0, 0
+                        last_refresh = time.monotonic()
+
+                if stop:
+                    break
 
 
 def validate(
@@ -184,24 +357,42 @@ def is_early_stopping_possible(
     return True
 
 
+def get_iterations_per_epoch(
+    train_loader: DataLoader, grad_accumulation_steps: int = 1
+) -> Optional[int]:
+    # None for the loaders of streams, which do not have a length
+    if not has_length(train_loader):
+        return None
+    return int(np.ceil(len(train_loader) / grad_accumulation_steps))
+
+
 def compute_training_time(
-    iterations_per_epoch: int,
-    max_epochs: int,
-    max_iterations: int,
+    iterations_per_epoch: Optional[int],
+    max_epochs: Optional[int],
+    max_iterations: Optional[int],
     warmup_percentage: float,
-) -> Tuple[int, int, int]:
+) -> Tuple[Optional[int], int, int]:
     if max_iterations is None and max_epochs is None:
         raise ValueError("Please specify either max_epochs or max_iterations")
 
+    if not 0 <= warmup_percentage <= 1:
+        raise ValueError("Warmup percentage must be between 0 and 1")
+
+    # The number of iterations in one pass over a stream is not known in advance
+    if iterations_per_epoch is None:
+        if max_iterations is None:
+            raise ValueError(
+                "Please specify max_iterations for data without a length (e.g. an IterableDataset)."
+            )
+        warmup_iterations = int(max_iterations * warmup_percentage)
+        return max_epochs, max_iterations, warmup_iterations
+
     if max_epochs is None:
         max_epochs = int(np.ceil(max_iterations / iterations_per_epoch))
 
     if max_iterations is None:
         max_iterations = iterations_per_epoch * max_epochs
 
-    if not 0 <= warmup_percentage <= 1:
-        raise ValueError("Warmup percentage must be between 0 and 1")
-
     warmup_iterations = int(
         iterations_per_epoch * max_epochs * warmup_percentage
     )
@@ -237,6 +428,16 @@ def train_model(
     eval_logged_methods: Optional[
         List[Union[str, Tuple[str, Callable]]]
     ] = None,
+    log_every: Optional[int] = None,
+    progress_refresh_interval: float = 0.5,
+    precision: str = "fp32",
+    grad_accumulation_steps: int = 1,
+    grad_cache: bool = False,
+    snapshot: str = "memory",
+    checkpoint_path: Optional[str] = None,
+    checkpoint_every: Optional[int] = None,
+    resume_from: Optional[str] = None,
+    valid_every: Optional[int] = None,
 ) -> Optional[Any]:
     # Create the training and validation dataloaders
     train_loader, valid_loader = make_default_dataloaders(
@@ -247,6 +448,16 @@ def train_model(
         num_workers=num_workers,
     )
 
+    # The gradients of grad_accumulation_steps consecutive batches are accumulated before each update.
+    # With grad_cache, all the samples in the accumulated batches are used as negatives.
+    if grad_accumulation_steps < 1:
+        raise ValueError("grad_accumulation_steps must be a positive integer.")
+    if grad_cache:
+        check_grad_cache_support(model)
+    iterations_per_epoch = get_iterations_per_epoch(
+        train_loader, grad_accumulation_steps
+    )
+
     # Check if early stopping is possible
     if early_stopping:
         early_stopping = is_early_stopping_possible(
@@ -257,19 +468,33 @@ def train_model(
 
     # Determine the training duration
     max_epochs, max_iterations, warmup_iterations = compute_training_time(
-        iterations_per_epoch=len(train_loader),
+        iterations_per_epoch=iterations_per_epoch,
         max_epochs=max_epochs,
         max_iterations=max_iterations,
         warmup_percentage=warmup_percentage,
     )
 
+    # The model is validated at the end of each epoch, or every valid_every iterations if specified.
+    # Since the length of an epoch is unknown for streams, they are validated every ~2% of the iterations by default.
+    if not (valid_every is None) and valid_every < 1:
+        raise ValueError("valid_every must be a positive integer.")
+    if valid_every is None and iterations_per_epoch is None:
+        valid_every = max(1, int(max_iterations * 0.02))
+        if not (valid_loader is None):
+            print(
+                f"[Info]: valid_every is not specified, using valid_every={valid_every} (~2% of the iterations) by default."
+            )
+
     if patience is None and early_stopping:
-        patience = int(max_epochs * 0.02)
+        if valid_every is None:
+            patience = int(max_epochs * 0.02)
+        else:
+            patience = int(max_iterations / valid_every * 0.02)
         if patience < 1:
             patience = 1
 
         print(
-            f"[Info]: patience is not specified, using patience={patience} (~2% of training epochs) by default."
+            f"[Info]: patience is not specified, using patience={patience} (~2% of the validations) by default."
         )
 
     # Instantiate the optimizer and lr_scheduler
@@ -283,6 +508,10 @@ def train_model(
     )
     model = model.to(device)
 
+    # Mixed precision is used only for training, the validation is computed in float32
+    precision = check_precision(precision, device)
+    grad_scaler = make_grad_scaler(precision, device)
+
     # Instantiate the logger
     # If the logger is None, use the default PandasLogger,
     if logger is None:
@@ -291,6 +520,12 @@ def train_model(
     elif logger is False:
         logger = DummyLogger()
 
+    # The logged quantities are accumulated on device and aggregated (synchronized) every log_every iterations
+    if not (log_every is None):
+        if log_every < 1:
+            raise ValueError("log_every must be a positive integer.")
+        logger.log_every = log_every
+
     # If nothing is specified, log the loss and evaluation method
     if train_logged_methods is None:
         train_logged_methods = [train_method]
@@ -307,22 +542,133 @@ def train_model(
         maximize=model.lower_bound,
         minimize=model.upper_bound,
         verbose=verbose,
+        snapshot=snapshot,
     )
 
+    # The state of the training procedure is saved to checkpoint_path at the end of each epoch
+    # and every checkpoint_every iterations (if specified)
+    if not (checkpoint_every is None):
+        if checkpoint_path is None:
+            raise ValueError(
+                "Please specify checkpoint_path to use checkpoint_every."
+            )
+        if checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be a positive integer.")
+
+    def checkpoint(
+        epoch: int,
+        n_batches: int,
+        epoch_rng_state: Dict[str, Any],
+        stopped: bool = False,
+    ):
+        save_checkpoint(
+            path=checkpoint_path,
+            model=model,
+            opt=opt,
+            lr_scheduler=lr_scheduler,
+            grad_scaler=grad_scaler,
+            logger=logger,
+            run_manager=run_manager,
+            epoch=epoch,
+            n_batches=n_batches,
+            epoch_rng_state=epoch_rng_state,
+            stopped=stopped,
+        )
+
+    def validation_step() -> bool:
+        # Compute the validation score
+        valid_score = validate(
+            model=model,
+            eval_method=eval_method if eval_method else train_method,
+            valid_loader=valid_loader,
+            device=device,
+            logger=logger,
+            eval_logged_methods=eval_logged_methods,
+        )
+
+        # Update the bars
+        if tqdm_epochs and valid_score:
+            s = [
+                f"valid_{eval_method if eval_method else train_method}: {np.round(valid_score,3)}"
+            ]
+            if early_stopping:
+                s += [f"patience: {run_manager.current_patience}"]
+                s += [f"best_value: {np.round(run_manager.best_value,3)}"]
+            tqdm_epochs.set_postfix_str(", ".join(s))
+
+        # Determine if the training is over
+        return run_manager.should_stop(
+            iteration=logger._iteration, score=valid_score, model=model
+        )
+
+    def iteration_callback(n_batches: int) -> bool:
+        nonlocal stopped
+        if not (valid_every is None) and logger._iteration % valid_every == 0:
+            stopped = validation_step()
+
+        # epoch and epoch_rng_state refer to the epoch in progress
+        if (
+            not (checkpoint_every is None)
+            and logger._iteration % checkpoint_every == 0
+        ):
+            checkpoint(epoch, n_batches, epoch_rng_state, stopped=stopped)
+        return stopped
+
+    # Restore the state of an interrupted training procedure.
+    # Note that the training (and validation) data must be the same used before the interruption.
+    start_epoch, skip_batches, stopped = 0, 0, False
+    epoch_rng_state, resume_rng_state = None, None
+    if not (resume_from is None):
+        state = load_checkpoint(
+            path=resume_from,
+            model=model,
+            opt=opt,
+            lr_scheduler=lr_scheduler,
+            grad_scaler=grad_scaler,
+            logger=logger,
+            run_manager=run_manager,
+            device=device,
+        )
+        start_epoch, skip_batches = state["epoch"], state["n_batches"]
+        epoch_rng_state, resume_rng_state = (
+            state["epoch_rng_state"],
+            state["rng_state"],
+        )
+        stopped = state["stopped"]
+
     # Bars for training
     tqdm_epochs = (
         tqdm(total=max_epochs, desc="Epoch", position=1) if verbose else None
     )
     tqdm_iteration = (
-        tqdm(total=len(train_loader), desc="Iteration", position=2)
+        tqdm(total=iterations_per_epoch, desc="Iteration", position=2)
         if verbose
         else None
     )
 
-    for epoch in range(max_epochs):
+    if tqdm_epochs:
+        tqdm_epochs.update(start_epoch)
+
+    # The number of epochs is not bounded for streams, unless specified
+    epochs = (
+        itertools.count(start_epoch)
+        if max_epochs is None
+        else range(start_epoch, max_epochs)
+    )
+    for epoch in epochs:
+        if stopped or logger._iteration >= max_iterations:
+            break
+        start_iteration = logger._iteration
+
         if tqdm_epochs:
             tqdm_iteration.reset()
 
+        # The random state at the beginning of the epoch determines the order of the batches
+        if epoch_rng_state is None:
+            epoch_rng_state = get_rng_state()
+        else:
+            set_rng_state(epoch_rng_state)
+
         # Train one epoch
         train_epoch(
             model=model,
@@ -336,35 +682,37 @@ def train_model(
             train_logged_methods=train_logged_methods,
             eval_logged_methods=eval_logged_methods,
             max_iterations=max_iterations,
+            progress_refresh_interval=progress_refresh_interval,
+            precision=precision,
+            grad_scaler=grad_scaler,
+            grad_accumulation_steps=grad_accumulation_steps,
+            grad_cache=grad_cache,
+            skip_batches=skip_batches,
+            resume_rng_state=resume_rng_state,
+            iteration_callback=(
+                None
+                if checkpoint_every is None and valid_every is None
+                else iteration_callback
+            ),
         )
+        skip_batches, epoch_rng_state, resume_rng_state = 0, None, None
 
-        # Compute the validation score
-        valid_score = validate(
-            model=model,
-            eval_method=eval_method if eval_method else train_method,
-            valid_loader=valid_loader,
-            device=device,
-            logger=logger,
-            eval_logged_methods=eval_logged_methods,
-        )
-
-        # Update the bars
         if tqdm_epochs:
-            if valid_score:
-                s = [
-                    f"valid_{eval_method if eval_method else train_method}: {np.round(valid_score,3)}"
-                ]
-                if early_stopping:
-                    s += [f"patience: {run_manager.current_patience}"]
-                    s += [f"best_value: {np.round(run_manager.best_value,3)}"]
-                tqdm_epochs.set_postfix_str(", ".join(s))
             tqdm_epochs.update(1)
 
-        # Determine if the training is over
-        if run_manager.should_stop(
-            iteration=logger._iteration, score=valid_score, model=model
-        ):
-            break
+        # Validate at the end of the epoch, unless the model is validated every valid_every iterations
+        if valid_every is None:
+            stopped = validation_step()
+        elif logger._iteration == start_iteration:
+            print(
+                "[Warning]: The training data is empty, stopping the training."
+            )
+            stopped = True
+        elif logger._iteration >= max_iterations:
+            stopped = True
+
+        if not (checkpoint_path is None):
+            checkpoint(epoch + 1, 0, get_rng_state(), stopped=stopped)
 
     if early_stopping and run_manager.current_patience > 0:
         print(
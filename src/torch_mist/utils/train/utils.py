@@ -1,12 +1,15 @@
 import os.path
 import tempfile
-from copy import deepcopy
-from typing import Optional
 import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from copy import deepcopy
+from typing import Optional, Dict, Any
 
 from torch import nn
 import torch
 
+SNAPSHOT_STRATEGIES = ["memory", "disk", "none"]
+
 
 class RunTerminationManager:
     def __init__(
@@ -19,13 +22,28 @@ class RunTerminationManager:
         verbose: bool = False,
         maximize: bool = False,
         minimize: bool = False,
+        snapshot: str = "memory",
     ):
+        """
+        :param snapshot: how the weights of the best model are stored when early_stopping is used.
+            'memory' keeps a copy on the CPU in buffers that are re-used for each improvement, 'disk' writes the
+            weights to a temporary file on a background thread and 'none' does not store them (the weights of
+            the last iteration are used).
+        """
+        self.__best_model_path = None
+        self.__executor = None
+        self.__pending_save = None
+
         if early_stopping:
             if not maximize and not minimize:
                 print(
                     "[Warning]: early_stopping can be used only when maximizing or minimizing, the parameter will be ignored."
                 )
                 early_stopping = False
+        if not (snapshot in SNAPSHOT_STRATEGIES):
+            raise ValueError(
+                f"Unknown snapshot strategy {snapshot}, please use one of {SNAPSHOT_STRATEGIES}."
+            )
         self.early_stopping = early_stopping
         self.maximize = maximize
         self.minimize = minimize
@@ -36,29 +54,132 @@ class RunTerminationManager:
         self.max_iterations = max_iterations
         self.warmup_iterations = warmup_iterations
         self.verbose = verbose
+        self.snapshot = snapshot
+        self.best_iteration = None
         self.best_state_dict = None
-        self.__best_model_path = None
 
-    def save_weights(self, model: nn.Module, iteration: int):
+    def _copy_state_dict(self, state_dict: Dict[str, Any]):
+        # Re-use the buffers of the previous snapshot if the structure of the state dict has not changed.
+        # Non-tensor entries (e.g. the _extra_state of a module) are copied and do not prevent the re-use.
+        reuse = not (self.best_state_dict is None) and (
+            self.best_state_dict.keys() == state_dict.keys()
+        )
+        if reuse:
+            for name, value in state_dict.items():
+                if not torch.is_tensor(value):
+                    continue
+                buffer = self.best_state_dict[name]
+                if not (
+                    torch.is_tensor(buffer)
+                    and buffer.shape == value.shape
+                    and buffer.dtype == value.dtype
+                ):
+                    reuse = False
+                    break
+
+        if not reuse:
+            self.best_state_dict = {
+                name: (
+                    torch.empty_like(value, device="cpu")
+                    if torch.is_tensor(value)
+                    else None
+                )
+                for name, value in state_dict.items()
+            }
+
+        for name, value in state_dict.items():
+            if torch.is_tensor(value):
+                self.best_state_dict[name].copy_(value.detach())
+            else:
+                self.best_state_dict[name] = deepcopy(value)
+
+    def _wait_for_pending_save(self):
+        if not (self.__pending_save is None):
+            self.__pending_save.result()
+            self.__pending_save = None
+
+    def _save_to_disk(self, state_dict: Dict[str, Any], iteration: int):
+        self._wait_for_pending_save()
         self.delete_best_weights()
         self.__best_model_path = os.path.join(
-            tempfile.gettempdir(), f"model_{iteration}_{time.time}.pyt"
+            tempfile.gettempdir(), f"model_{iteration}_{time.time()}.pyt"
         )
-        torch.save(model.state_dict(), self.__best_model_path)
+
+        # The weights are copied synchronously and written to disk on a background thread
+        state_dict = {
+            name: (
+                value.detach().to("cpu", copy=True)
+                if torch.is_tensor(value)
+                else deepcopy(value)
+            )
+            for name, value in state_dict.items()
+        }
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=1)
+        self.__pending_save = self.__executor.submit(
+            torch.save, state_dict, self.__best_model_path
+        )
+
+    def save_weights(self, model: nn.Module, iteration: int):
+        self.best_iteration = iteration
+        if self.snapshot == "memory":
+            self._copy_state_dict(model.state_dict())
+        elif self.snapshot == "disk":
+            self._save_to_disk(model.state_dict(), iteration)
 
     def load_best_weights(self, model: nn.Module):
-        if not (self.__best_model_path is None):
+        state_dict = None
+        if not (self.best_state_dict is None):
+            state_dict = self.best_state_dict
+        elif not (self.__best_model_path is None):
+            self._wait_for_pending_save()
+            # The state dict can contain the extra state of the modules, which is not restricted to weights
+            state_dict = torch.load(self.__best_model_path, weights_only=False)
+
+        if not (state_dict is None):
             if self.verbose:
-                iteration = self.__best_model_path.split("_")[1].split(".")[0]
-                print(f"Loading the weights saved at iteration {iteration}")
-            model.load_state_dict(torch.load(self.__best_model_path))
+                print(
+                    f"Loading the weights saved at iteration {self.best_iteration}"
+                )
+            model.load_state_dict(state_dict)
         else:
             if self.verbose:
                 print(f"Using the weights from the last iteration")
 
     def delete_best_weights(self):
         if not (self.__best_model_path is None):
-            os.remove(self.__best_model_path)
+            self._wait_for_pending_save()
+            if os.path.exists(self.__best_model_path):
+                os.remove(self.__best_model_path)
+            self.__best_model_path = None
+
+    def state_dict(self) -> Dict[str, Any]:
+        self._wait_for_pending_save()
+        return {
+            "best_value": self.best_value,
+            "current_patience": self.current_patience,
+            "best_iteration": self.best_iteration,
+            "best_state_dict": self.best_state_dict,
+            "best_model_path": self.__best_model_path,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        self.best_value = state_dict["best_value"]
+        self.current_patience = state_dict["current_patience"]
+        self.best_iteration = state_dict["best_iteration"]
+        if not (state_dict["best_state_dict"] is None):
+            self._copy_state_dict(state_dict["best_state_dict"])
+
+        # The weights stored on disk are available only if the file has not been removed
+        best_model_path = state_dict["best_model_path"]
+        if not (best_model_path is None):
+            if os.path.exists(best_model_path):
+                self.delete_best_weights()
+                self.__best_model_path = best_model_path
+            else:
+                print(
+                    f"[Warning]: The best weights ({best_model_path}) can not be found, the weights of the last iteration will be used."
+                )
 
     def should_stop(
         self, iteration: int, score: Optional[float], model: nn.Module
@@ -79,10 +200,8 @@ class RunTerminationManager:
                 self.best_value = score
                 self.current_patience = self.patience
 
-                # Write the best state_dict to disk
+                # Store a snapshot of the best weights
                 self.save_weights(model, iteration)
-
-                self.best_state_dict = deepcopy(model.state_dict())
             elif -improvement < self.tolerance:
                 pass
             else:
@@ -98,3 +217,5 @@ class RunTerminationManager:
 
     def __del__(self):
         self.delete_best_weights()
+        if not (self.__executor is None):
+            self.__executor.shutdown()
@@ -3,7 +3,11 @@ from copy import deepcopy
 import torch
 
 from torch_mist.estimators import js
-from torch_mist.utils.caching import cached_function
+from torch_mist.utils.caching import (
+    cached_function,
+    caching,
+    set_cache_max_memory,
+)
 
 
 def test_caching():
@@ -31,12 +35,13 @@ def test_caching():
     # Check the values
     assert value_1 == value_2 and value_1 != value_3
 
-    # Make sure the cache is automatically invalidated when we use backwards()
-    assert len(estimator.__cache) > 0
+    # Make sure the cache is invalidated at the end of each step
+    assert len(estimator.__cache["unnormalized_log_ratio"]) > 0
 
-    estimator(x + 1, y).backward()
+    with estimator.step_cache():
+        estimator(x + 1, y).backward()
 
-    assert not hasattr(estimator, "__cache")
+    assert len(estimator.__cache["unnormalized_log_ratio"]) == 0
     value_4 = estimator(x + 1, y)
     e2 = deepcopy(estimator)
     assert not (e2 is None)
@@ -47,6 +52,22 @@ def test_caching():
 
     assert e3(x + 1, y) == value_4
 
+    # The cache is invalidated when the parameters are updated outside of step_cache()
+    state_dict = deepcopy(estimator.state_dict())
+    opt = torch.optim.SGD(estimator.parameters(), lr=0.1)
+    value_1 = estimator(x, y)
+    opt.zero_grad()
+    value_1.backward()
+    opt.step()
+    cache_stats = estimator.__cache_stats["unnormalized_log_ratio"]
+    miss = cache_stats["miss"]
+    assert estimator(x, y) != value_1
+    assert cache_stats["miss"] == miss + 1
+
+    estimator.load_state_dict(state_dict)
+    assert estimator(x, y) == value_1
+    assert cache_stats["miss"] == miss + 2
+
 
 @cached_function
 def f(x):
@@ -69,3 +90,76 @@ def test_function_cache():
     f(a)
     stats = f.cache_info()
     assert stats["hits"] == 1 and stats["miss"] == 2
+
+
+def test_lru_cache():
+    calls = []
+
+    @cached_function(max_size=2)
+    def g(x):
+        calls.append(x)
+        return x.sum()
+
+    a = torch.ones(3)
+    b = torch.zeros(3)
+
+    # Alternating calls do not evict each other
+    g(a), g(b), g(a), g(b)
+    assert len(calls) == 2
+
+    # Identity-based keys: same values in a different tensor is a miss
+    g(a.clone())
+    assert len(calls) == 3
+
+    # The least recently used entry (a) has been evicted
+    g(b)
+    assert len(calls) == 3
+    g(a)
+    assert len(calls) == 4
+
+    # In-place modifications invalidate the entry
+    b += 1
+    assert g(b) == 3
+    assert len(calls) == 5
+
+    @cached_function(strict=True)
+    def h(x):
+        calls.append(x)
+        return x.sum()
+
+    # Value-based comparison in strict mode
+    h(a), h(a.clone())
+    assert len(calls) == 6
+
+
+def test_cache_stats():
+    estimator = js(x_dim=1, y_dim=1, hidden_dims=[32])
+    x = torch.zeros(10, 1)
+    y = torch.zeros(10, 1)
+
+    estimator.log_ratio(x, y)
+    estimator.log_ratio(x, y)
+
+    stats = estimator.cache_stats()["unnormalized_log_ratio"]
+    assert stats["hits"] == 1 and stats["miss"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["bytes"] == 10 * 4 and stats["entries"] == 1
+
+    estimator.clear_cache()
+    assert estimator.cache_stats()["unnormalized_log_ratio"]["bytes"] == 0
+
+    estimator.reset_cache_stats()
+    assert estimator.cache_stats()["unnormalized_log_ratio"]["hits"] == 0
+
+    # No values are stored when caching is disabled
+    with caching(False):
+        estimator.log_ratio(x, y)
+    assert estimator.cache_stats()["unnormalized_log_ratio"]["miss"] == 0
+
+    # Values larger than the memory limit are not stored
+    set_cache_max_memory(8)
+    try:
+        estimator.log_ratio(x, y)
+        assert estimator.cache_stats()["unnormalized_log_ratio"]["bytes"] == 0
+    finally:
+        set_cache_max_memory(None)
@@ -1,10 +1,50 @@
+import os
+import pickle
+import sys
+from typing import Dict
+
 import numpy as np
+import pandas as pd
+import pytest
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import (
+    DataLoader,
+    Dataset,
+    Subset,
+    ConcatDataset,
+    IterableDataset,
+)
 
-from torch_mist.data.multimixture import MultivariateCorrelatedNormalMixture
+from torch_mist import estimate_mi
+from torch_mist.data.multimixture import (
+    MultivariateCorrelatedNormalMixture,
+    get_mixture_estimates,
+)
 from torch_mist.data.multivariate import JointMultivariateNormal
-from torch_mist.utils.data.dataset import DistributionDataset
+from torch_mist.utils.data import CSVDataset, BatchSliceSampler
+from torch_mist.utils.data.dataset import (
+    DistributionDataset,
+    SampleDataset,
+    DataFrameDataset,
+)
+from torch_mist.utils.data.loader import (
+    InMemoryDataLoader,
+    supports_batch_indexing,
+)
+from torch_mist.utils.data.utils import (
+    compute_valid_mask,
+    is_valid_entry,
+    filter_dataset,
+    make_default_dataloader,
+    make_default_dataloaders,
+    load_dataset,
+    infer_dims,
+)
+from torch_mist.utils.data.stream import (
+    has_length,
+    reservoir_sample,
+    DistributionStreamDataset,
+)
 
 
 def test_dataloaders():
@@ -19,6 +59,39 @@ def test_dataloaders():
     assert count == 10, "There should be 10 batches"
 
 
+def test_distribution_batches():
+    p_xy = MultivariateCorrelatedNormalMixture(n_dim=5)
+    dataset = DistributionDataset(p_xy, max_samples=1050)
+    assert dataset[10:20]["x"].shape == (10, 5)
+
+    # One slice for each batch
+    dataloader = DataLoader(
+        dataset,
+        sampler=BatchSliceSampler(len(dataset), batch_size=100),
+        batch_size=None,
+    )
+    sizes = [len(batch["x"]) for batch in dataloader]
+    assert sizes == [100] * 10 + [50]
+
+    # The default dataloaders sample one batch at a time
+    dataloader = make_default_dataloader(dataset, batch_size=64)
+    assert isinstance(dataloader, InMemoryDataLoader)
+    assert next(iter(dataloader))["y"].shape == (64, 5)
+
+    # Streams of batches, with a different seed for each worker
+    stream = DistributionStreamDataset(
+        p_xy, batch_size=32, max_batches=6, seed=42
+    )
+    batches = list(DataLoader(stream, batch_size=None, num_workers=2))
+    assert len(batches) == 6
+    assert all(batch["x"].shape == (32, 5) for batch in batches)
+    assert not torch.equal(batches[0]["x"], batches[1]["x"])
+    assert torch.equal(
+        batches[0]["x"],
+        next(iter(DataLoader(stream, batch_size=None, num_workers=2)))["x"],
+    )
+
+
 def test_joint_dist():
     p_XY = JointMultivariateNormal(n_dim=3)
     p_X = p_XY.marginal("x")
@@ -71,3 +144,395 @@ def test_joint_dist():
     assert np.isclose(log_p_xy, log_p_x + log_p_y_x, atol=1e-3)
 
     assert np.isclose(h_x, -log_p_x, atol=1e-2)
+
+
+def test_multimixture_mi(tmp_path):
+    torch.manual_seed(42)
+    params = dict(rho=0.5, sigma=1.0, epsilon=0.5, delta=0.5)
+    p_xy = MultivariateCorrelatedNormalMixture(
+        n_dim=2, cache_dir=str(tmp_path), **params
+    )
+
+    # Compare with a Monte Carlo estimate
+    samples = p_xy.sample([200000])
+    log_ratio = (
+        p_xy.log_prob(**samples)
+        - p_xy.marginal("x").log_prob(samples["x"])
+        - p_xy.marginal("y").log_prob(samples["y"])
+    )
+    mi = p_xy.mutual_information()
+    assert torch.abs(mi - log_ratio.mean()) < 0.01
+    assert torch.isclose(
+        mi, p_xy.entropy("x") + p_xy.entropy("y") - p_xy.entropy("x", "y")
+    )
+
+    # The values are stored on disk
+    assert os.path.isfile(os.path.join(tmp_path, "multimixture.json"))
+    estimates = get_mixture_estimates(cache_dir=str(tmp_path), **params)
+    assert estimates["I(x;y)"] * 2 == pytest.approx(mi.item())
+
+
+def test_valid_mask(tmp_path):
+    x = torch.randn(20, 3)
+    y = torch.randn(20, 2)
+    x[3, 1] = np.nan
+    y[7, 0] = np.nan
+    csv_path = str(tmp_path / "data.csv")
+    pd.DataFrame(
+        {
+            "x_1": x[:, 0],
+            "x_2": x[:, 1],
+            "x_3": x[:, 2],
+            "y_1": y[:, 0],
+            "y_2": y[:, 1],
+        }
+    ).to_csv(csv_path, index=False)
+
+    datasets = [
+        SampleDataset({"x": x, "y": y}),
+        DataFrameDataset(
+            pd.DataFrame(
+                {
+                    "x": x[:, 0].numpy(),
+                    "y": list(y.numpy()),
+                    "a": np.arange(20),
+                }
+            )
+        ),
+        CSVDataset(csv_path, remove_nan_rows=False),
+    ]
+    datasets += [
+        Subset(datasets[0], [7, 0, 3, 5]),
+        ConcatDataset([datasets[0], Subset(datasets[0], [3, 4])]),
+    ]
+
+    for dataset in datasets:
+        # The vectorized mask is consistent with the check of each entry
+        mask = compute_valid_mask(dataset)
+        expected = np.array([bool(is_valid_entry(entry)) for entry in dataset])
+        assert np.array_equal(mask, expected)
+
+        filtered = filter_dataset(dataset)
+        assert len(filtered) == mask.sum() < len(dataset)
+
+
+def test_in_memory_dataloader(tmp_path, capsys):
+    x = torch.randn(50, 3)
+    csv_path = str(tmp_path / "data.csv")
+    pd.DataFrame({"x_1": x[:, 0], "x_2": x[:, 1], "y_1": x[:, 2]}).to_csv(
+        csv_path, index=False
+    )
+
+    datasets = [
+        SampleDataset({"x": x, "y": x[:, 0], "z": x.numpy()}),
+        DataFrameDataset(
+            pd.DataFrame(
+                {
+                    "x": x[:, 0].numpy(),
+                    "y": list(x.numpy()),
+                    "a": np.arange(50),
+                }
+            )
+        ),
+        CSVDataset(csv_path),
+    ]
+    datasets.append(Subset(Subset(datasets[0], range(5, 45)), [3, 1, 20]))
+
+    for dataset in datasets:
+        assert supports_batch_indexing(dataset)
+
+        # Same batches as collating the entries one by one
+        for batch, expected in zip(
+            InMemoryDataLoader(dataset, batch_size=16),
+            DataLoader(dataset, batch_size=16),
+        ):
+            assert batch.keys() == expected.keys()
+            for name in batch:
+                assert batch[name].dtype == expected[name].dtype
+                assert torch.equal(batch[name], expected[name])
+
+        # Each entry is used once per epoch
+        loader = InMemoryDataLoader(dataset, batch_size=16, shuffle=True)
+        batches = list(loader)
+        assert len(batches) == len(loader)
+        assert sum(len(batch["y"]) for batch in batches) == len(dataset)
+
+    # Batches that are not dictionaries are supported too
+    class _TupleDataset(Dataset):
+        def __len__(self):
+            return len(x)
+
+        def __getitem__(self, idx):
+            return x[idx], x[idx, 0]
+
+        def get_batch(self, indices):
+            return x[indices], x[indices, 0]
+
+    batches = list(
+        InMemoryDataLoader(_TupleDataset(), batch_size=16, pin_memory=True)
+    )
+    assert torch.equal(torch.cat([batch[0] for batch in batches]), x)
+
+    # The batches are loaded in the main process
+    InMemoryDataLoader(datasets[0], batch_size=16, num_workers=2)
+    assert "num_workers=2 is ignored" in capsys.readouterr().out
+
+    assert isinstance(
+        make_default_dataloader((x, x), batch_size=16), InMemoryDataLoader
+    )
+    assert not isinstance(
+        make_default_dataloader((x, x), batch_size=16, num_workers=1),
+        InMemoryDataLoader,
+    )
+    train_loader, valid_loader = make_default_dataloaders(
+        pd.DataFrame({"x": x[:, 0].numpy(), "y": x[:, 1].numpy()}),
+        batch_size=16,
+    )
+    assert isinstance(train_loader, InMemoryDataLoader)
+    assert isinstance(valid_loader, InMemoryDataLoader)
+
+
+def test_dataframe_groups():
+    x = np.random.randn(30, 3)
+    df = pd.DataFrame(
+        {
+            "x_1": x[:, 0],
+            "x_2": x[:, 1],
+            "y": x[:, 2],
+            "z": [np.arange(i, i + 2) for i in range(30)],
+        }
+    )
+
+    dataset = DataFrameDataset(df, groups={"x": ["x_1", "x_2"]})
+    assert set(dataset[0].keys()) == {"x", "y", "z"}
+    assert np.array_equal(dataset[4]["x"], x[4, :2].astype(np.float32))
+    assert np.array_equal(dataset[4]["z"], np.arange(4, 6))
+
+    batch = dataset.get_batch(torch.LongTensor([4, 2]))
+    assert batch["x"].shape == (2, 2)
+    assert batch["y"].shape == (2, 1)
+    assert torch.equal(batch["z"], torch.LongTensor([[4, 5], [2, 3]]))
+
+    # The groups are exposed to the estimator as variables
+    train_loader, _ = make_default_dataloaders(dataset, batch_size=8)
+    assert next(iter(train_loader))["x"].dtype == torch.float32
+
+    for groups in [{"x": ["x_1", "w"]}, {"x": ["x_1"], "w": ["x_1"]}]:
+        with pytest.raises(ValueError):
+            DataFrameDataset(df, groups=groups)
+
+    # Integer and categorical columns are stored as floats, unless they are specified as integer variables
+    df["n"] = np.arange(30)
+    df["c"] = pd.Categorical(["a", "b", "c"] * 10)
+    dataset = DataFrameDataset(df, groups={"w": ["n", "c"]})
+    assert dataset.data["w"].dtype == np.float32
+    dataset = DataFrameDataset(
+        df, groups={"w": ["n", "c"]}, integer_variables=["w"]
+    )
+    assert dataset.data["w"].dtype == np.int64
+    assert np.array_equal(dataset[4]["w"], [4, 1])
+    assert dataset.data["y"].dtype == np.float32
+    for integer_variables in [["y"], ["v"]]:
+        with pytest.raises(ValueError):
+            DataFrameDataset(df, integer_variables=integer_variables)
+
+    # The groups can be specified in estimate_mi
+    estimated_mi = estimate_mi(
+        data=df[["x_1", "x_2", "y"]],
+        groups={"x": ["x_1", "x_2"]},
+        max_iterations=5,
+        hidden_dims=[8],
+        verbose=False,
+    )[0]
+    assert np.isfinite(estimated_mi)
+
+    # Integer columns can be used directly as inputs of the estimators
+    estimated_mi = estimate_mi(
+        data=pd.DataFrame(
+            {
+                "x": np.random.randint(0, 5, 100),
+                "y": np.random.randint(0, 5, 100),
+            }
+        ),
+        estimator="js",
+        max_iterations=5,
+        hidden_dims=[8],
+        verbose=False,
+    )[0]
+    assert np.isfinite(estimated_mi)
+
+
+def test_csv_cache(tmp_path):
+    x = np.random.randn(50, 3).astype(np.float32)
+    x[4, 2] = np.nan
+    csv_path = str(tmp_path / "data.csv")
+    cache_dir = str(tmp_path / "cache")
+    pd.DataFrame({"x_1": x[:, 0], "x_2": x[:, 1], "y_1": x[:, 2]}).to_csv(
+        csv_path, index=False
+    )
+
+    dataset = CSVDataset(csv_path, chunksize=16)
+    cached = CSVDataset(csv_path, cache_dir=cache_dir, chunksize=16)
+    assert len(dataset) == len(cached) == 49
+    assert isinstance(cached.data["x"], np.memmap)
+
+    indices = torch.LongTensor([0, 10, 48])
+    for name, value in dataset.get_batch(indices).items():
+        assert value.dtype == torch.float32
+        assert torch.equal(value, cached.get_batch(indices)[name])
+    assert np.array_equal(dataset[5]["x"], cached[5]["x"])
+
+    # The cache is re-used, and re-opened when pickled
+    assert len(os.listdir(cache_dir)) == 1
+    cached = pickle.loads(
+        pickle.dumps(CSVDataset(csv_path, cache_dir=cache_dir))
+    )
+    assert isinstance(cached.data["y"], np.memmap)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # And invalidated when the file or the options change
+    CSVDataset(csv_path, cache_dir=cache_dir, remove_nan_rows=False)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_file_datasets(tmp_path):
+    x = np.random.randn(40, 2)
+    y = np.random.randn(40, 1)
+    z = np.random.randn(40)
+    columns = {"x_1": x[:, 0], "x_2": x[:, 1], "y_1": y[:, 0], "z_1": z}
+
+    paths = {
+        "csv": str(tmp_path / "data.csv"),
+        "npz_columns": str(tmp_path / "columns.npz"),
+        "npz_arrays": str(tmp_path / "arrays.npz"),
+        "npy": str(tmp_path / "data.npy"),
+    }
+    pd.DataFrame(columns).to_csv(paths["csv"], index=False)
+    np.savez(paths["npz_columns"], **columns)
+    # 1-D arrays that are not named as columns are variables of shape [N, 1]
+    np.savez(paths["npz_arrays"], x=x, y_1=y[:, 0], z=z)
+    array = np.zeros(
+        40, dtype=[(name, np.float32) for name in ["x_1", "x_2", "y_1", "z_1"]]
+    )
+    for name, value in columns.items():
+        array[name] = value
+    np.save(paths["npy"], array)
+
+    for name, path in paths.items():
+        # Only the columns of x and y are read
+        dataset = load_dataset(path, variables=["x", "y"])
+        assert set(dataset[0].keys()) == {"x", "y"}, name
+
+        batch = dataset.get_batch(torch.LongTensor([3, 7]))
+        assert batch["x"].dtype == torch.float32
+        assert batch["x"].shape == (2, 2)
+        assert batch["y"].shape == (2, 1)
+        assert np.allclose(batch["x"].numpy(), x[[3, 7]], atol=1e-6)
+
+        assert len(load_dataset(path)[0]) == 3
+
+    with pytest.raises(ValueError):
+        load_dataset(paths["npy"], variables=["w"])
+
+    estimated_mi = estimate_mi(
+        data=paths["npz_columns"],
+        max_iterations=5,
+        hidden_dims=[8],
+        verbose=False,
+    )[0]
+    assert np.isfinite(estimated_mi)
+
+
+def test_missing_pyarrow(tmp_path, monkeypatch):
+    from torch_mist.utils.data.arrow import ParquetDataset
+
+    # Simulate an environment without pyarrow
+    for module in ["pyarrow", "pyarrow.ipc", "pyarrow.parquet"]:
+        monkeypatch.setitem(sys.modules, module, None)
+    path = tmp_path / "data.parquet"
+    path.touch()
+    with pytest.raises(ImportError, match="pip install"):
+        ParquetDataset(str(path))
+
+
+def test_arrow_datasets(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from pyarrow import feather
+    from torch_mist.utils.data.arrow import ParquetDataset, ArrowDataset
+
+    x = np.random.randn(50, 3)
+    x[5, 0] = np.nan
+    table = pa.table({"x_1": x[:, 0], "x_2": x[:, 1], "y_1": x[:, 2]})
+    parquet_path = str(tmp_path / "data.parquet")
+    arrow_path = str(tmp_path / "data.arrow")
+    pq.write_table(table, parquet_path, row_group_size=16)
+    feather.write_feather(table, arrow_path, chunksize=16)
+
+    for dataset_class, path in [
+        (ParquetDataset, parquet_path),
+        (ArrowDataset, arrow_path),
+    ]:
+        in_memory = dataset_class(path)
+        lazy = pickle.loads(
+            pickle.dumps(
+                dataset_class(path, in_memory=False, max_cached_chunks=2)
+            )
+        )
+        assert len(in_memory) == len(lazy) == 50
+        assert np.array_equal(in_memory.valid_mask(), lazy.valid_mask())
+
+        indices = torch.LongTensor([49, 0, 17, 33, 16])
+        for name, value in in_memory.get_batch(indices).items():
+            assert torch.equal(value, lazy.get_batch(indices)[name])
+        assert np.array_equal(in_memory[20]["x"], lazy[20]["x"])
+        assert len(load_dataset(path, variables=["y"])[0]) == 1
+
+
+class _Stream(IterableDataset):
+    def __init__(self, samples: Dict[str, np.ndarray]):
+        self.samples = samples
+
+    def __iter__(self):
+        n_samples = len(next(iter(self.samples.values())))
+        for i in range(n_samples):
+            yield {name: value[i] for name, value in self.samples.items()}
+
+
+def test_streams():
+    x = np.arange(200, dtype=np.float32).reshape(-1, 1)
+    x[3] = np.nan
+    stream = _Stream({"x": x, "y": x})
+
+    torch.manual_seed(0)
+    train_loader, valid_loader = make_default_dataloaders(
+        stream, batch_size=16, valid_percentage=0.2, shuffle_buffer_size=32
+    )
+    assert not has_length(train_loader)
+
+    # The splits are disjoint, cover the valid entries and are the same at each pass
+    train_values = [
+        torch.cat([b["x"] for b in train_loader]) for _ in range(2)
+    ]
+    valid_values = torch.cat([b["x"] for b in valid_loader])
+    assert not torch.equal(train_values[0], train_values[1])
+    assert torch.equal(
+        train_values[0].sort(0).values, train_values[1].sort(0).values
+    )
+    assert 20 < len(valid_values) < 60
+    assert torch.equal(
+        torch.cat([train_values[0], valid_values]).sort(0).values.view(-1),
+        torch.FloatTensor([v for v in range(200) if v != 3]),
+    )
+
+    # The validation entries can be reduced to a fixed set in memory
+    _, valid_loader = make_default_dataloaders(
+        stream, batch_size=16, valid_percentage=0.2, max_valid_samples=10
+    )
+    assert len(valid_loader.dataset) == 10
+
+    sample = reservoir_sample(stream, n_samples=5, max_entries=50)
+    assert len(sample) == 5
+    assert sample.samples["x"].max() < 50
+
+    assert infer_dims(stream) == {"x": 1, "y": 1}
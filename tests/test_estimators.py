@@ -2,13 +2,17 @@ from copy import deepcopy
 from typing import Tuple, Dict, Type, Any
 
 import numpy as np
+import pytest
 import torch
 from torch.optim import Optimizer, Adam
 from pyro.distributions.transforms import conditional_affine_coupling
 from torch.utils.data import DataLoader
 
 from torch_mist.data.multivariate import JointMultivariateNormal
-from torch_mist.distributions import conditional_transformed_normal
+from torch_mist.distributions import (
+    conditional_transformed_normal,
+    MemoryBank,
+)
 from torch_mist.distributions.normal import ConditionalStandardNormalModule
 from torch_mist.distributions.transforms import (
     ConditionalTransformedDistributionModule,
@@ -39,10 +43,13 @@ from torch_mist.quantization import (
     vqvae,
     kmeans_quantization,
 )
+from torch_mist import estimate_mi
 from torch_mist.utils.data import SampleDataset
 from torch_mist.utils.data.dataset import DistributionDataset
 
-from torch_mist.utils.evaluation import evaluate_mi
+from torch_mist.utils.evaluation import evaluate_mi, evaluate
+from torch_mist.utils.indexing import select_k_others
+from torch_mist.utils.train.grad_cache import grad_cache_backward
 from torch_mist.utils.train.mi_estimator import train_mi_estimator
 
 
@@ -217,6 +224,347 @@ def test_discriminative_estimators():
         )
 
 
+def test_chunked_estimators():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    x = torch.randn(32, x_dim)
+    y = torch.randn(32, y_dim)
+
+    configs = [
+        ("nwj", dict(neg_samples=neg_samples)),
+        ("infonce", dict(hidden_dims=hidden_dims + [k_dim])),
+        ("infonce", dict(hidden_dims=hidden_dims + [k_dim], neg_samples=-3)),
+        ("js", dict(neg_samples=neg_samples)),
+        ("mine", dict(neg_samples=neg_samples)),
+        ("smile", dict(neg_samples=0, tau=1.0)),
+        ("tuba", dict(neg_samples=neg_samples)),
+        ("alpha_tuba", dict(k_dim=k_dim, alpha=0.4)),
+        ("flo", dict(neg_samples=-1)),
+    ]
+
+    for estimator_name, params in configs:
+        params = {"hidden_dims": hidden_dims, **params}
+        estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            **params,
+        )
+        chunked_estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            max_chunk_elements=100,
+            **params,
+        )
+        chunked_estimator.load_state_dict(estimator.state_dict())
+        estimator.eval()
+        chunked_estimator.eval()
+
+        for method in ["log_ratio", "batch_loss"]:
+            value = getattr(estimator, method)(x, y)
+            chunked_value = getattr(chunked_estimator, method)(x, y)
+            assert torch.allclose(
+                value, chunked_value, atol=1e-5
+            ), f"{estimator_name}.{method}: {value} != {chunked_value}"
+
+        # The gradients are the same with the checkpointed chunks
+        for model in [estimator, chunked_estimator]:
+            with model.step_cache():
+                model.batch_loss(x, y).mean().backward()
+        grad = torch.cat([p.grad.reshape(-1) for p in estimator.parameters()])
+        chunked_grad = torch.cat(
+            [p.grad.reshape(-1) for p in chunked_estimator.parameters()]
+        )
+        assert (
+            grad - chunked_grad
+        ).norm() <= 1e-4 * grad.norm(), f"{estimator_name}: gradient mismatch"
+
+    # With gradients enabled, the activations of the critic on the negatives are not stored for the backward pass
+    def _saved_bytes(estimator: MIEstimator) -> int:
+        saved = []
+
+        def pack(tensor: torch.Tensor) -> torch.Tensor:
+            saved.append(tensor.numel() * tensor.element_size())
+            return tensor
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            with estimator.step_cache():
+                estimator.loss(x, y).backward()
+        return sum(saved)
+
+    x = torch.randn(128, x_dim)
+    y = torch.randn(128, y_dim)
+    for estimator_name in ["nwj", "js"]:
+        saved_bytes = [
+            _saved_bytes(
+                instantiate_estimator(
+                    estimator_name=estimator_name,
+                    x_dim=x_dim,
+                    y_dim=y_dim,
+                    hidden_dims=hidden_dims,
+                    critic_type="joint",
+                    neg_samples=-1,
+                    max_chunk_elements=max_chunk_elements,
+                )
+            )
+            for max_chunk_elements in [None, 512]
+        ]
+        # The critic on the 127 x 128 negative pairs stores O(N x M x hidden_dims) values otherwise
+        assert saved_bytes[1] * 20 < saved_bytes[0], saved_bytes
+
+
+def test_compiled_estimators():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    x = torch.randn(32, x_dim)
+    y = torch.randn(32, y_dim)
+
+    configs = [
+        ("nwj", dict(neg_samples=neg_samples)),
+        ("js", dict(neg_samples=-1)),
+        ("smile", dict(neg_samples=0, tau=1.0)),
+        ("mine", dict(neg_samples=0)),
+        ("infonce", dict(neg_samples=0)),
+        ("flo", dict(neg_samples=-1)),
+    ]
+
+    for estimator_name, params in configs:
+        params = {"hidden_dims": hidden_dims, **params}
+        estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            **params,
+        )
+        compiled_estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            compile=True,
+            **params,
+        )
+        compiled_estimator.load_state_dict(estimator.state_dict())
+
+        for model in [estimator, compiled_estimator]:
+            with model.step_cache():
+                model.loss(x, y).backward()
+
+        value = estimator.log_ratio(x, y)
+        compiled_value = compiled_estimator.log_ratio(x, y)
+        assert torch.allclose(
+            value, compiled_value, atol=1e-5
+        ), f"{estimator_name}: {value} != {compiled_value}"
+
+        grad = torch.cat([p.grad.reshape(-1) for p in estimator.parameters()])
+        compiled_grad = torch.cat(
+            [p.grad.reshape(-1) for p in compiled_estimator.parameters()]
+        )
+        assert (
+            grad - compiled_grad
+        ).norm() <= 1e-4 * grad.norm(), f"{estimator_name}: gradient mismatch"
+
+
+def test_separable_negatives():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    x = torch.randn(32, x_dim)
+    y = torch.randn(32, y_dim)
+
+    for neg in [1, 5, 31, 0, -1, -5]:
+        estimator = instantiate_estimator(
+            estimator_name="nwj",
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims + [k_dim],
+            critic_type="separable",
+            neg_samples=neg,
+        )
+        M = estimator.n_negatives_to_use(x.shape[0])
+
+        # Reference implementation: evaluate the critic on the explicit negatives
+        if neg == 0:
+            y_ = y.unsqueeze(1).expand(-1, x.shape[0], -1)
+        else:
+            y_ = select_k_others(y, M)
+        f_ = estimator.critic.f_x(x).unsqueeze(0) * estimator.critic.f_y(y_)
+        f_ = f_.sum(-1)
+        f = estimator.critic(x, y)
+        expected = f - ((f_ - 1.0).exp().mean(0) + 1.0 - 1.0)
+
+        with estimator.step_cache():
+            log_ratio = estimator.log_ratio(x, y)
+            stats = estimator.cache_stats()
+
+        assert torch.allclose(log_ratio, expected, atol=1e-5)
+
+        # x and y are embedded only once
+        assert stats["critic.embed_x"]["miss"] == 1
+        assert stats["critic.embed_y"]["miss"] == 1
+
+
+def test_memory_bank():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    batches = [torch.randn(8, x_dim + y_dim) for _ in range(4)]
+
+    for embedded in [False, True]:
+        estimator = instantiate_estimator(
+            estimator_name="infonce",
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims + [k_dim],
+            critic_type="separable",
+        )
+        encoder = estimator.critic.f_y if embedded else None
+        estimator.proposal = MemoryBank(
+            capacity=20,
+            encoder=encoder,
+            momentum=0.9 if embedded else None,
+        )
+        opt = Adam(estimator.parameters(), lr=1e-3)
+
+        for i, batch in enumerate(batches):
+            x, y = batch[:, :x_dim], batch[:, x_dim:]
+            with estimator.step_cache():
+                loss = estimator.loss(x, y)
+                # The current batch and the stored samples are used as negatives
+                assert estimator.n_negatives_to_use(8) == min(8 * (i + 1), 28)
+                opt.zero_grad()
+                loss.backward()
+                opt.step()
+            assert len(estimator.proposal) == min(8 * (i + 1), 20)
+
+        # The memory is not updated during evaluation
+        estimator.eval()
+        with estimator.step_cache():
+            estimator.log_ratio(x, y)
+        assert len(estimator.proposal) == 20
+
+    # Without embeddings the negatives are equivalent to the explicit ones
+    estimator.proposal = MemoryBank(capacity=20)
+    estimator.train()
+    x, y = batches[0][:, :x_dim], batches[0][:, x_dim:]
+    estimator.proposal.add_samples(y)
+    estimator.proposal.update()
+    y_ = torch.cat([y, y])
+    f = estimator.critic(x, y)
+    f_ = estimator.critic(x.unsqueeze(0), y_.unsqueeze(1))
+    expected = f - torch.logsumexp(f_, 0) + np.log(16)
+
+    with estimator.step_cache():
+        log_ratio = estimator.log_ratio(x, y)
+    assert torch.allclose(log_ratio, expected, atol=1e-5)
+
+    # Positive values of neg_samples sample the negatives from the memory bank
+    for critic_type in ["joint", "separable"]:
+        estimator = instantiate_estimator(
+            estimator_name="js",
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims,
+            critic_type=critic_type,
+            k_dim=k_dim,
+            neg_samples=3,
+            memory_bank_capacity=20,
+        )
+        for i, batch in enumerate(batches):
+            x, y = batch[:, :x_dim], batch[:, x_dim:]
+            with estimator.step_cache():
+                _, y_, _ = estimator.sample_negatives(x, y)
+                if i == 0:
+                    # The other samples in the current batch are used until the bank is filled
+                    assert torch.equal(y_, select_k_others(y, 3))
+                else:
+                    # The stored samples of the previous batches
+                    assert y_.shape == (3, 1, y_dim)
+                    stored = torch.cat(batches[:i])[:, x_dim:]
+                    assert all(
+                        (stored == negative).all(-1).any()
+                        for negative in y_[:, 0]
+                    )
+                estimator.loss(x, y)
+
+    with pytest.raises(ValueError):
+        instantiate_estimator(
+            estimator_name="js",
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims,
+            neg_samples=30,
+            memory_bank_capacity=20,
+        )
+
+    # The embeddings of the current batch are computed once by the critic
+    estimator = instantiate_estimator(
+        estimator_name="infonce",
+        x_dim=x_dim,
+        y_dim=y_dim,
+        hidden_dims=hidden_dims,
+        critic_type="separable",
+        k_dim=k_dim,
+        memory_bank_capacity=20,
+        memory_bank_momentum=0.9,
+    )
+    n_calls = []
+    estimator.critic.f_y.register_forward_hook(lambda *args: n_calls.append(1))
+    x, y = batches[0][:, :x_dim], batches[0][:, x_dim:]
+    with estimator.step_cache():
+        estimator.loss(x, y)
+    assert len(n_calls) == 1
+
+
+def test_memory_bank_estimation():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    train_samples, test_samples, true_mi, _ = _make_data()
+
+    # The memory bank is specified with the parameters of the factory functions
+    for momentum in [None, 0.9]:
+        estimated_mi, estimator, _ = estimate_mi(
+            data=(train_samples["x"], train_samples["y"]),
+            test_data=(test_samples["x"], test_samples["y"]),
+            estimator="infonce",
+            hidden_dims=hidden_dims,
+            critic_type="separable",
+            k_dim=k_dim,
+            memory_bank_capacity=128,
+            memory_bank_momentum=momentum,
+            batch_size=batch_size,
+            max_epochs=max_epochs,
+            return_estimator=True,
+        )
+        assert isinstance(estimator.proposal, MemoryBank)
+        assert estimator.proposal.embedded == (momentum is not None)
+        assert len(estimator.proposal) == 128
+        # The stored embeddings are computed with a lagging (momentum) encoder, which biases the evaluation:
+        # only the estimates with the stored samples are compared with the true value
+        if momentum is None:
+            assert estimated_mi == pytest.approx(true_mi, abs=atol)
+        else:
+            assert np.isfinite(estimated_mi)
+
+    with pytest.raises(ValueError):
+        instantiate_estimator(
+            estimator_name="js",
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims,
+            memory_bank_capacity=128,
+            memory_bank_momentum=0.9,
+        )
+
+
 def test_dummy_estimators():
     # Seed everything
     np.random.seed(0)
@@ -539,3 +887,222 @@ def test_multi_estimator():
     assert np.isclose(
         mi_estimate["I(x;z)"], 0, atol=atol
     ), f"Estimate {mi_estimate} is not close to true value {0}."
+
+
+def test_log_every():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    train_samples, _, _, _ = _make_data()
+    n_samples = 640
+    train_samples = {k: v[:n_samples] for k, v in train_samples.items()}
+
+    logs = []
+    for log_every in [1, 5]:
+        torch.manual_seed(0)
+        estimator = js(
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims,
+            neg_samples=neg_samples,
+        )
+        log = train_mi_estimator(
+            estimator,
+            train_data=train_samples,
+            max_epochs=1,
+            batch_size=64,
+            valid_percentage=0,
+            verbose=False,
+            log_every=log_every,
+        )
+        logs.append(log[log["name"] == "loss"])
+
+    # The losses are aggregated on groups of log_every iterations
+    assert len(logs[0]) == n_samples // 64
+    assert len(logs[1]) == n_samples // 64 // 5
+    assert np.allclose(
+        logs[0]["value"].values.reshape(-1, 5).mean(-1),
+        logs[1]["value"].values,
+        atol=1e-5,
+    )
+
+
+def test_mixed_precision():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    train_samples, test_samples, true_mi, _ = _make_data()
+
+    configs = [
+        ("infonce", dict(hidden_dims=hidden_dims + [k_dim])),
+        ("smile", dict(neg_samples=neg_samples)),
+        ("doe", dict(marginal_transform_name="spline_autoregressive")),
+    ]
+
+    for estimator_name, params in configs:
+        params = {"hidden_dims": hidden_dims, **params}
+        estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            **params,
+        )
+
+        # fp16 is not supported on CPU, bf16 is used instead
+        for precision in ["bf16", "fp16"]:
+            log = train_mi_estimator(
+                estimator,
+                train_data=train_samples,
+                max_epochs=1,
+                batch_size=batch_size,
+                valid_percentage=0,
+                verbose=False,
+                precision=precision,
+            )
+            assert np.all(np.isfinite(log["value"].values))
+
+        mi_estimate = evaluate_mi(
+            estimator, data=test_samples, batch_size=batch_size
+        )
+        assert np.isfinite(mi_estimate)
+
+
+def test_grad_accumulation():
+    # Seed everything
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    x = torch.randn(64, x_dim)
+    y = x + torch.randn(64, y_dim) * 0.5
+
+    for estimator_name in ["infonce", "smile"]:
+        estimator = instantiate_estimator(
+            estimator_name=estimator_name,
+            x_dim=x_dim,
+            y_dim=y_dim,
+            hidden_dims=hidden_dims + [k_dim],
+            critic_type="separable",
+            neg_samples=0,
+        )
+
+        # Reference: gradient of the loss on the full batch
+        with estimator.step_cache():
+            estimator.loss(x, y).backward()
+        grads = [p.grad.clone() for p in estimator.parameters()]
+        estimator.zero_grad()
+
+        # Gradient computed one micro-batch at a time using the full batch as negatives
+        micro_batches = [
+            {"x": x[i : i + 16], "y": y[i : i + 16]} for i in range(0, 64, 16)
+        ]
+        grad_cache_backward(
+            model=estimator,
+            micro_batches=micro_batches,
+            device="cpu",
+        )
+        for grad, param in zip(grads, estimator.parameters()):
+            assert torch.allclose(grad, param.grad, atol=1e-5)
+
+    # Stochastic embeddings: the dropout masks of the re-computation match the ones of the first pass
+    estimator = instantiate_estimator(
+        estimator_name="infonce",
+        x_dim=x_dim,
+        y_dim=y_dim,
+        hidden_dims=hidden_dims + [k_dim],
+        critic_type="separable",
+        neg_samples=0,
+    )
+    critic = estimator.critic
+    critic.f_x = torch.nn.Sequential(critic.f_x, torch.nn.Dropout(0.5))
+    micro_batches = [
+        {"x": x[i : i + 16], "y": y[i : i + 16]} for i in range(0, 64, 16)
+    ]
+
+    # Reference: back-propagation through the embeddings computed in the same order
+    torch.manual_seed(1)
+    f_x, f_y = [], []
+    for samples in micro_batches:
+        f_x.append(critic.f_x(samples["x"]))
+        f_y.append(critic.f_y(samples["y"]))
+    rng_state = torch.get_rng_state()
+    with estimator.step_cache(), critic.precomputed_embeddings():
+        estimator.loss(x=torch.cat(f_x), y=torch.cat(f_y)).backward()
+    grads = [p.grad.clone() for p in estimator.parameters()]
+    estimator.zero_grad()
+
+    torch.manual_seed(1)
+    grad_cache_backward(
+        model=estimator,
+        micro_batches=micro_batches,
+        device="cpu",
+    )
+    for grad, param in zip(grads, estimator.parameters()):
+        assert torch.allclose(grad, param.grad, atol=1e-5)
+    # The random number generator continues from the state after the first pass
+    assert torch.equal(torch.get_rng_state(), rng_state)
+
+    # One iteration for each group of grad_accumulation_steps batches
+    train_samples, _, _, _ = _make_data()
+    train_samples = {k: v[:640] for k, v in train_samples.items()}
+    for grad_cache in [False, True]:
+        log = train_mi_estimator(
+            estimator,
+            train_data=train_samples,
+            max_epochs=1,
+            batch_size=16,
+            valid_percentage=0,
+            verbose=False,
+            grad_accumulation_steps=4,
+            grad_cache=grad_cache,
+        )
+        assert log["iteration"].max() == 640 // 16 // 4
+
+
+def test_weighted_evaluation():
+    class BatchMean(torch.nn.Module):
+        def mean(self, x, y):
+            return x.mean()
+
+        def means(self, x, y):
+            return {"x": x.mean(), "y": y.mean()}
+
+        def grad_enabled(self, x, y):
+            return float(torch.is_grad_enabled())
+
+    samples = {"x": torch.randn(1000, 1), "y": torch.randn(1000, 1) + 1}
+
+    # The last (smaller) batch is weighted by its size
+    value = evaluate(
+        BatchMean(), "mean", data=SampleDataset(samples), batch_size=300
+    )
+    assert np.isclose(value, samples["x"].mean().item(), atol=1e-6)
+
+    # No computational graph is stored during the evaluation
+    assert (
+        evaluate(
+            BatchMean(),
+            "grad_enabled",
+            data=SampleDataset(samples),
+            batch_size=300,
+        )
+        == 0
+    )
+
+    for interval_method in ["batch_means", "bootstrap"]:
+        values, intervals = evaluate(
+            BatchMean(),
+            "means",
+            data=SampleDataset(samples),
+            batch_size=50,
+            confidence=0.99,
+            interval_method=interval_method,
+        )
+        for key in ["x", "y"]:
+            low, high = intervals[key]
+            assert np.isclose(
+                values[key], samples[key].mean().item(), atol=1e-6
+            )
+            assert low < values[key] < high
+            assert high - low < 0.5
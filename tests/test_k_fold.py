@@ -35,3 +35,44 @@ def test_kfold_validation():
 
         assert np.isclose(estimated_mi, true_value, rtol=0.1), estimated_mi
         assert not (log is None)
+
+
+def test_parallel_kfold():
+    x = np.random.randn(200, 2)
+    y = x + np.random.randn(200, 2)
+
+    results = []
+    for n_jobs in [1, 2, 3]:
+        estimated_mi, log = k_fold_mi_estimate(
+            data=(x, y),
+            estimator="smile",
+            max_iterations=20,
+            folds=3,
+            hidden_dims=[16],
+            seed=42,
+            verbose=False,
+            n_jobs=n_jobs,
+        )
+        results.append((estimated_mi, log))
+
+    # The parallel results do not depend on the number of jobs
+    assert results[1][0] == results[2][0]
+    assert results[1][1].equals(results[2][1])
+
+    # The sequential results are reproducible with the same seed
+    estimated_mi, _ = k_fold_mi_estimate(
+        data=(x, y),
+        estimator="smile",
+        max_iterations=20,
+        folds=3,
+        hidden_dims=[16],
+        seed=42,
+        verbose=False,
+    )
+    assert estimated_mi == results[0][0]
+    assert list(results[0][1]["split"][:4]) == [
+        "train",
+        "valid",
+        "test",
+        "all",
+    ]
@@ -8,7 +8,10 @@ from torch_mist.utils.data import (
     SampleDataset,
     sample_same_attributes,
 )
-from torch.utils.data import DataLoader
+from torch_mist.quantization import VectorQuantization
+from torch_mist.utils.data.loader import sample_same_value
+from torch_mist.utils.data.utils import _state_hash
+from torch.utils.data import DataLoader, Subset
 
 
 def _test_same_attributes_in_batch(dataloader):
@@ -91,3 +94,83 @@ def test_same_attribute_samples():
     _test_same_attributes_in_batch(
         sample_same_attributes(dataloader, a, neg_samples=9)
     )
+
+
+def test_sampler_many_attributes():
+    attributes = np.random.randint(0, 256, 10000)
+    neg_samples = 3
+    sampler = SameAttributeSampler(
+        batch_size=32, neg_samples=neg_samples, attributes=attributes
+    )
+
+    batches = np.stack(list(sampler))
+    assert len(batches) == len(sampler)
+
+    # Each group of entries shares the same attribute, and each entry is used at most once
+    batch_a = attributes[batches].reshape(len(batches), neg_samples + 1, -1)
+    assert (batch_a == batch_a[:, :1]).all()
+    assert len(np.unique(batches)) == batches.size
+
+    # The batches are different at each epoch
+    assert not np.array_equal(batches, np.stack(list(sampler)))
+
+
+def test_cached_attributes():
+    samples = MultivariateCorrelatedNormalMixture(n_dim=2).sample([1000])
+    dataset = SampleDataset(samples)
+    train_set = Subset(dataset, range(800))
+    test_set = Subset(dataset, range(500, 1000))
+
+    n_calls = []
+
+    def f(batch):
+        n_calls.append(len(batch["y"]))
+        return _compute_attributes(batch["y"])
+
+    dataloader = sample_same_value(
+        DataLoader(train_set, batch_size=100), f, neg_samples=9, cache_key="a"
+    )
+    _test_same_attributes_in_batch(dataloader)
+    assert sum(n_calls) == 800
+
+    # Only the entries that are not in the cache are computed
+    dataloader = sample_same_value(
+        DataLoader(test_set, batch_size=100), f, neg_samples=9, cache_key="a"
+    )
+    _test_same_attributes_in_batch(dataloader)
+    assert sum(n_calls) == 1000
+
+    # A different key invalidates the cache
+    sample_same_value(
+        DataLoader(test_set, batch_size=100), f, neg_samples=9, cache_key="b"
+    )
+    assert sum(n_calls) == 1500
+
+
+def test_state_hash():
+    quantization = VectorQuantization(vectors=torch.randn(8, 2))
+    key = _state_hash([quantization])
+
+    # The state_dict is hashed again only after the state has been modified
+    n_calls = []
+    state_dict = quantization.state_dict
+
+    def _counted_state_dict(*args, **kwargs):
+        n_calls.append(1)
+        return state_dict(*args, **kwargs)
+
+    quantization.state_dict = _counted_state_dict
+    assert _state_hash([quantization]) == key
+    assert len(n_calls) == 0
+
+    quantization.vectors.mul_(2)
+    assert _state_hash([quantization]) != key
+    assert len(n_calls) == 1
+
+    # Modules with the same state have the same hash
+    quantization.vectors.div_(2)
+    assert _state_hash([quantization]) == key
+    assert (
+        _state_hash([VectorQuantization(vectors=quantization.vectors.clone())])
+        == key
+    )
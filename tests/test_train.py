@@ -0,0 +1,349 @@
+from copy import deepcopy
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, IterableDataset
+
+from torch_mist import estimate_mi_ensemble
+from torch_mist.distributions import MemoryBank
+from torch_mist.estimators import instantiate_estimator
+from torch_mist.utils.data.dataset import SampleDataset
+from torch_mist.utils.logging import PandasLogger
+from torch_mist.utils.logging.logger.base import DummyLogger
+from torch_mist.utils.train import train_mi_estimator, train_ensemble
+from torch_mist.utils.train.model import train_epoch
+from torch_mist.utils.train.utils import RunTerminationManager
+
+
+class _StatefulLinear(nn.Linear):
+    def __init__(self):
+        super().__init__(4, 2)
+        self.stats = np.zeros(3)
+
+    def get_extra_state(self) -> dict:
+        return {"stats": self.stats.copy()}
+
+    def set_extra_state(self, state: dict):
+        self.stats = state["stats"]
+
+
+def test_snapshot():
+    for snapshot in ["memory", "disk", "none"]:
+        # The extra state (not a tensor) does not prevent the re-use of the buffers
+        model = _StatefulLinear()
+        run_manager = RunTerminationManager(
+            early_stopping=True,
+            tolerance=0,
+            patience=2,
+            warmup_iterations=0,
+            max_iterations=None,
+            maximize=True,
+            snapshot=snapshot,
+        )
+
+        best_weights = None
+        buffer = None
+        for iteration, score in enumerate([1.0, 2.0, 3.0, 1.0, 0.5]):
+            with torch.no_grad():
+                model.weight.add_(1.0)
+            stop = run_manager.should_stop(
+                iteration=iteration + 1, score=score, model=model
+            )
+            if score == 3.0:
+                best_weights = model.weight.detach().clone()
+            if snapshot == "memory" and score == 1.0 and iteration == 0:
+                buffer = run_manager.best_state_dict["weight"]
+            assert stop == (iteration == 4)
+
+        last_weights = model.weight.detach().clone()
+        run_manager.load_best_weights(model)
+
+        if snapshot == "none":
+            assert torch.equal(model.weight, last_weights)
+        else:
+            assert torch.equal(model.weight, best_weights)
+            assert run_manager.best_iteration == 3
+
+        # The buffers are re-used for each improvement
+        if snapshot == "memory":
+            assert run_manager.best_state_dict["weight"] is buffer
+
+    # Extra state that is not restricted to tensors is restored from the disk snapshot
+    model = _StatefulLinear()
+    run_manager = RunTerminationManager(
+        early_stopping=True,
+        tolerance=0,
+        patience=2,
+        warmup_iterations=0,
+        max_iterations=None,
+        maximize=True,
+        snapshot="disk",
+    )
+    run_manager.should_stop(iteration=1, score=1.0, model=model)
+    model.stats = np.ones(3)
+    run_manager.load_best_weights(model)
+    assert np.array_equal(model.stats, np.zeros(3))
+    run_manager.delete_best_weights()
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class _InterruptingLogger(PandasLogger):
+    def __init__(self, interrupt_at: int):
+        super().__init__()
+        self.interrupt_at = interrupt_at
+
+    def on_iteration_start(self):
+        if self._iteration == self.interrupt_at:
+            raise _Interrupted()
+
+
+def test_resume(tmp_path):
+    x = torch.randn(100, 2)
+    y = x + torch.randn(100, 2)
+    checkpoint_path = str(tmp_path / "checkpoint.pyt")
+
+    # MINE uses an exponential moving average baseline, NWJ is used with early stopping, and InfoNCE with a memory
+    # bank of negatives
+    for estimator_name, early_stopping in [
+        ("mine", False),
+        ("nwj", True),
+        ("infonce", False),
+    ]:
+
+        def train(seed: int, logger: PandasLogger, **kwargs):
+            torch.manual_seed(seed)
+            estimator = instantiate_estimator(
+                estimator_name=estimator_name,
+                x_dim=2,
+                y_dim=2,
+                hidden_dims=[16],
+            )
+            if estimator_name == "infonce":
+                estimator.proposal = MemoryBank(capacity=40)
+            torch.manual_seed(0)
+            log = train_mi_estimator(
+                estimator=estimator,
+                train_data=(x, y),
+                batch_size=16,
+                max_epochs=4,
+                lr_annealing=True,
+                warmup_percentage=0.2,
+                early_stopping=early_stopping,
+                patience=10,
+                verbose=False,
+                logger=logger,
+                **kwargs,
+            )
+            return estimator, log
+
+        # Uninterrupted training
+        estimator, log = train(seed=0, logger=PandasLogger())
+
+        # Interrupted in the third epoch (6 iterations per epoch)
+        for checkpoint_every in [None, 4]:
+            with pytest.raises(_Interrupted):
+                train(
+                    seed=0,
+                    logger=_InterruptingLogger(interrupt_at=15),
+                    checkpoint_path=checkpoint_path,
+                    checkpoint_every=checkpoint_every,
+                )
+
+            # And resumed starting from different weights
+            resumed_estimator, resumed_log = train(
+                seed=1,
+                logger=PandasLogger(),
+                checkpoint_path=checkpoint_path,
+                checkpoint_every=checkpoint_every,
+                resume_from=checkpoint_path,
+            )
+
+            if estimator_name == "mine":
+                assert torch.equal(
+                    resumed_estimator._train_baseline.ema,
+                    estimator._train_baseline.ema,
+                )
+            if estimator_name == "infonce":
+                assert resumed_estimator.proposal._pointer == (
+                    estimator.proposal._pointer
+                )
+                assert torch.equal(
+                    resumed_estimator.proposal._memory,
+                    estimator.proposal._memory,
+                )
+            for param, resumed_param in zip(
+                estimator.parameters(), resumed_estimator.parameters()
+            ):
+                assert torch.equal(param, resumed_param)
+            pd.testing.assert_frame_equal(log, resumed_log)
+
+
+def test_load_previous_state_dict():
+    estimator = instantiate_estimator(
+        estimator_name="mine", x_dim=2, y_dim=2, hidden_dims=[16]
+    )
+
+    # State dicts saved before the moving average was stored
+    state_dict = estimator.state_dict()
+    for key in list(state_dict.keys()):
+        if key.endswith("_extra_state"):
+            del state_dict[key]
+    for metadata in state_dict._metadata.values():
+        metadata.pop("version", None)
+
+    estimator.load_state_dict(state_dict)
+    assert estimator._train_baseline.ema is None
+
+
+def test_ensemble():
+    x = torch.randn(64, 2)
+    y = x + torch.randn(64, 2)
+    loader = DataLoader(SampleDataset({"x": x, "y": y}), batch_size=16)
+
+    for estimator_name in ["nwj", "smile", "js"]:
+        replicas = []
+        for seed in range(3):
+            torch.manual_seed(seed)
+            replicas.append(
+                instantiate_estimator(
+                    estimator_name=estimator_name,
+                    x_dim=2,
+                    y_dim=2,
+                    hidden_dims=[16],
+                )
+            )
+        copies = [deepcopy(replica) for replica in replicas]
+
+        train_ensemble(
+            replicas, train_data=loader, max_epochs=2, verbose=False
+        )
+
+        # Train each copy independently on the same batches
+        for replica, estimator in zip(replicas, copies):
+            opt = torch.optim.Adam(estimator.parameters(), lr=5e-4)
+            for _ in range(2):
+                for samples in loader:
+                    opt.zero_grad()
+                    with estimator.step_cache():
+                        estimator.loss(**samples).backward()
+                    opt.step()
+
+            for param, replica_param in zip(
+                estimator.parameters(), replica.parameters()
+            ):
+                assert torch.allclose(param, replica_param, atol=1e-6)
+
+    mean, std, mi_values = estimate_mi_ensemble(
+        data=(x, y),
+        estimator="smile",
+        n_replicas=4,
+        seed=0,
+        max_iterations=10,
+        hidden_dims=[16],
+        verbose=False,
+    )
+    assert mi_values.shape == (4,)
+    assert mean == pytest.approx(mi_values.mean())
+    assert std > 0
+
+    # Estimators with running statistics are not supported
+    with pytest.raises(ValueError):
+        train_ensemble(
+            [
+                instantiate_estimator(
+                    "mine", x_dim=2, y_dim=2, hidden_dims=[16]
+                )
+            ],
+            train_data=loader,
+            max_epochs=1,
+        )
+
+
+class _Stream(IterableDataset):
+    def __init__(self, x: torch.Tensor, y: torch.Tensor):
+        self.x, self.y = x, y
+
+    def __iter__(self):
+        for i in range(len(self.x)):
+            yield {"x": self.x[i], "y": self.y[i]}
+
+
+def test_stream_training():
+    x = torch.randn(200, 2)
+    y = x + torch.randn(200, 2)
+
+    # 180 training entries, 12 batches per pass
+    estimator = instantiate_estimator(
+        estimator_name="js", x_dim=2, y_dim=2, hidden_dims=[16]
+    )
+    log = train_mi_estimator(
+        estimator=estimator,
+        train_data=_Stream(x, y),
+        batch_size=16,
+        max_iterations=30,
+        valid_every=10,
+        early_stopping=True,
+        patience=10,
+        verbose=False,
+    )
+    valid_log = log[log["split"] == "valid"]
+    assert list(valid_log["iteration"].unique()) == [10, 20, 30]
+    assert log["iteration"].max() == 30
+
+    # The duration must be specified in iterations
+    with pytest.raises(ValueError):
+        train_mi_estimator(
+            estimator=estimator,
+            train_data=_Stream(x, y),
+            batch_size=16,
+            max_epochs=2,
+            verbose=False,
+        )
+
+    mean, _, _ = estimate_mi_ensemble(
+        data=_Stream(x, y),
+        estimator="js",
+        n_replicas=2,
+        max_iterations=5,
+        hidden_dims=[16],
+        verbose=False,
+    )
+    assert np.isfinite(mean)
+
+
+def test_uneven_grad_accumulation():
+    class Regression(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.w = nn.Parameter(torch.zeros(2, 2))
+
+        def loss(self, x, y):
+            return ((x @ self.w - y) ** 2).mean()
+
+    x = torch.randn(40, 2)
+    y = x + torch.randn(40, 2)
+
+    # Reference: gradient of the loss on the full batch
+    model = Regression()
+    model.loss(x, y).backward()
+    expected = -model.w.grad.clone()
+
+    # Micro-batches of 16, 16 and 8 entries accumulated in one update
+    model = Regression()
+    train_epoch(
+        model=model,
+        train_loader=DataLoader(SampleDataset({"x": x, "y": y}), 16),
+        opt=torch.optim.SGD(model.parameters(), lr=1.0),
+        device="cpu",
+        logger=DummyLogger(),
+        train_logged_methods=[],
+        eval_logged_methods=[],
+        grad_accumulation_steps=3,
+    )
+    assert torch.allclose(model.w.detach(), expected, atol=1e-6)